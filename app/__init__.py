@@ -2,14 +2,31 @@ import os
 from flask import Flask
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+from werkzeug.middleware.proxy_fix import ProxyFix
 from .db import db
+from .database import replicas
+from .metrics import metrics
+from .instrumentation import instrumentation
+from . import serializers
 from .config import Config
+from .cache import response_cache
+from .hashing import password_hasher
+from .identity import identity
+from .storage import storage
+from .timeline import calendar
+from .search import search_index
+from .ratelimit import rate_limiter, admission_gate
+from .jobs import jobs
+from .sync import sync_cli
 
 jwt = JWTManager()
 
-def create_app():
+def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
+    serializers.init_app(app)
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
 
     # Corrected CORS configuration: Dictionary with resource paths as keys
     CORS(app, resources={
@@ -18,7 +35,9 @@ def create_app():
     },
     supports_credentials=True,
     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"])
+    allow_headers=["Content-Type", "Authorization"],
+    expose_headers=["X-Next-Cursor", "Link", "ETag", "Retry-After",
+                    "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy"])
 
     # Configure file upload settings
     upload_folder = os.path.join(app.root_path, 'static/uploads')
@@ -28,13 +47,26 @@ def create_app():
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limit upload size to 16MB
     
     # Initialize extensions
+    replicas.init_app(app)  # Engine and replica settings, before db.init_app
     db.init_app(app)
+    metrics.init_app(app)
+    instrumentation.init_app(app)  # First request hook, so rejected requests are timed too
+    rate_limiter.init_app(app)  # Before the gate, so throttled requests never take a slot
+    admission_gate.init_app(app)
     jwt.init_app(app)
+    response_cache.init_app(app)
+    password_hasher.init_app(app)
+    identity.init_app(app, jwt)
+    storage.init_app(app)
+    calendar.init_app(app)
+    search_index.init_app(app)
+    jobs.init_app(app)
     
     # Register blueprints
     from .routes import api_bp
     from .auth import auth_bp
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.cli.add_command(sync_cli)
 
     return app
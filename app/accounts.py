@@ -0,0 +1,72 @@
+from flask import current_app
+from sqlalchemy import select, delete, update
+from .db import db
+from .jobs import jobs
+from .storage import storage
+from app.models import User, Task, Event, EventException, Tombstone, Job, Upload
+
+# Tables holding a user's rows, deleted in this order before the user
+USER_TABLES = (('events', Event), ('tasks', Task), ('tombstones', Tombstone))
+
+
+def _save_progress(job_id, progress):
+    # A plain UPDATE, so the expired Job is not reloaded after every chunk
+    db.session.execute(update(Job).where(Job.id == job_id).values(progress=dict(progress)))
+
+
+def _delete_chunks(job_id, progress, name, model, user_id, chunk_size):
+    while True:
+        ids = db.session.execute(
+            select(model.id).where(model.user_id == user_id).limit(chunk_size)
+        ).scalars().all()
+        if not ids:
+            return
+        if model is Event:
+            db.session.execute(delete(EventException).where(EventException.event_id.in_(ids)),
+                               execution_options={'synchronize_session': False})
+        db.session.execute(delete(model).where(model.id.in_(ids)), execution_options={'synchronize_session': False})
+        progress[name] = progress.get(name, 0) + len(ids)
+        _save_progress(job_id, progress)
+        db.session.commit()
+
+
+def _delete_uploads(job_id, progress, user_id, chunk_size):
+    while True:
+        rows = db.session.execute(
+            select(Upload.id, Upload.path).where(Upload.user_id == user_id).limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        db.session.execute(delete(Upload).where(Upload.id.in_([row.id for row in rows])),
+                           execution_options={'synchronize_session': False})
+        # Files go before the commit, while the locks keep new uploads of them waiting
+        removed = sum(storage.delete_unreferenced(path) for path in {row.path for row in rows})
+        progress['uploads'] = progress.get('uploads', 0) + len(rows)
+        progress['files'] = progress.get('files', 0) + removed
+        _save_progress(job_id, progress)
+        db.session.commit()
+
+
+@jobs.handler('delete_account')
+def delete_account(job, user_id):
+    """Delete a user's rows and uploaded files, then the user.
+
+    Rows go ACCOUNT_DELETE_CHUNK_SIZE at a time, each chunk in its own short
+    transaction committed together with the job's progress, so a retried job
+    resumes where it stopped. ON DELETE CASCADE would remove them with the
+    user, but in one transaction as long as the account is large; chunking
+    also covers SQLite, which does not enforce foreign keys by default.
+
+    Uploads are content-addressed, so a file (and its thumbnails) is only
+    removed when no other upload or profile picture refers to it.
+    """
+    chunk_size = current_app.config['ACCOUNT_DELETE_CHUNK_SIZE']
+    job_id, progress = job.id, dict(job.progress)
+    for name, model in USER_TABLES:
+        _delete_chunks(job_id, progress, name, model, user_id, chunk_size)
+    _delete_uploads(job_id, progress, user_id, chunk_size)
+
+    db.session.execute(delete(User).where(User.id == user_id))
+    progress['user'] = True
+    _save_progress(job_id, progress)
+    db.session.commit()
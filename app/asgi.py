@@ -0,0 +1,409 @@
+"""ASGI serving mode: the hot reads on the event loop, everything else on threads.
+
+GET /api/tasks and GET /api/tasks/<id> are served by async views that query
+through an async SQLAlchemy engine (aiomysql for MySQL, aiosqlite for SQLite),
+so a worker keeps thousands of such requests in flight while they wait on the
+database. GET /api/timeline is answered on the loop from the in-process month
+buckets when they are current; a bucket or series that needs (re)loading is
+read through the sync session on a thread, as the calendar's loaders and
+their bookkeeping are shared with the WSGI view. These views reuse the Flask app's URL map, request hooks (rate limits,
+metrics, CORS), token checks, response cache and ETags, task_list_query and
+the serializers, so responses are identical to the WSGI views. Every other
+route runs unchanged through asgiref's WSGI adapter on a thread pool.
+
+Serve with any ASGI server, e.g.
+
+    uvicorn asgi:app --workers 4 --host 0.0.0.0 --port 8000
+
+Sizing, per worker process:
+
+- Workers: one per CPU core. The event loop runs on one core and the JSON
+  encoding, token checks and routing it does are CPU work.
+- Async pool: the event-loop views hold a connection only while a query
+  runs, so by Little's law they need about requests/s x queries per request
+  x query time, e.g. 2000/s x 2 x 2 ms = 8. DB_POOL_SIZE and DB_MAX_OVERFLOW
+  size this pool as well as the sync one.
+- Threads: ASGI_WSGI_THREADS run the other views, each holding at most one
+  sync connection, so it defaults to DB_POOL_SIZE + DB_MAX_OVERFLOW. At most
+  ADMISSION_MAX_QUEUE more requests wait for a thread; the rest are shed
+  with 503 (the admission gate only applies to these threads).
+- Database: workers x (async pool + sync pool) x (1 + replicas) connections
+  at most, which must stay below the server's max_connections.
+
+The request hooks (rate limits) and token checks of the event-loop views run
+on the loop's default thread pool, since a denylist or rate limit check can be
+a Redis round trip and a user lookup missing the identity cache (once per
+IDENTITY_CACHE_TTL per user) queries through the sync session. So does the
+request's teardown, which hands that session's connection back to the pool,
+and, with the Redis backend, response cache loads and stores. The in-process
+cache backend is a dict lookup and stays on the loop.
+"""
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from io import BytesIO
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from flask import request, g, current_app, jsonify, request_started
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from sqlalchemy import exc, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+from app.cache import response_cache
+from app.database import replicas, engine_options, InstrumentedAsyncQueuePool, REPLICA_READS
+from app.db import db
+from app.models import Task
+from app.queries import task_list_query
+from app.ratelimit import ADMISSION_REJECTED
+from app.routes import task_page
+from app.serializers import serialize_task, stream_json_array
+from app.sync import version_query, version_etag
+from app.timeline import calendar, timeline_window
+
+logger = logging.getLogger(__name__)
+
+# Set in the WSGI environ of requests served on the event loop
+EVENT_LOOP_ENVIRON_KEY = 'app.event_loop'
+
+# Async driver used in place of each sync driver
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+    'mysql+mysqldb': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+}
+
+
+def async_url(url):
+    """The async driver counterpart of a sync database URL."""
+    url = make_url(url)
+    if url.drivername not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver known for {url.drivername}, set ASYNC_DATABASE_URL')
+    return url.set(drivername=ASYNC_DRIVERS[url.drivername])
+
+
+class AsyncDatabase:
+    """Async engines for the primary and each read replica.
+
+    Replica selection follows Replicas.choose: a replica serves a user only
+    when its copy of the user's change version has caught up with the
+    primary's, and not while the user is pinned to the primary after a write.
+    Note that in-memory SQLite gives the async engine a database of its own.
+    """
+
+    def __init__(self):
+        self.primary = None
+        self.replicas = ()
+        self._round_robin = itertools.count()
+
+    def init_app(self, app):
+        config = app.config
+        url = config['ASYNC_DATABASE_URL'] or async_url(config['SQLALCHEMY_DATABASE_URI'])
+        self.primary = self._create_engine(config, url, 'async_primary')
+        self.replicas = tuple(
+            self._create_engine(config, async_url(replica_url), f'async_replica_{index}')
+            for index, replica_url in enumerate(config['DATABASE_REPLICA_URLS'])
+        )
+        app.extensions['async_database'] = self
+
+    @staticmethod
+    def _create_engine(config, url, name):
+        return create_async_engine(url, **engine_options(config, url, name, InstrumentedAsyncQueuePool))
+
+    def engines(self):
+        return (self.primary,) + self.replicas
+
+    async def scalar(self, engine, statement):
+        async with engine.connect() as connection:
+            return await connection.scalar(statement)
+
+    async def current_version(self, user_id):
+        return await self.scalar(self.primary, version_query(user_id)) or 0
+
+    async def reader(self, user_id, version):
+        """Return a replica engine caught up with version, or the primary."""
+        if not self.replicas:
+            return self.primary
+        engine = self.primary
+        if not replicas.sticky.get(user_id):
+            replica = self.replicas[next(self._round_robin) % len(self.replicas)]
+            try:
+                if (await self.scalar(replica, version_query(user_id)) or 0) >= version:
+                    engine = replica
+            except exc.DBAPIError:
+                logger.warning('Replica %s unavailable, reading from the primary', replica.url, exc_info=True)
+        REPLICA_READS.inc('replica' if engine is not self.primary else 'primary')
+        return engine
+
+    async def dispose(self):
+        for engine in self.engines():
+            await engine.dispose()
+
+
+async_database = AsyncDatabase()
+
+# endpoint -> async view replacing the blueprint's view of that endpoint
+_views = {}
+
+
+def _blocking(fn):
+    """fn run off the event loop, on the loop's default executor.
+
+    For request hooks and token checks, which may query the sync session
+    (user lookups) or make Redis round trips (denylist, rate limits).
+    """
+    return sync_to_async(fn, thread_sensitive=False)
+
+
+async def _cache_load(user_id, key):
+    if getattr(response_cache.backend, 'blocking', True):
+        return await _blocking(response_cache.load)(user_id, key)
+    return response_cache.load(user_id, key)
+
+
+async def _cache_store(user_id, key, response):
+    if getattr(response_cache.backend, 'blocking', True):
+        # A streamed body would be stored as the loop sends its last chunk, so
+        # it is buffered here; event-loop views have their rows in hand anyway
+        response.get_data()
+        await _blocking(response_cache.store)(user_id, key, response)
+    else:
+        response_cache.store(user_id, key, response)
+
+
+def user_read(endpoint, namespace, etag=True, reader=True):
+    """Register an async view for a user-scoped, cached GET endpoint.
+
+    The counterpart of jwt_required, read_replica, versioned_etag (unless
+    etag is False) and response_cache.cached on the WSGI view. The view is
+    called as view(user_id, engine, **url_args) with the engine to read from,
+    or None if reader is False (views that do not query the async engines).
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(**kwargs):
+            await _blocking(verify_jwt_in_request)()
+            user_id = get_jwt_identity()['id']
+            version = g.change_version = await async_database.current_version(user_id)
+            # Where request_version looks, for code run through _blocking
+            request.environ['app.change_version'] = version
+            tag = version_etag(user_id, version) if etag else None
+            if tag is not None and request.if_none_match.contains_weak(tag):
+                response = current_app.response_class(status=304)
+            else:
+                key = response_cache.key(namespace, user_id, version)
+                response = await _cache_load(user_id, key)
+                if response is None:
+                    engine = await async_database.reader(user_id, version) if reader else None
+                    response = current_app.make_response(await view(user_id, engine, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    await _cache_store(user_id, key, response)
+            if tag is not None:
+                response.set_etag(tag, weak=True)
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        _views[endpoint] = wrapper
+        return wrapper
+    return decorator
+
+
+@user_read('api.get_tasks', 'tasks')
+async def get_tasks(user_id, engine):
+    try:
+        stmt, limit, fields = task_list_query(
+            user_id,
+            request.args,
+            default_limit=current_app.config['TASKS_PAGE_DEFAULT_LIMIT'],
+            max_limit=current_app.config['TASKS_PAGE_MAX_LIMIT'],
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    async with engine.connect() as connection:
+        rows = (await connection.execute(stmt)).all()
+    return task_page(rows, limit, fields)
+
+
+_task_columns = [getattr(Task, field) for field in serialize_task.fields] + [Task.user_id]
+
+
+@user_read('api.get_task', 'task', etag=False)
+async def get_task(user_id, engine, task_id):
+    async with engine.connect() as connection:
+        task = (await connection.execute(select(*_task_columns).where(Task.id == task_id))).first()
+    if task and task.user_id == user_id:
+        return jsonify(serialize_task(task)), 200
+    return jsonify(message="Task not found"), 404
+
+
+def _load_timeline(user_id, start, end, version):
+    # What read_replica does for the WSGI view, for the calendar's sync loaders
+    replica = replicas.choose(user_id)
+    if replicas.bind_keys:
+        REPLICA_READS.inc('replica' if replica is not None else 'primary')
+    g.db_replica = replica
+    return calendar.events_between(user_id, start, end, version)
+
+
+@user_read('api.get_timeline_events', 'timeline', reader=False)
+async def get_timeline(user_id, engine):
+    try:
+        start, end = timeline_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    version = g.change_version
+    events = calendar.loaded_events_between(user_id, start, end, version)
+    if events is None:
+        events = await _blocking(_load_timeline)(user_id, start, end, version)
+    return stream_json_array(events)
+
+
+async def _server_busy():
+    ADMISSION_REJECTED.inc('queue_full')
+    return jsonify(message="Server busy, please retry"), 503, {'Retry-After': '1'}
+
+
+class _WsgiRequest(WsgiToAsgiInstance):
+    """asgiref's WSGI adapter for one request, run on the app's thread pool.
+
+    asgiref runs every request on one shared thread and never closes the
+    response iterable; this runs them in parallel and closes it in the same
+    thread, so Flask's close callbacks (e.g. send_file's) run.
+    """
+
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self._executor = executor
+
+    def _run(self, body):
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:  # Too many duplicate headers
+            self.sync_send({'type': 'http.response.start', 'status': 400,
+                            'headers': [(b'content-type', b'text/plain')]})
+            self.sync_send({'type': 'http.response.body', 'body': b'Bad Request'})
+            return
+        result = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in result:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+            if not self.response_started:
+                self.response_started = True
+                self.sync_send(self.response_start)
+            self.sync_send({'type': 'http.response.body'})
+        finally:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._run, thread_sensitive=False, executor=self._executor)(body)
+
+
+class AsgiApp:
+    """ASGI application serving a Flask app created by create_app."""
+
+    def __init__(self, app):
+        self.app = app
+        self.urls = app.url_map.bind('localhost')
+        threads = app.config['ASGI_WSGI_THREADS']
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+        self.max_threaded = threads + app.config['ADMISSION_MAX_QUEUE']
+        self.threaded = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] == 'http':
+            if scope['method'] == 'GET':
+                view, args = self._match(scope)
+                if view is not None:
+                    return await self._serve(view, args, scope, send)
+            if self.threaded >= self.max_threaded:
+                return await self._serve(_server_busy, {}, scope, send)
+        self.threaded += 1
+        try:
+            await _WsgiRequest(self.app, self.executor)(scope, receive, send)
+        finally:
+            self.threaded -= 1
+
+    def _match(self, scope):
+        path = scope['path'][len(scope.get('root_path', '')):]
+        try:
+            endpoint, args = self.urls.match(path, 'GET')
+        except HTTPException:  # 404, 405 and redirects are left to Flask
+            return None, None
+        return _views.get(endpoint), args
+
+    async def _serve(self, view, args, scope, send):
+        adapter = _WsgiRequest(self.app, self.executor)
+        adapter.scope = scope
+        environ = adapter.build_environ(scope, BytesIO())
+        environ[EVENT_LOOP_ENVIRON_KEY] = True
+        ctx = self.app.request_context(environ)
+        error = None
+        try:
+            try:
+                ctx.push()
+                response = await self._dispatch(view, args)
+            except Exception as e:
+                error = e
+                response = self.app.handle_exception(e)
+            body, status, headers = response.get_wsgi_response(environ)
+            await send({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+            })
+            try:
+                for chunk in body:
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                close = getattr(body, 'close', None)
+                if close is not None:
+                    close()
+            await send({'type': 'http.response.body'})
+        finally:
+            try:
+                # Returns a connection the token check or a load checked out;
+                # the teardown in ctx.pop then finds nothing left to do
+                await _blocking(db.session.remove)()
+            finally:
+                ctx.pop(error)
+
+    async def _dispatch(self, view, args):
+        """Flask's full_dispatch_request, awaiting view instead of the blueprint's view."""
+        try:
+            request_started.send(self.app)
+            response = await _blocking(self.app.preprocess_request)()
+            if response is None:
+                response = await view(**args)
+        except Exception as e:
+            response = self.app.handle_user_exception(e)
+        return self.app.finalize_request(response)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_database.dispose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(app):
+    """Wrap a Flask app from create_app for an ASGI server."""
+    async_database.init_app(app)
+    return AsgiApp(app)
@@ -1,18 +1,25 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, url_for
 from flask_jwt_extended import (
     jwt_required,
+    get_jwt,
     get_jwt_identity,
     create_access_token,
     create_refresh_token,
+    decode_token,
 )
 import jwt
 from flask_cors import CORS
-from datetime import timedelta
-from werkzeug.security import generate_password_hash
-from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta
 from .models import User
 from .db import db
-import os
+from .cache import response_cache
+from .hashing import password_hasher, HasherBusy
+from .identity import identity
+from .storage import storage, request_upload, UploadError
+from .jobs import jobs
+from .timeline import calendar
+from .search import search_index
+from . import accounts  # Registers the delete_account job
 
 auth_bp = Blueprint('auth', __name__)
 CORS(auth_bp, supports_credentials=True, resources={r"/*": {"origins": "http://localhost:8080"}})
@@ -20,9 +27,22 @@ CORS(auth_bp, supports_credentials=True, resources={r"/*": {"origins": "http://l
 @auth_bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
-    user = User.query.filter_by(email=data['email']).first()
-    
-    if user and user.check_password(data['password']):
+    user = User.query.filter_by(email=data['email'], deleted_at=None).first()
+
+    try:
+        valid = user is not None and password_hasher.verify(user.password, data['password'])
+    except HasherBusy:
+        return jsonify(message="Server busy, please retry"), 503, {'Retry-After': '1'}
+
+    if valid:
+        # Upgrade hashes made with older parameters while we have the plaintext
+        if password_hasher.needs_rehash(user.password):
+            try:
+                user.password = password_hasher.hash(data['password'])
+                db.session.commit()
+            except HasherBusy:
+                pass  # Retried on the next login
+
         # Generate access and refresh tokens
         access_token = create_access_token(identity={'id': user.id}, expires_delta=timedelta(minutes=15))
         refresh_token = create_refresh_token(identity={'id': user.id}, expires_delta=timedelta(days=7))  # Fixed: removed comma
@@ -40,7 +60,10 @@ def register():
     if not data or not data.get('username') or not data.get('email') or not data.get('password'):
         return jsonify({"message": "Missing required fields"}), 400
 
-    hashed_password = generate_password_hash(data['password'])
+    try:
+        hashed_password = password_hasher.hash(data['password'])
+    except HasherBusy:
+        return jsonify({"message": "Server busy, please retry"}), 503, {'Retry-After': '1'}
     
     new_user = User(
         username=data['username'],
@@ -58,23 +81,29 @@ def register():
 def upload_profile_picture():
     user_id = get_jwt_identity()['id']
     
-    if 'file' not in request.files:
+    source = request_upload(request, 'file')
+    if source is None:
         return jsonify({"message": "No file part"}), 400
 
-    file = request.files['file']
-    if file.filename == '':
+    stream, filename, content_type = source
+    if filename == '':
         return jsonify({"message": "No file selected"}), 400
 
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-    
-    file.save(filepath)
+    try:
+        stored = storage.save_stream(stream, filename, content_type, user_id=user_id)
+    except UploadError as e:
+        return jsonify({"message": e.message}), e.status
 
     user = User.query.get(user_id)
-    user.profile_picture = filepath
+    user.profile_picture = stored.path
     db.session.commit()
+    identity.invalidate_user(user_id)
 
-    return jsonify({"message": "Profile picture uploaded", "file_path": filepath}), 200
+    return jsonify({
+        "message": "Profile picture uploaded",
+        "file_path": stored.path,
+        "url": url_for('api.get_media', path=stored.path, _external=True)
+    }), 200
 
 @auth_bp.route('/update', methods=['PUT'])
 @jwt_required()
@@ -90,8 +119,42 @@ def update_user():
         user.email = data['email']
 
     db.session.commit()
+    identity.invalidate_user(user_id)
     return jsonify({"message": "User information updated"}), 200
 
+@auth_bp.route('/password', methods=['PUT'])
+@jwt_required()
+def change_password():
+    user_id = get_jwt_identity()['id']
+    data = request.get_json()
+
+    if not data or not data.get('current_password') or not data.get('new_password'):
+        return jsonify({"message": "Missing required fields"}), 400
+
+    user = User.query.get(user_id)
+
+    try:
+        if not password_hasher.verify(user.password, data['current_password']):
+            return jsonify({"message": "Invalid credentials"}), 401
+        user.password = password_hasher.hash(data['new_password'])
+    except HasherBusy:
+        return jsonify({"message": "Server busy, please retry"}), 503, {'Retry-After': '1'}
+
+    db.session.commit()
+
+    # Sign out every other session, then hand this client fresh tokens
+    identity.revoke_all_tokens(user_id)
+    return jsonify({
+        'access_token': create_access_token(identity={'id': user_id}, expires_delta=timedelta(minutes=15)),
+        'refresh_token': create_refresh_token(identity={'id': user_id}, expires_delta=timedelta(days=7))
+    }), 200
+
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    identity.revoke_token(get_jwt())
+    return jsonify({"message": "Logged out"}), 200
+
 @auth_bp.route('/delete', methods=['DELETE'])
 @jwt_required()
 def delete_account():
@@ -99,10 +162,22 @@ def delete_account():
 
     user = User.query.get(user_id)
 
-    db.session.delete(user)
+    # Large accounts take a while, so the rows are deleted by a background job.
+    # The account stops working now: it can no longer log in or use its tokens.
+    user.deleted_at = datetime.utcnow()
+    job = jobs.enqueue('delete_account', {'user_id': user_id}, user_id=user_id)
     db.session.commit()
-
-    return jsonify({"message": "Account deleted"}), 200
+    identity.revoke_all_tokens(user_id)
+    response_cache.invalidate_user(user_id)
+    calendar.invalidate_user(user_id)
+    search_index.invalidate_user(user_id)
+    jobs.notify()
+
+    # The account's tokens no longer work, so the status URL carries its own
+    status_url = url_for('api.get_job', job_id=job.id, token=jobs.status_token(job.id), _external=True)
+    response = jsonify({"message": "Account deletion started", "job_id": job.id, "status_url": status_url})
+    response.headers['Location'] = status_url
+    return response, 202
 
 @auth_bp.route('/refresh', methods=['POST'])
 def refresh_token():
@@ -113,10 +188,15 @@ def refresh_token():
         return jsonify({'error': 'Missing refresh token'}), 400
 
     try:
-        payload = jwt.decode(refresh_token, current_app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
+        # Same verification settings as every other protected route
+        payload = decode_token(refresh_token)
+        if payload.get('type') != 'refresh' or identity.is_revoked(payload):
+            return jsonify({'error': 'Invalid refresh token'}), 401
+        if identity.load_user(payload['sub']['id']) is None:
+            return jsonify({'error': 'Invalid refresh token'}), 401
 
         # Create a new access token
-        new_access_token = create_access_token(identity={'id': payload['identity']['id']})
+        new_access_token = create_access_token(identity={'id': payload['sub']['id']})
 
         return jsonify({'new_access_token': new_access_token}), 200
     except jwt.ExpiredSignatureError:
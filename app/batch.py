@@ -0,0 +1,126 @@
+from sqlalchemy import select, insert, update, delete
+from .db import db
+from app.models import Task
+from app.sync import record_bulk_changes, record_bulk_inserts
+
+TASK_BATCH_OPS = ('create', 'update', 'delete')
+
+
+def validate_task_values(op, require_title):
+    """Return the writable task columns from a batch operation or import record, or an error message."""
+    values = {}
+    if 'title' in op or require_title:
+        title = op.get('title')
+        if not isinstance(title, str) or not title or len(title) > 255:
+            return None, 'title must be a non-empty string of at most 255 characters'
+        values['title'] = title
+    if 'completed' in op:
+        if not isinstance(op['completed'], bool):
+            return None, 'completed must be a boolean'
+        values['completed'] = op['completed']
+    return values, None
+
+
+def _is_id(value):
+    # bool is an int subclass, but True is not task 1
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _insert_tasks(user_id, rows, version):
+    """Insert task rows in one statement and return their ids in row order."""
+    # A multi-row INSERT hands out ascending ids in row order, but RETURNING
+    # may list them in any order (sort_by_parameter_order would fall back to
+    # one INSERT per row where the id cannot serve as its sentinel, e.g. SQLite)
+    if db.session.get_bind().dialect.insert_executemany_returning:
+        return sorted(db.session.scalars(insert(Task).returning(Task.id), rows))
+    # No RETURNING (MySQL): the batch's fresh version tells its rows apart
+    db.session.execute(insert(Task), rows)
+    return db.session.scalars(
+        select(Task.id).where(Task.user_id == user_id, Task.version == version).order_by(Task.id)
+    ).all()
+
+
+def apply_task_batch(user_id, operations):
+    """Apply a list of create/update/delete task operations in one transaction.
+
+    Ownership of every referenced task is checked with a single IN (...) query.
+    Creates go in as one multi-row INSERT, updates through a bulk UPDATE by
+    primary key and deletes through one DELETE ... WHERE id IN (...), all
+    stamped with one change version, then the session is committed once.
+    Operations on the same task are applied in request order: repeated
+    updates are merged and anything after a delete gets a 404.
+
+    Returns one result dict per operation, in the order they were given. Invalid
+    operations are reported in their result and do not abort the others.
+    """
+    results = [None] * len(operations)
+
+    referenced_ids = {
+        op['id'] for op in operations
+        if isinstance(op, dict) and op.get('op') in ('update', 'delete') and _is_id(op.get('id'))
+    }
+    owned_ids = set()
+    if referenced_ids:
+        owned_ids = set(db.session.scalars(
+            select(Task.id).where(Task.user_id == user_id, Task.id.in_(referenced_ids))
+        ))
+
+    creates = []
+    updates = {}
+    deleted_ids = set()
+
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict) or op.get('op') not in TASK_BATCH_OPS:
+            results[index] = {'status': 400, 'error': f"op must be one of {', '.join(TASK_BATCH_OPS)}"}
+            continue
+
+        if op['op'] == 'create':
+            values, error = validate_task_values(op, require_title=True)
+            if error:
+                results[index] = {'status': 400, 'error': error}
+                continue
+            creates.append((index, {'user_id': user_id, 'completed': values.pop('completed', False), **values}))
+            continue
+
+        task_id = op.get('id')
+        if not _is_id(task_id):
+            results[index] = {'status': 400, 'error': 'id must be an integer'}
+            continue
+        if task_id not in owned_ids or task_id in deleted_ids:
+            results[index] = {'id': task_id, 'status': 404, 'error': 'Task not found or unauthorized'}
+            continue
+
+        if op['op'] == 'update':
+            values, error = validate_task_values(op, require_title=False)
+            if error:
+                results[index] = {'id': task_id, 'status': 400, 'error': error}
+                continue
+            updates.setdefault(task_id, {'id': task_id}).update(values)
+        else:
+            deleted_ids.add(task_id)
+            updates.pop(task_id, None)
+        results[index] = {'id': task_id, 'status': 200}
+
+    create_rows = [row for _, row in creates]
+    update_rows = [row for row in updates.values() if len(row) > 1]
+    if create_rows or update_rows or deleted_ids:
+        version = record_bulk_changes(db.session, 'task', user_id, update_rows, deleted_ids, create_rows)
+
+    # Before the updates, which stamp existing rows with the same version
+    if create_rows:
+        ids = _insert_tasks(user_id, create_rows, version)
+        for (index, row), task_id in zip(creates, ids):
+            row['id'] = task_id
+            results[index] = {'id': task_id, 'status': 201}
+        record_bulk_inserts(db.session, 'task', user_id, create_rows, version)
+
+    if update_rows:
+        db.session.execute(update(Task), update_rows)
+
+    if deleted_ids:
+        db.session.execute(
+            delete(Task).where(Task.id.in_(deleted_ids)).execution_options(synchronize_session=False)
+        )
+
+    db.session.commit()
+    return results
@@ -0,0 +1,281 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, current_app
+from flask_jwt_extended import get_jwt_identity
+from app.sync import on_commit, request_version
+from app.metrics import metrics
+
+
+class MemoryBackend:
+    """In-process LRU cache with per-entry TTL.
+
+    Bounded both by entry count and by the total size of the stored values;
+    whichever limit is hit first evicts the least recently used entries.
+    Keys are grouped by user so a user's entries can be dropped together.
+    """
+
+    # Whether get and set wait on I/O, which the ASGI event loop must not do
+    blocking = False
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (user_id, value, expires_at)
+        self._user_keys = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def _remove(self, key):
+        user_id, value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+    def get(self, user_id, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (user_id, value, time.monotonic() + ttl)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class RedisBackend:
+    """Cache backed by a redis-py compatible client (or a fake such as fakeredis).
+
+    Each user's keys are tracked in a Redis set so invalidation removes exactly
+    that user's entries. Size is bounded by the TTL and Redis' own maxmemory
+    policy; the value size cap stops a single huge payload being stored.
+    """
+
+    blocking = True
+
+    def __init__(self, client, prefix='resp:', max_value_bytes=1024 * 1024):
+        self.client = client
+        self.prefix = prefix
+        self.max_value_bytes = max_value_bytes
+        self.hits = self.misses = 0
+
+    def _user_set(self, user_id):
+        return f'{self.prefix}user:{user_id}'
+
+    def get(self, user_id, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, user_id, key, value, ttl):
+        if len(value) > self.max_value_bytes:
+            return
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, value, ex=ttl)
+        pipe.sadd(self._user_set(user_id), self.prefix + key)
+        pipe.expire(self._user_set(user_id), ttl)
+        pipe.execute()
+
+    def invalidate_user(self, user_id):
+        keys = self.client.smembers(self._user_set(user_id))
+        if keys:
+            self.client.delete(*keys)
+        self.client.delete(self._user_set(user_id))
+
+    def stats(self):
+        return {'backend': 'redis', 'hits': self.hits, 'misses': self.misses, 'evictions': 0}
+
+
+class NullBackend:
+    """Disables caching while keeping the same interface."""
+
+    blocking = False
+
+    def get(self, user_id, key):
+        return None
+
+    def set(self, user_id, key, value, ttl):
+        pass
+
+    def invalidate_user(self, user_id):
+        pass
+
+    def stats(self):
+        return {'backend': 'null'}
+
+
+class ResponseCache:
+    """Read-through cache of serialized per-user JSON responses."""
+
+    def __init__(self):
+        self.backend = NullBackend()
+        self.ttl = 60
+        self.max_entry_bytes = 1024 * 1024
+
+    def init_app(self, app, backend=None):
+        self.ttl = app.config['RESPONSE_CACHE_TTL']
+        self.max_entry_bytes = app.config['RESPONSE_CACHE_MAX_ENTRY_BYTES']
+        if backend is None:
+            backend = self._backend_from_config(app.config)
+        self.backend = backend
+        app.extensions['response_cache'] = self
+
+    @staticmethod
+    def _backend_from_config(config):
+        name = config['RESPONSE_CACHE_BACKEND']
+        if name == 'memory':
+            return MemoryBackend(config['RESPONSE_CACHE_MAX_ENTRIES'], config['RESPONSE_CACHE_MAX_BYTES'])
+        if name == 'redis':
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("RESPONSE_CACHE_BACKEND='redis' requires the redis package")
+            return RedisBackend(redis.Redis.from_url(config['RESPONSE_CACHE_REDIS_URL']))
+        if name == 'null':
+            return NullBackend()
+        raise ValueError(f'Unknown RESPONSE_CACHE_BACKEND: {name}')
+
+    def invalidate_user(self, user_id):
+        self.backend.invalidate_user(user_id)
+
+    def stats(self):
+        return self.backend.stats()
+
+    def _store_streamed(self, user_id, key, prefix, chunks):
+        """Pass a streamed body through, storing it once fully sent if it stayed small."""
+        parts, size = [prefix], 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                if parts is not None:
+                    size += len(chunk)
+                    if size > self.max_entry_bytes:
+                        parts = None  # Too large to cache, keep streaming
+                    else:
+                        parts.append(chunk)
+                yield chunk
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+        if parts is not None:
+            self.backend.set(user_id, key, b''.join(parts), self.ttl)
+
+    def key(self, namespace, user_id, version):
+        return f'{namespace}:{user_id}:{version}:{request.full_path}'
+
+    def load(self, user_id, key):
+        """Return the cached response for key, or None."""
+        cached = self.backend.get(user_id, key)
+        if cached is None:
+            return None
+        header_line, body = cached.split(b'\n', 1)
+        response = current_app.response_class(body, mimetype='application/json')
+        response.headers.update(json.loads(header_line))
+        return response
+
+    def store(self, user_id, key, response, headers=('X-Next-Cursor', 'Link')):
+        """Cache a 200 response with the listed headers; streamed bodies are stored once sent."""
+        if response.status_code != 200:
+            return
+        stored_headers = {h: response.headers[h] for h in headers if h in response.headers}
+        prefix = json.dumps(stored_headers).encode() + b'\n'
+        if response.is_streamed:
+            response.response = self._store_streamed(user_id, key, prefix, response.response)
+        else:
+            self.backend.set(user_id, key, prefix + response.get_data(), self.ttl)
+
+    def cached(self, namespace, headers=('X-Next-Cursor', 'Link')):
+        """Cache a user-scoped GET view's 200 responses.
+
+        The key includes the user's change version (reused from versioned_etag
+        when it ran first) and the full request path, so entries written by
+        another worker are never served after a change, even before this
+        worker's invalidation runs. The listed response headers are stored with
+        the body. Must be applied inside jwt_required.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                user_id = get_jwt_identity()['id']
+                version = request_version(user_id)
+                key = self.key(namespace, user_id, version)
+                response = self.load(user_id, key)
+                if response is None:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    self.store(user_id, key, response, headers)
+                return response
+            return wrapper
+        return decorator
+
+
+response_cache = ResponseCache()
+
+
+def _cache_stat(name):
+    def collect():
+        stats = response_cache.stats()
+        if name in stats:
+            yield (), stats[name]
+    return collect
+
+
+metrics.gauge('response_cache_hits_total', 'Response cache hits.', (), _cache_stat('hits'), type='counter')
+metrics.gauge('response_cache_misses_total', 'Response cache misses.', (), _cache_stat('misses'), type='counter')
+metrics.gauge('response_cache_evictions_total', 'Entries evicted to stay within the size limits.', (),
+              _cache_stat('evictions'), type='counter')
+metrics.gauge('response_cache_entries', 'Entries held by the in-process response cache.', (), _cache_stat('entries'))
+metrics.gauge('response_cache_bytes', 'Bytes held by the in-process response cache.', (), _cache_stat('bytes'))
+
+
+@on_commit
+def _invalidate_changed_users(changes):
+    for user_id in {change.user_id for change in changes}:
+        response_cache.invalidate_user(user_id)
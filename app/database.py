@@ -0,0 +1,181 @@
+import itertools
+import logging
+import time
+from functools import wraps
+from flask import g, current_app
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from .db import db
+from .metrics import metrics
+from .identity import TTLCache
+from app.sync import on_commit, request_version, version_query
+
+logger = logging.getLogger(__name__)
+
+POOL_CHECKOUT_SECONDS = metrics.histogram(
+    'db_pool_checkout_seconds', 'Time spent waiting for a pooled connection.', ['pool'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0),
+)
+POOL_CHECKOUT_TIMEOUTS = metrics.counter(
+    'db_pool_checkout_timeouts_total', 'Checkouts that gave up after DB_POOL_TIMEOUT.', ['pool'],
+)
+REPLICA_READS = metrics.counter(
+    'db_replica_reads_total', 'Read-replica routing decisions for replica-eligible requests.', ['target'],
+)
+
+
+class _TimedCheckout:
+    """Pool mixin that records how long each checkout waited for a connection.
+
+    It also keeps the connection limit it was configured with (pool_size plus
+    max_overflow, see engine_options) for the saturation gauge.
+    """
+
+    def __init__(self, creator, pool_size=5, max_overflow=10, **kwargs):
+        super().__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kwargs)
+        self.max_connections = pool_size + max(max_overflow, 0)  # -1 means no overflow limit
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.inc(self.logging_name)
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start, self.logging_name)
+
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def _is_memory_sqlite(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(config, url, name, poolclass=InstrumentedQueuePool):
+    """Pool settings for one engine, from the DB_POOL_* config values.
+
+    In-memory SQLite keeps Flask-SQLAlchemy's single shared connection, so it
+    gets no pool options. Async engines pass InstrumentedAsyncQueuePool.
+    """
+    if _is_memory_sqlite(url):
+        return {}
+    return {
+        'poolclass': poolclass,
+        'pool_logging_name': name,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def _pool_gauge(read):
+    def collect():
+        engines = list(db.engines.values())
+        async_database = current_app.extensions.get('async_database')
+        if async_database is not None:
+            engines.extend(engine.sync_engine for engine in async_database.engines())
+        for engine in engines:
+            if isinstance(engine.pool, _TimedCheckout):
+                yield (engine.pool.logging_name or 'primary',), read(engine.pool)
+    return collect
+
+
+metrics.gauge('db_pool_size', 'Configured pool size.', ['pool'], _pool_gauge(lambda pool: pool.size()))
+metrics.gauge('db_pool_checked_out', 'Connections currently checked out.', ['pool'],
+              _pool_gauge(lambda pool: pool.checkedout()))
+metrics.gauge('db_pool_overflow', 'Overflow connections currently open.', ['pool'],
+              _pool_gauge(lambda pool: max(pool.overflow(), 0)))
+metrics.gauge('db_pool_saturation', 'Checked-out connections over pool_size + max_overflow.', ['pool'],
+              _pool_gauge(lambda pool: pool.checkedout() / max(pool.max_connections, 1)))
+
+
+class Replicas:
+    """Engine configuration and read-replica selection.
+
+    init_app must run before db.init_app: it fills SQLALCHEMY_ENGINE_OPTIONS
+    for the primary and adds one bind per DATABASE_REPLICA_URLS entry.
+
+    A request marked with read_replica uses a replica only when it is caught
+    up with the user: the user's change version is read on the primary (the
+    same lookup versioned_etag needs) and on the replica, and any lag sends
+    the request to the primary. After a commit in this process the user is
+    pinned to the primary for DB_REPLICA_STICKY_SECONDS, which skips the
+    replica probe while the replica is most likely behind.
+    """
+
+    def __init__(self):
+        self.bind_keys = ()
+        self.sticky = TTLCache(ttl=2)
+        self._round_robin = itertools.count()
+
+    def init_app(self, app):
+        config = app.config
+        config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          engine_options(config, config['SQLALCHEMY_DATABASE_URI'], 'primary'))
+        binds = config.setdefault('SQLALCHEMY_BINDS', {})
+        keys = []
+        for index, url in enumerate(config['DATABASE_REPLICA_URLS']):
+            key = f'replica_{index}'
+            binds[key] = dict(engine_options(config, url, key), url=url)
+            keys.append(key)
+        self.bind_keys = tuple(keys)
+        self.sticky = TTLCache(config['DB_REPLICA_STICKY_MAX_USERS'], config['DB_REPLICA_STICKY_SECONDS'])
+        app.extensions['replicas'] = self
+
+    def pin(self, user_id):
+        """Send this user's reads to the primary for the stickiness window."""
+        if self.bind_keys:
+            self.sticky.set(user_id, True)
+
+    def choose(self, user_id):
+        """Return a replica engine caught up with user_id, or None for the primary."""
+        if not self.bind_keys or self.sticky.get(user_id):
+            return None
+        key = self.bind_keys[next(self._round_robin) % len(self.bind_keys)]
+        engine = db.engines[key]
+        version = request_version(user_id)
+        try:
+            replica_version = db.session.execute(version_query(user_id), bind_arguments={'bind': engine}).scalar() or 0
+        except exc.DBAPIError:
+            db.session.rollback()
+            logger.warning('Replica %s unavailable, reading from the primary', key, exc_info=True)
+            return None
+        if replica_version < version:
+            return None
+        return engine
+
+
+replicas = Replicas()
+
+
+@on_commit
+def _pin_writers(changes):
+    for user_id in {change.user_id for change in changes}:
+        replicas.pin(user_id)
+
+
+def read_replica(view):
+    """Let a read-only, user-scoped view run on a read replica.
+
+    Must be applied inside jwt_required and outside versioned_etag.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        replica = replicas.choose(get_jwt_identity()['id'])
+        if replicas.bind_keys:
+            REPLICA_READS.inc('replica' if replica is not None else 'primary')
+        g.db_replica = replica
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,109 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+
+def method_parameters(method):
+    """The method segment werkzeug stores for method, e.g. 'pbkdf2' -> 'pbkdf2:sha256:1000000'.
+
+    generate_password_hash fills in defaults for omitted parameters, so this
+    does the same to compare a configured method with stored hashes.
+    """
+    name, *args = method.split(':')
+    if name == 'pbkdf2' and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    if name == 'scrypt' and len(args) < 3:
+        return ':'.join([name, *args, *('32768', '8', '1')[len(args):]])
+    return method
+
+
+def _costs(parameters):
+    """Split a method segment into (algorithm, work factors as ints)."""
+    name, *args = parameters.split(':')
+    if name == 'pbkdf2':
+        return (name, args[0]), tuple(int(a) for a in args[1:])
+    return (name,), tuple(int(a) for a in args)
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated or a hash did not finish in time."""
+
+
+class PasswordHasher:
+    """Runs password hashing and verification in a process pool.
+
+    PBKDF2 is pure CPU under the GIL, so running it on the request thread
+    stalls every other request on the worker. Work is handed to a pool of
+    PASSWORD_HASH_WORKERS processes; at most PASSWORD_HASH_QUEUE_SIZE further
+    calls may wait for a free process, beyond which HasherBusy is raised
+    immediately so the route can answer 503 instead of queueing. With
+    PASSWORD_HASH_WORKERS = 0 hashing runs inline, which is handy for tests.
+    """
+
+    def __init__(self):
+        self.method = 'pbkdf2'
+        self.workers = 0
+        self.timeout = None
+        self._slots = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(self.workers + app.config['PASSWORD_HASH_QUEUE_SIZE'])
+        app.extensions['password_hasher'] = self
+
+    def _get_executor(self):
+        # Created on first use so pre-forking servers start the pool per worker
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is held until the work really finishes, even if we stop waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True when a stored hash uses another algorithm than PASSWORD_HASH_METHOD, or a lower cost.
+
+        Hashes stronger than the configured method are kept, so lowering the
+        setting never weakens stored passwords.
+        """
+        try:
+            algorithm, costs = _costs(pwhash.split('$', 1)[0])
+        except ValueError:
+            return True
+        wanted_algorithm, wanted_costs = _costs(method_parameters(self.method))
+        return (algorithm != wanted_algorithm or len(costs) != len(wanted_costs)
+                or any(cost < wanted for cost, wanted in zip(costs, wanted_costs)))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+password_hasher = PasswordHasher()
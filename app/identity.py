@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import g, request
+from flask_jwt_extended.config import config as jwt_config
+from sqlalchemy import select
+from .db import db
+from .instrumentation import record_span
+from app.models import User
+
+# The user columns protected routes need, detached from any session
+UserSnapshot = namedtuple('UserSnapshot', 'id username email profile_picture')
+
+
+class TTLCache:
+    """Small thread-safe LRU mapping whose entries expire after ttl seconds."""
+
+    def __init__(self, max_entries=10000, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class MemoryDenylist:
+    """Revoked token ids and per-user revocation cutoffs, held in process.
+
+    Cutoffs are kept for cutoff_ttl seconds (the refresh token lifetime set
+    in auth.py), after which every token they revoke has expired anyway.
+    Expired entries are swept at most once a minute, on writes.
+    """
+
+    def __init__(self, cutoff_ttl=7 * 24 * 3600):
+        self.cutoff_ttl = cutoff_ttl
+        self._jtis = {}  # jti -> token expiry (epoch seconds)
+        self._cutoffs = {}  # user_id -> (tokens issued before this are revoked, forget it after)
+        self._next_sweep = 0
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + 60
+        self._jtis = {jti: exp for jti, exp in self._jtis.items() if exp > now}
+        self._cutoffs = {user_id: entry for user_id, entry in self._cutoffs.items() if entry[1] > now}
+
+    def revoke_jti(self, jti, expires_at):
+        with self._lock:
+            self._sweep(time.time())
+            self._jtis[jti] = expires_at
+
+    def revoke_user(self, user_id, before):
+        with self._lock:
+            self._sweep(time.time())
+            self._cutoffs[user_id] = (before, before + self.cutoff_ttl)
+
+    def is_jti_revoked(self, jti):
+        return jti in self._jtis
+
+    def user_cutoff(self, user_id):
+        entry = self._cutoffs.get(user_id)
+        return entry[0] if entry is not None else None
+
+
+class RedisDenylist:
+    """Denylist shared between workers through a redis-py compatible client."""
+
+    def __init__(self, client, prefix='deny:', cutoff_ttl=7 * 24 * 3600):
+        self.client = client
+        self.prefix = prefix
+        self.cutoff_ttl = cutoff_ttl
+
+    def revoke_jti(self, jti, expires_at):
+        self.client.set(f'{self.prefix}jti:{jti}', 1, ex=max(int(expires_at - time.time()), 1))
+
+    def revoke_user(self, user_id, before):
+        self.client.set(f'{self.prefix}user:{user_id}', repr(before), ex=self.cutoff_ttl)
+
+    def is_jti_revoked(self, jti):
+        return self.client.exists(f'{self.prefix}jti:{jti}') > 0
+
+    def user_cutoff(self, user_id):
+        value = self.client.get(f'{self.prefix}user:{user_id}')
+        return float(value) if value is not None else None
+
+
+class Identity:
+    """Token revocation and cached user lookups for flask_jwt_extended.
+
+    flask_jwt_extended verifies the token once per request and keeps the
+    claims in flask.g. On top of that this registers a blocklist check that
+    rejects revoked jtis and tokens issued before a user-wide cutoff (set on
+    password change and account deletion), and a user loader backed by a TTL
+    cache of UserSnapshot rows, so protected routes do not query users.
+
+    The iat claim is in whole seconds, so tokens also carry the issue time
+    with sub-second precision in an 'issued' claim. A token issued earlier
+    in the same second as a cutoff is revoked, and one issued just after it,
+    like those handed out by a password change, is not.
+    """
+
+    def __init__(self):
+        self.users = TTLCache()
+        self.denylist = MemoryDenylist()
+
+    def init_app(self, app, jwt, denylist=None):
+        self.users = TTLCache(app.config['IDENTITY_CACHE_MAX_ENTRIES'], app.config['IDENTITY_CACHE_TTL'])
+        if denylist is None:
+            denylist = self._denylist_from_config(app.config)
+        self.denylist = denylist
+        jwt.additional_claims_loader(lambda identity: {'issued': time.time()})
+        jwt.decode_key_loader(self._start_verification)
+        jwt.token_in_blocklist_loader(lambda jwt_header, jwt_data: self.is_revoked(jwt_data))
+        jwt.user_lookup_loader(self._finish_verification)
+        app.extensions['identity'] = self
+
+    @staticmethod
+    def _denylist_from_config(config):
+        name = config['JWT_DENYLIST_BACKEND']
+        if name == 'memory':
+            return MemoryDenylist()
+        if name == 'redis':
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("JWT_DENYLIST_BACKEND='redis' requires the redis package")
+            return RedisDenylist(redis.Redis.from_url(config['JWT_DENYLIST_REDIS_URL']))
+        raise ValueError(f'Unknown JWT_DENYLIST_BACKEND: {name}')
+
+    # Token verification runs from the key lookup to the user lookup; its time
+    # goes to the request's 'jwt' span (Server-Timing)
+    @staticmethod
+    def _start_verification(jwt_header, jwt_data):
+        g.jwt_started = time.perf_counter()
+        return jwt_config.decode_key
+
+    def _finish_verification(self, jwt_header, jwt_data):
+        user = self.load_user(jwt_data['sub']['id'])
+        started = g.pop('jwt_started', None)
+        if started is not None:
+            record_span('jwt', time.perf_counter() - started)
+        return user
+
+    def is_revoked(self, claims):
+        # The rate limiter and the view both verify the token; ask the
+        # denylist (a redis round trip or two) once per request
+        checked = request.environ.get('app.token_revoked')
+        if checked is not None and checked[0] == claims['jti']:
+            return checked[1]
+        revoked = self.denylist.is_jti_revoked(claims['jti'])
+        if not revoked:
+            cutoff = self.denylist.user_cutoff(claims['sub']['id'])
+            # Older tokens without 'issued' are revoked with the cutoff's whole second
+            revoked = cutoff is not None and claims.get('issued', claims['iat']) <= cutoff
+        request.environ['app.token_revoked'] = (claims['jti'], revoked)
+        return revoked
+
+    def load_user(self, user_id):
+        """Return a UserSnapshot for user_id, or None if the user no longer exists."""
+        snapshot = self.users.get(user_id)
+        if snapshot is None:
+            row = db.session.execute(
+                select(User.id, User.username, User.email, User.profile_picture)
+                .where(User.id == user_id, User.deleted_at.is_(None))
+            ).first()
+            if row is None:
+                return None
+            snapshot = UserSnapshot(*row)
+            self.users.set(user_id, snapshot)
+        return snapshot
+
+    def invalidate_user(self, user_id):
+        self.users.delete(user_id)
+
+    def revoke_token(self, claims):
+        self.denylist.revoke_jti(claims['jti'], claims['exp'])
+
+    def revoke_all_tokens(self, user_id):
+        """Revoke every token issued to a user before now."""
+        self.denylist.revoke_user(user_id, time.time())
+        self.invalidate_user(user_id)
+
+
+identity = Identity()
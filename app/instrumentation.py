@@ -0,0 +1,267 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from flask import request, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .db import db
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint.', ['method', 'endpoint', 'status'],
+)
+REQUEST_SQL_QUERIES = metrics.histogram(
+    'http_request_sql_queries', 'SQL statements executed per request.', ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500),
+)
+REQUEST_SQL_SECONDS = metrics.histogram(
+    'http_request_sql_seconds', 'Time spent in SQL per request.', ['endpoint'],
+)
+N_PLUS_ONE = metrics.counter(
+    'sql_n_plus_one_total', 'Requests that repeated a statement or lazy load past the threshold.', ['endpoint', 'kind'],
+)
+SLOW_PROFILES = metrics.counter('profiler_dumps_total', 'Slow requests written out by the sampling profiler.', ['endpoint'])
+
+
+class _RequestStats:
+    """SQL activity of one request, filled in by the engine and session hooks."""
+
+    __slots__ = ('queries', 'sql_seconds', 'statements', 'lazy_loads', 'spans')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = Counter()
+        self.lazy_loads = Counter()
+        self.spans = Counter()  # seconds by span name, e.g. 'jwt' or 'serialize'
+
+
+def _current_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+
+def current_spans():
+    """The current request's seconds by span name, or None outside a request.
+
+    Code that runs after the request context is gone (e.g. a streamed body)
+    can look this up beforehand and add to it later.
+    """
+    stats = _current_stats()
+    return stats.spans if stats is not None else None
+
+
+def record_span(name, seconds):
+    """Add seconds to the current request's time in a named span, if there is a request."""
+    spans = current_spans()
+    if spans is not None:
+        spans[name] += seconds
+
+
+@contextmanager
+def timed(name):
+    """Count the time spent in the block towards the current request's span name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    stats = _current_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_seconds += elapsed
+        stats.statements[statement] += 1
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _count_lazy_loads(orm_execute_state):
+    if orm_execute_state.is_relationship_load:
+        stats = _current_stats()
+        if stats is not None:
+            stats.lazy_loads[str(orm_execute_state.loader_strategy_path)] += 1
+
+
+class SamplingProfiler:
+    """Samples the stacks of in-flight requests and keeps those of slow ones.
+
+    A daemon thread wakes every interval and records the current stack of
+    each thread serving a request. When a request took longer than the
+    threshold its samples are written to output_dir in the collapsed
+    ("folded") format read by flamegraph.pl, speedscope and inferno: one
+    line per distinct stack, frames joined by ';', then the sample count.
+    """
+
+    def __init__(self, interval, threshold, output_dir):
+        self.interval = interval
+        self.threshold = threshold
+        self.output_dir = output_dir
+        self._active = {}  # thread ident -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start_request(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+
+    def finish_request(self, endpoint, elapsed):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if samples and elapsed >= self.threshold:
+            self._dump(endpoint, elapsed, samples)
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and ident != own:
+                        samples[self._fold(frame)] += 1
+
+    def _dump(self, endpoint, elapsed, samples):
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{endpoint or 'unmatched'}-{int(elapsed * 1000)}ms.folded"
+        path = os.path.join(self.output_dir, name.replace('/', '_'))
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        SLOW_PROFILES.inc(endpoint or 'unmatched')
+        logger.info('Slow request %s took %.0f ms, profile written to %s', endpoint, elapsed * 1000, path)
+
+
+class RequestInstrumentation:
+    """Per-request latency and SQL metrics, N+1 warnings and the optional profiler.
+
+    Records each request's latency by endpoint, and the number and duration
+    of SQL statements it ran (through engine cursor hooks, so replicas count
+    too). They are observed when the server closes the response, so a
+    streamed body's queries and encoding are included; requests that raise
+    are observed at teardown as 500s. A request that runs the same
+    statement, or lazy-loads the same relationship (e.g. User.tasks), at
+    least SQL_N_PLUS_ONE_THRESHOLD times is logged and counted as a likely
+    N+1, unless its endpoint is in SQL_N_PLUS_ONE_EXEMPT. With
+    SERVER_TIMING_ENABLED the time in token checks (jwt), SQL and JSON
+    encoding (serialize) is also sent in a Server-Timing header for browser
+    dev tools; being a header, it covers the request up to the first byte of
+    a streamed body.
+    """
+
+    def __init__(self):
+        self.n_plus_one_threshold = 0
+        self.n_plus_one_exempt = frozenset()
+        self.server_timing = False
+        self.profiler = None
+
+    def init_app(self, app):
+        config = app.config
+        self.n_plus_one_threshold = config['SQL_N_PLUS_ONE_THRESHOLD']
+        self.n_plus_one_exempt = frozenset(config['SQL_N_PLUS_ONE_EXEMPT'])
+        self.server_timing = config['SERVER_TIMING_ENABLED']
+        if config['PROFILER_ENABLED']:
+            self.profiler = SamplingProfiler(
+                config['PROFILER_INTERVAL_MS'] / 1000,
+                config['PROFILER_SLOW_REQUEST_MS'] / 1000,
+                config['PROFILER_OUTPUT_DIR'] or os.path.join(app.instance_path, 'profiles'),
+            )
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        app.extensions['instrumentation'] = self
+
+    def _start(self):
+        g.request_started = time.perf_counter()
+        g.request_stats = _RequestStats()
+        # Samples are kept per thread, which views on the ASGI event loop share
+        g.request_profiled = self.profiler is not None and not request.environ.get('app.event_loop')
+        if g.request_profiled:
+            self.profiler.start_request()
+
+    def _finish(self, response):
+        started = g.get('request_started')
+        stats = g.get('request_stats')
+        if started is None or stats is None:
+            return response
+        if self.server_timing:
+            response.headers['Server-Timing'] = self._server_timing(stats, time.perf_counter() - started)
+        observe = partial(self._observe, request.method, request.endpoint, str(response.status_code),
+                          started, stats, g.request_profiled)
+        g.request_observed = True
+        # send_file responses hand their file to the server without closing the
+        # response, but run no more of our code either
+        if response.direct_passthrough:
+            observe()
+        else:
+            response.call_on_close(observe)
+        return response
+
+    def _teardown(self, exc):
+        # after_request did not run: the error propagated (e.g. in tests) or a hook raised
+        if g.get('request_started') is not None and not g.get('request_observed'):
+            self._observe(request.method, request.endpoint, '500', g.request_started, g.request_stats,
+                          g.request_profiled)
+
+    @staticmethod
+    def _server_timing(stats, elapsed):
+        return (
+            f"jwt;dur={stats.spans['jwt'] * 1000:.1f}, "
+            f'sql;dur={stats.sql_seconds * 1000:.1f};desc="{stats.queries} queries", '
+            f"serialize;dur={stats.spans['serialize'] * 1000:.1f}, "
+            f'app;dur={elapsed * 1000:.1f}'
+        )
+
+    def _observe(self, method, endpoint, status, started, stats, profiled):
+        elapsed = time.perf_counter() - started
+        endpoint = endpoint or 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, method, endpoint, status)
+        REQUEST_SQL_QUERIES.observe(stats.queries, endpoint)
+        REQUEST_SQL_SECONDS.observe(stats.sql_seconds, endpoint)
+        self._check_n_plus_one(endpoint, stats)
+        if profiled:
+            self.profiler.finish_request(endpoint, elapsed)
+
+    def _check_n_plus_one(self, endpoint, stats):
+        threshold = self.n_plus_one_threshold
+        if threshold <= 0 or endpoint in self.n_plus_one_exempt:
+            return
+        for path, count in stats.lazy_loads.items():
+            if count >= threshold:
+                N_PLUS_ONE.inc(endpoint, 'lazy_load')
+                logger.warning('Possible N+1 in %s: %d lazy loads of %s', endpoint, count, path)
+        for statement, count in stats.statements.items():
+            if count >= threshold:
+                N_PLUS_ONE.inc(endpoint, 'statement')
+                logger.warning('Possible N+1 in %s: statement ran %d times: %s',
+                               endpoint, count, ' '.join(statement.split())[:200])
+
+
+instrumentation = RequestInstrumentation()
@@ -0,0 +1,202 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import select, update, exc
+from .db import db
+from .metrics import metrics
+from app.models import Job
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('thread', 'worker', 'inline')
+
+JOB_SECONDS = metrics.histogram(
+    'job_duration_seconds', 'Background job run time by outcome.', ['kind', 'status'],
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0),
+)
+
+
+class JobQueue:
+    """Background jobs whose status is kept in the jobs table.
+
+    enqueue() adds a queued Job to the session; once the caller has committed,
+    notify() starts it according to JOB_QUEUE_BACKEND: 'thread' runs jobs on
+    JOB_WORKERS threads in this process (the stand-in for development and
+    SQLite), 'worker' leaves them to `flask jobs worker` processes and
+    'inline' runs them in the calling request, which suits tests.
+
+    Jobs are claimed with a conditional UPDATE, so threads and worker
+    processes can share the table. A job that raises goes back to the queue
+    until it has been tried JOB_MAX_ATTEMPTS times, so handlers must be
+    idempotent and should commit their progress as they go. A job still
+    running JOB_LEASE_SECONDS after it started is presumed lost with its
+    worker (a crash or restart) and requeued the same way. The thread
+    backend drains the queue when the app serves its first request, picking
+    up jobs left by the previous process; CLI commands and scripts that
+    never serve one do not start it.
+    """
+
+    def __init__(self):
+        self.backend = 'thread'
+        self.workers = 2
+        self.poll_interval = 1
+        self.max_attempts = 3
+        self.lease = timedelta(hours=1)
+        self.handlers = {}
+        self._app = None
+        self._executor = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.backend = app.config['JOB_QUEUE_BACKEND']
+        if self.backend not in BACKENDS:
+            raise ValueError(f'Unknown JOB_QUEUE_BACKEND: {self.backend}')
+        self.workers = app.config['JOB_WORKERS']
+        self.poll_interval = app.config['JOB_POLL_INTERVAL']
+        self.max_attempts = app.config['JOB_MAX_ATTEMPTS']
+        self.lease = timedelta(seconds=app.config['JOB_LEASE_SECONDS'])
+        self._app = app
+        app.cli.add_command(jobs_cli)
+        app.extensions['jobs'] = self
+        self._started = False
+        if self.backend == 'thread':
+            app.before_request(self._drain_on_first_request)
+
+    def handler(self, kind):
+        """Register handler(job, **payload) for jobs of a kind."""
+        def decorator(fn):
+            self.handlers[kind] = fn
+            return fn
+        return decorator
+
+    def enqueue(self, kind, payload, user_id=None):
+        """Add a queued job to the session and return it; commit, then call notify()."""
+        job = Job(id=uuid.uuid4().hex, kind=kind, user_id=user_id, payload=payload, progress={},
+                  status='queued', attempts=0)
+        db.session.add(job)
+        return job
+
+    def status_token(self, job_id):
+        """A signed token that shows one job's status to whoever holds it, without logging in."""
+        return URLSafeSerializer(current_app.secret_key, salt='job-status').dumps(job_id)
+
+    def check_status_token(self, job_id, token):
+        try:
+            return URLSafeSerializer(current_app.secret_key, salt='job-status').loads(token) == job_id
+        except BadSignature:
+            return False
+
+    def notify(self):
+        if self.backend == 'inline':
+            self.run_pending()
+        elif self.backend == 'thread':
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='jobs')
+            self._executor.submit(self._drain)
+
+    def _drain_on_first_request(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.notify()
+
+    def _drain(self):
+        with self._app.app_context():
+            try:
+                self.run_pending()
+            except exc.DBAPIError as e:
+                # e.g. at startup, before the tables exist
+                logger.warning('Could not run queued jobs: %s', e)
+                db.session.rollback()
+
+    def run_pending(self):
+        """Requeue expired jobs, then run queued jobs until none are left; return how many ran."""
+        self.requeue_expired()
+        count = 0
+        while self.run_next():
+            count += 1
+        return count
+
+    def requeue_expired(self):
+        """Requeue running jobs whose lease expired, or fail them once out of attempts."""
+        now = datetime.utcnow()
+        expired = (Job.status == 'running', Job.started_at < now - self.lease)
+        db.session.execute(
+            update(Job).where(*expired, Job.attempts >= self.max_attempts)
+            .values(status='failed', error='Lease expired', finished_at=now)
+        )
+        requeued = db.session.execute(
+            update(Job).where(*expired, Job.attempts < self.max_attempts).values(status='queued')
+        ).rowcount
+        db.session.commit()
+        if requeued:
+            logger.warning('Requeued %d job(s) whose lease expired', requeued)
+
+    def claim(self):
+        """Mark the oldest queued job running and return it, or None."""
+        while True:
+            job_id = db.session.execute(
+                select(Job.id).where(Job.status == 'queued').order_by(Job.created_at)
+                .limit(1).with_for_update(skip_locked=True)
+            ).scalar()
+            if job_id is None:
+                db.session.rollback()
+                return None
+            claimed = db.session.execute(
+                update(Job).where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', started_at=datetime.utcnow(), attempts=Job.attempts + 1)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, job_id, populate_existing=True)
+            # Another worker claimed it between the two statements
+
+    def run_next(self):
+        """Run one queued job; return False if there was none."""
+        job = self.claim()
+        if job is None:
+            return False
+        start = time.perf_counter()
+        try:
+            self.handlers[job.kind](job, **job.payload)
+        except Exception as e:
+            db.session.rollback()
+            logger.exception('Job %s (%s) failed on attempt %d', job.id, job.kind, job.attempts)
+            job.status = 'queued' if job.attempts < self.max_attempts else 'failed'
+            job.error = f'{type(e).__name__}: {e}'
+        else:
+            job.status = 'succeeded'
+            job.error = None
+        if job.status != 'queued':
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        JOB_SECONDS.observe(time.perf_counter() - start, job.kind, job.status)
+        return True
+
+
+jobs = JobQueue()
+
+
+jobs_cli = AppGroup('jobs', help='Background jobs.')
+
+
+@jobs_cli.command('worker')
+@click.option('--once', is_flag=True, help='Exit once no jobs are queued.')
+def worker_command(once):
+    """Run queued jobs, polling every JOB_POLL_INTERVAL seconds."""
+    while True:
+        count = jobs.run_pending()
+        if once:
+            click.echo(f'{count} job(s) run')
+            return
+        time.sleep(jobs.poll_interval)
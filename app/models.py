@@ -12,8 +12,13 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(200), nullable=False)
     profile_picture = db.Column(db.String(300), nullable=True)  # New field for profile picture
-    tasks = db.relationship('Task', backref='user', lazy=True)
-    events = db.relationship('Event', backref='creator', lazy=True)  # Changed backref name to 'creator'
+    change_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')  # Bumped on every task/event write
+    tombstones_pruned_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')  # Tombstones up to here were pruned
+    deleted_at = db.Column(db.DateTime, nullable=True)  # Deletion requested; the row goes when the job finishes
+    # Child rows are removed by the database (ON DELETE CASCADE), never loaded to be deleted
+    tasks = db.relationship('Task', backref='user', lazy=True, cascade='all, delete', passive_deletes=True)
+    events = db.relationship('Event', backref='creator', lazy=True,  # Changed backref name to 'creator'
+                             cascade='all, delete', passive_deletes=True)
 
     def check_password(self, password):
         """Check if the provided password matches the hashed password."""
@@ -21,21 +26,103 @@ class User(db.Model):
 
 class Task(db.Model):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # Keyset pagination on (updated_at, id), optionally narrowed by completed
+        db.Index('ix_tasks_user_updated', 'user_id', 'updated_at', 'id'),
+        db.Index('ix_tasks_user_completed_updated', 'user_id', 'completed', 'updated_at', 'id'),
+        db.Index('ix_tasks_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_tasks_user_title', 'user_id', 'title'),
+        db.Index('ix_tasks_user_version', 'user_id', 'version'),
+        # Backs /api/search on MySQL; other databases use the in-process index
+        db.Index('ft_tasks_title', 'title', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     completed = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')  # User.change_version at last write
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
 
 
 class Event(db.Model):
     __tablename__ = 'events'
+    __table_args__ = (
+        db.Index('ix_events_user_date', 'user_id', 'event_date'),
+        db.Index('ix_events_user_version', 'user_id', 'version'),
+        db.Index('ix_events_user_recurrence_end', 'user_id', 'recurrence_end'),
+        db.Index('ft_events_title_description', 'title', 'description', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    event_date = db.Column(db.Date, nullable=False)
+    event_date = db.Column(db.Date, nullable=False)  # First occurrence for recurring events
+    rrule = db.Column(db.String(255), nullable=True)  # RFC 5545 RRULE, NULL for single events
+    recurrence_end = db.Column(db.Date, nullable=True)  # Last possible occurrence, NULL for single events
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')  # User.change_version at last write
     
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
\ No newline at end of file
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+
+
+class EventException(db.Model):
+    """Cancels or overrides a single occurrence of a recurring event."""
+    __tablename__ = 'event_exceptions'
+    __table_args__ = (
+        db.UniqueConstraint('event_id', 'original_date', name='uq_event_exceptions_occurrence'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id', ondelete='CASCADE'), nullable=False)
+    original_date = db.Column(db.Date, nullable=False)  # The occurrence this replaces
+    cancelled = db.Column(db.Boolean, nullable=False, default=False)
+    title = db.Column(db.String(255), nullable=True)  # Overrides, NULL keeps the series value
+    description = db.Column(db.Text, nullable=True)
+    event_date = db.Column(db.Date, nullable=True)  # Moved-to date, NULL keeps original_date
+
+
+class Tombstone(db.Model):
+    """Records a deleted task or event so /api/sync can report it to clients."""
+    __tablename__ = 'tombstones'
+    __table_args__ = (
+        db.Index('ix_tombstones_user_version', 'user_id', 'version'),
+        db.Index('ix_tombstones_deleted_at', 'deleted_at'),  # Pruning
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(20), nullable=False)  # 'task' or 'event'
+    entity_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.BigInteger, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+
+
+class Upload(db.Model):
+    """Who uploaded a stored object, so it can be removed once nobody has it, see app/storage.py."""
+    __tablename__ = 'uploads'
+    __table_args__ = (
+        db.Index('ix_uploads_path', 'path'),
+        db.Index('ix_uploads_user', 'user_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(300), nullable=False)  # Storage path of the object
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=True)  # NULL when anonymous
+
+
+class Job(db.Model):
+    """A background job and its status, see app/jobs.py."""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_created', 'status', 'created_at'),
+    )
+    id = db.Column(db.String(32), primary_key=True)  # Random hex
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded or failed
+    user_id = db.Column(db.Integer, nullable=True)  # No foreign key: jobs outlive deleted accounts
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    progress = db.Column(db.JSON, nullable=False, default=dict)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,109 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import select, and_, or_
+from app.models import Task
+
+# Columns a client may ask for with ?fields=
+TASK_FIELDS = ('id', 'title', 'completed', 'created_at', 'updated_at')
+
+# The keyset columns are always selected so the next cursor can be built
+TASK_KEYSET_FIELDS = ('updated_at', 'id')
+
+TASK_RANGE_FILTERS = {
+    'created_after': (Task.created_at, '>='),
+    'created_before': (Task.created_at, '<'),
+    'updated_after': (Task.updated_at, '>='),
+    'updated_before': (Task.updated_at, '<'),
+}
+
+
+def encode_cursor(updated_at, task_id):
+    """Encode the (updated_at, id) position of the last row on a page."""
+    raw = json.dumps([updated_at.isoformat(), task_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor, raising ValueError if it is malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        updated_at, task_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(updated_at), int(task_id)
+    except (TypeError, ValueError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+
+
+def _parse_bool(value):
+    lowered = value.lower()
+    if lowered in ('1', 'true', 'yes'):
+        return True
+    if lowered in ('0', 'false', 'no'):
+        return False
+    raise ValueError('completed must be true or false')
+
+
+def _parse_datetime(name, value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO 8601 date or datetime')
+
+
+def parse_task_fields(value):
+    """Return the task columns requested with ?fields=, in canonical order."""
+    if not value:
+        return TASK_FIELDS
+    requested = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in TASK_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return tuple(f for f in TASK_FIELDS if f in requested)
+
+
+def task_list_query(user_id, args, default_limit=100, max_limit=1000):
+    """Build the keyset-paginated task list query for a user.
+
+    Tasks are ordered newest-updated first on (updated_at, id), which is served
+    by the composite indexes declared on Task. Only the requested columns are
+    selected, so no Task entities are hydrated.
+
+    Returns a tuple of (statement, limit, fields), where fields are the columns
+    the client asked for; the keyset columns are selected regardless so the
+    next cursor can be built. The statement fetches one row more than the limit
+    so the caller can tell whether another page exists.
+    Raises ValueError with a client-facing message for invalid parameters.
+    """
+    try:
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    limit = min(limit, max_limit)
+
+    fields = parse_task_fields(args.get('fields'))
+    columns = fields + tuple(f for f in TASK_KEYSET_FIELDS if f not in fields)
+    stmt = select(*[getattr(Task, f) for f in columns]).where(Task.user_id == user_id)
+
+    if args.get('completed') is not None:
+        stmt = stmt.where(Task.completed == _parse_bool(args['completed']))
+
+    for name, (column, op) in TASK_RANGE_FILTERS.items():
+        if args.get(name):
+            bound = _parse_datetime(name, args[name])
+            stmt = stmt.where(column >= bound if op == '>=' else column < bound)
+
+    if args.get('title_prefix'):
+        prefix = args['title_prefix'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        stmt = stmt.where(Task.title.like(prefix + '%', escape='\\'))
+
+    if args.get('cursor'):
+        after_updated_at, after_id = decode_cursor(args['cursor'])
+        stmt = stmt.where(or_(
+            Task.updated_at < after_updated_at,
+            and_(Task.updated_at == after_updated_at, Task.id < after_id),
+        ))
+
+    stmt = stmt.order_by(Task.updated_at.desc(), Task.id.desc()).limit(limit + 1)
+    return stmt, limit, fields
@@ -0,0 +1,259 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import request, g, jsonify
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+# burst tokens, refilled continuously at burst per period seconds
+Limit = namedtuple('Limit', 'burst period')
+
+RATE_LIMITED = metrics.counter('ratelimit_rejections_total', 'Requests answered with 429.', ['endpoint'])
+ADMISSION_REJECTED = metrics.counter('admission_rejections_total', 'Requests shed with 503.', ['reason'])
+
+
+def parse_limit(value):
+    """Parse 'N/period' (period: second, minute, hour or day) into a Limit."""
+    count, sep, period = value.strip().partition('/')
+    if not sep or not count.strip().isdigit() or period.strip() not in PERIODS or int(count) < 1:
+        raise ValueError(f'Invalid rate limit {value!r}, expected e.g. 10/minute')
+    return Limit(int(count), PERIODS[period.strip()])
+
+
+class MemoryBuckets:
+    """Token buckets held in process, bounded to max_keys least recently used clients."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, limit):
+        """Take one token; return (allowed, tokens left)."""
+        now = time.monotonic()
+        rate = limit.burst / limit.period
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+# Refill and take in one round trip; the server clock keeps workers consistent
+TAKE_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = burst
+    ts = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared between workers through a redis-py compatible client.
+
+    Each bucket is a hash updated by a Lua script, so concurrent requests can
+    never both spend the last token, and expires once it would be full again.
+    """
+
+    def __init__(self, client, prefix='rl:'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, limit):
+        try:
+            allowed, tokens = self._script(keys=[self.prefix + key], args=[limit.burst, limit.burst / limit.period])
+        except Exception:
+            # An unreachable limiter must not take the API down with it
+            logger.warning('Rate limit backend unavailable, allowing request', exc_info=True)
+            return True, limit.burst
+        return bool(allowed), float(tokens)
+
+
+class RateLimiter:
+    """Per-client token bucket limits checked before every request.
+
+    Clients are identified by the user id of a valid bearer token, falling
+    back to the client address, so a user keeps one budget across devices and
+    anonymous routes such as /auth/login are limited per address. Endpoints
+    listed in RATELIMIT_ROUTES get their own bucket and budget; every other
+    endpoint shares the RATELIMIT_DEFAULT bucket. Responses carry
+    RateLimit-Limit, RateLimit-Remaining, RateLimit-Reset and RateLimit-Policy
+    headers, and a 429 adds Retry-After.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.backend = MemoryBuckets()
+        self.default = None
+        self.routes = {}
+        self.exempt = frozenset()
+
+    def init_app(self, app, backend=None):
+        config = app.config
+        self.enabled = config['RATELIMIT_ENABLED']
+        self.default = parse_limit(config['RATELIMIT_DEFAULT'])
+        self.routes = {endpoint: parse_limit(value) for endpoint, value in config['RATELIMIT_ROUTES'].items()}
+        self.exempt = frozenset(config['RATELIMIT_EXEMPT'])
+        if backend is None:
+            backend = self._backend_from_config(config)
+        self.backend = backend
+        app.before_request(self._check)
+        app.after_request(self._add_headers)
+        app.extensions['rate_limiter'] = self
+
+    @staticmethod
+    def _backend_from_config(config):
+        name = config['RATELIMIT_BACKEND']
+        if name == 'memory':
+            return MemoryBuckets(config['RATELIMIT_MAX_KEYS'])
+        if name == 'redis':
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("RATELIMIT_BACKEND='redis' requires the redis package")
+            return RedisBuckets(redis.Redis.from_url(config['RATELIMIT_REDIS_URL']))
+        raise ValueError(f'Unknown RATELIMIT_BACKEND: {name}')
+
+    @staticmethod
+    def client_key():
+        # Verifying here leaves the claims and user in flask.g; the view's own
+        # check finds the denylist result and user snapshot already cached
+        try:
+            if verify_jwt_in_request(optional=True, verify_type=False) is not None:
+                return f"user:{get_jwt_identity()['id']}"
+        except Exception:
+            pass  # Invalid, expired or revoked; the route itself will reject it
+        # The proxy's address unless PROXY_FIX_X_FOR is set (see create_app)
+        return f'ip:{request.remote_addr}'
+
+    def _check(self):
+        if not self.enabled or request.method == 'OPTIONS' or request.endpoint in self.exempt:
+            return None
+        scope = request.endpoint if request.endpoint in self.routes else 'default'
+        limit = self.routes.get(scope, self.default)
+        allowed, tokens = self.backend.take(f'{scope}:{self.client_key()}', limit)
+        g.rate_limit = (limit, tokens)
+        if allowed:
+            return None
+        RATE_LIMITED.inc(scope)
+        rate = limit.burst / limit.period
+        retry_after = max(math.ceil((1 - tokens) / rate), 1)
+        return jsonify({'error': 'Too many requests', 'message': f'Retry in {retry_after} seconds'}), 429, \
+            {'Retry-After': str(retry_after)}
+
+    def _add_headers(self, response):
+        state = g.pop('rate_limit', None)
+        if state is not None:
+            limit, tokens = state
+            rate = limit.burst / limit.period
+            response.headers['RateLimit-Limit'] = str(limit.burst)
+            response.headers['RateLimit-Remaining'] = str(int(tokens))
+            response.headers['RateLimit-Reset'] = str(math.ceil((limit.burst - tokens) / rate))
+            response.headers['RateLimit-Policy'] = f'{limit.burst};w={limit.period}'
+        return response
+
+
+class AdmissionGate:
+    """Caps the requests one process works on at once and sheds the excess.
+
+    Up to ADMISSION_MAX_CONCURRENT requests run; up to ADMISSION_MAX_QUEUE
+    more wait at most ADMISSION_QUEUE_TIMEOUT seconds for a slot. Anything
+    beyond that is answered 503 with Retry-After straight away, so under
+    overload latency stays bounded instead of every request timing out in a
+    growing queue in front of the database pool. Only meaningful for threaded
+    workers, so views served on the ASGI event loop skip it; a max of 0
+    disables the gate.
+    """
+
+    def __init__(self):
+        self.max_concurrent = 0
+        self.max_queue = 0
+        self.queue_timeout = 0
+        self.exempt = frozenset()
+        self._slots = None
+        self._waiting = 0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        config = app.config
+        self.max_concurrent = config['ADMISSION_MAX_CONCURRENT']
+        self.max_queue = config['ADMISSION_MAX_QUEUE']
+        self.queue_timeout = config['ADMISSION_QUEUE_TIMEOUT']
+        self.exempt = frozenset(config['RATELIMIT_EXEMPT'])
+        if self.max_concurrent > 0:
+            self._slots = threading.BoundedSemaphore(self.max_concurrent)
+            app.before_request(self._enter)
+            app.teardown_request(self._leave)
+        app.extensions['admission_gate'] = self
+
+    def _reject(self, reason):
+        ADMISSION_REJECTED.inc(reason)
+        return jsonify(message="Server busy, please retry"), 503, {'Retry-After': '1'}
+
+    def _enter(self):
+        # Requests on the ASGI event loop never block a thread (see app/asgi.py)
+        if request.endpoint in self.exempt or request.environ.get('app.event_loop'):
+            return None
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self.max_queue:
+                    return self._reject('queue_full')
+                self._waiting += 1
+            try:
+                admitted = self._slots.acquire(timeout=self.queue_timeout)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not admitted:
+                return self._reject('timeout')
+        with self._lock:
+            self._running += 1
+        g.admitted = True
+        return None
+
+    def _leave(self, exc):
+        if g.pop('admitted', False):
+            with self._lock:
+                self._running -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {'running': self._running, 'waiting': self._waiting}
+
+
+rate_limiter = RateLimiter()
+admission_gate = AdmissionGate()
+
+metrics.gauge('admission_requests', 'Requests running or waiting behind the admission gate.', ['state'],
+              lambda: [((state,), value) for state, value in admission_gate.stats().items()])
@@ -0,0 +1,155 @@
+import calendar
+from collections import namedtuple
+from datetime import date, timedelta
+from functools import lru_cache
+
+# recurrence_end stored for series that never end, so one indexed range
+# condition (recurrence_end >= window start) finds every live series
+FOREVER = date(9999, 12, 31)
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+# last_occurrence walks a COUNT rule to its end, so COUNT is capped; longer
+# series can use UNTIL or no end at all
+MAX_COUNT = 1000
+
+Rule = namedtuple('Rule', 'freq interval count until byday')
+
+
+def _parse_until(value):
+    value = value.split('T', 1)[0].replace('-', '')
+    if len(value) != 8 or not value.isdigit():
+        raise ValueError('UNTIL must be a date in YYYYMMDD form')
+    return date(int(value[:4]), int(value[4:6]), int(value[6:]))
+
+
+@lru_cache(maxsize=4096)
+def parse_rrule(text):
+    """Parse the supported subset of an RFC 5545 RRULE.
+
+    FREQ (DAILY, WEEKLY, MONTHLY, YEARLY), INTERVAL, COUNT, UNTIL and, for
+    weekly rules, BYDAY. Monthly and yearly rules repeat on the start date's
+    day of month, skipping months without that day. Raises ValueError with a
+    client-facing message for anything else.
+    """
+    if text.upper().startswith('RRULE:'):
+        text = text[6:]
+    parts = {}
+    for part in text.upper().split(';'):
+        if not part:
+            continue
+        name, sep, value = part.partition('=')
+        if not sep or not value:
+            raise ValueError(f'Malformed rrule part: {part}')
+        parts[name] = value
+
+    freq = parts.pop('FREQ', None)
+    if freq not in FREQUENCIES:
+        raise ValueError(f"FREQ must be one of {', '.join(FREQUENCIES)}")
+    try:
+        interval = int(parts.pop('INTERVAL', 1))
+        count = int(parts.pop('COUNT')) if 'COUNT' in parts else None
+    except ValueError:
+        raise ValueError('INTERVAL and COUNT must be integers')
+    if interval < 1 or (count is not None and count < 1):
+        raise ValueError('INTERVAL and COUNT must be positive')
+    if count is not None and count > MAX_COUNT:
+        raise ValueError(f'COUNT must be at most {MAX_COUNT}')
+    until = _parse_until(parts.pop('UNTIL')) if 'UNTIL' in parts else None
+    if count is not None and until is not None:
+        raise ValueError('COUNT and UNTIL cannot both be set')
+
+    byday = None
+    if 'BYDAY' in parts:
+        if freq != 'WEEKLY':
+            raise ValueError('BYDAY is only supported with FREQ=WEEKLY')
+        days = parts.pop('BYDAY').split(',')
+        if any(d not in WEEKDAYS for d in days):
+            raise ValueError(f"BYDAY must list days from {','.join(WEEKDAYS)}")
+        byday = tuple(sorted({WEEKDAYS.index(d) for d in days}))
+
+    if parts:
+        raise ValueError(f"Unsupported rrule part(s): {', '.join(sorted(parts))}")
+    return Rule(freq, interval, count, until, byday)
+
+
+def _iter_from(rule, dtstart, window_start):
+    """Yield occurrences in order, starting at the first one on or after window_start.
+
+    Jumps straight to the period containing window_start instead of walking
+    every occurrence since dtstart.
+    """
+    skip_days = max((window_start - dtstart).days, 0)
+
+    if rule.freq == 'DAILY' or (rule.freq == 'WEEKLY' and rule.byday is None):
+        step = rule.interval * (1 if rule.freq == 'DAILY' else 7)
+        try:
+            current = dtstart + timedelta(days=-(-skip_days // step) * step)
+            while True:
+                yield current
+                current += timedelta(days=step)
+        except OverflowError:  # Ran past date.max
+            return
+
+    elif rule.freq == 'WEEKLY':
+        week_start = dtstart - timedelta(days=dtstart.weekday())
+        period = 7 * rule.interval
+        try:
+            week = week_start + timedelta(days=(max((window_start - week_start).days, 0) // period) * period)
+            while True:
+                for weekday in rule.byday:
+                    current = week + timedelta(days=weekday)
+                    if current >= dtstart:
+                        yield current
+                week += timedelta(days=period)
+        except OverflowError:
+            return
+
+    else:
+        step = rule.interval * (12 if rule.freq == 'YEARLY' else 1)
+        months = (window_start.year - dtstart.year) * 12 + window_start.month - dtstart.month
+        index = -(-months // step) if months > 0 else 0
+        while True:
+            total = dtstart.month - 1 + index * step
+            year, month = dtstart.year + total // 12, total % 12 + 1
+            if year > FOREVER.year:
+                return
+            # Months without the start day (e.g. the 31st) have no occurrence
+            if dtstart.day <= calendar.monthrange(year, month)[1]:
+                yield date(year, month, dtstart.day)
+            index += 1
+
+
+@lru_cache(maxsize=16384)
+def last_occurrence(rule_text, dtstart):
+    """A date no occurrence falls after: UNTIL, the COUNT-th occurrence, or FOREVER."""
+    rule = parse_rrule(rule_text)
+    if rule.until is not None:
+        return rule.until
+    if rule.count is not None:
+        for index, current in enumerate(_iter_from(rule, dtstart, dtstart), 1):
+            if index == rule.count:
+                return current
+    return FOREVER
+
+
+def occurrences(rule_text, dtstart, window_start, window_end):
+    """Lazily yield a series' occurrence dates with window_start <= date <= window_end."""
+    rule = parse_rrule(rule_text)
+    end = min(window_end, last_occurrence(rule_text, dtstart))
+    for current in _iter_from(rule, dtstart, window_start):
+        if current > end:
+            return
+        if current >= window_start:
+            yield current
+
+
+@lru_cache(maxsize=65536)
+def expand(rule_text, dtstart, window_start, window_end):
+    """Memoized tuple of occurrences(), so repeated views of a window are free."""
+    return tuple(occurrences(rule_text, dtstart, window_start, window_end))
+
+
+def is_occurrence(rule_text, dtstart, day):
+    return bool(expand(rule_text, dtstart, day, day))
@@ -1,11 +1,26 @@
-import os
-from flask import Blueprint, request, jsonify, current_app, url_for, send_from_directory
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request, jsonify, current_app, url_for, send_from_directory, g, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
 from flask_cors import CORS, cross_origin
 from .db import db
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
-from app.models import Event, User, Task
+from datetime import datetime
+from sqlalchemy import select
+from app.models import Event, EventException, User, Task, Tombstone, Job
+from app.queries import task_list_query, encode_cursor
+from app.batch import apply_task_batch
+from app.sync import versioned_etag, page_end
+from app.database import read_replica
+from app.cache import response_cache
+from app.identity import identity
+from app.jobs import jobs
+from app.storage import storage, request_upload, UploadError
+from app.timeline import calendar, timeline_window, parse_date
+from app.recurrence import last_occurrence, is_occurrence
+from app.search import search_index, SEARCH_TYPES
+from app.transfer import (TRANSFER_FORMATS, EXPORT_TYPES, iter_ndjson_export, iter_csv_export, read_ndjson, read_csv,
+                          import_records)
+from app.serializers import (serialize_task, serialize_event, serialize_event_exception, serialize_job,
+                             iter_json_array, stream_json, stream_json_array, STREAM_CHUNK_ITEMS)
 
 api_bp = Blueprint('api', __name__)  # Correctly set the blueprint name
 
@@ -26,29 +41,48 @@ def options_upload():
 
 @api_bp.route('/tasks', methods=['GET'])
 @jwt_required()
+@read_replica
+@versioned_etag
+@response_cache.cached('tasks')
 def get_tasks():
     current_user = get_jwt_identity()
-    tasks = Task.query.filter_by(user_id=current_user['id']).all()
-    return jsonify([{
-        'id': t.id,
-        'title': t.title,
-        'completed': t.completed,
-        'created_at': t.created_at,
-        'updated_at': t.updated_at
-    } for t in tasks]), 200
+
+    try:
+        stmt, limit, fields = task_list_query(
+            current_user['id'],
+            request.args,
+            default_limit=current_app.config['TASKS_PAGE_DEFAULT_LIMIT'],
+            max_limit=current_app.config['TASKS_PAGE_MAX_LIMIT'],
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rows = db.session.execute(stmt).all()
+    return task_page(rows, limit, fields)
+
+def task_page(rows, limit, fields):
+    """Response for the rows of a task_list_query, with the next page's cursor and link."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # The next page is addressed by the (updated_at, id) of the last row returned
+    headers = {}
+    if has_more:
+        next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        headers['X-Next-Cursor'] = next_cursor
+        headers['Link'] = f'<{url_for("api.get_tasks", _external=True, **args)}>; rel="next"'
+    return stream_json_array(rows, serialize_task.only(fields), headers=headers)
 
 @api_bp.route('/tasks/<int:task_id>', methods=['GET'])
 @jwt_required()
+@read_replica
+@response_cache.cached('task')
 def get_task(task_id):
     task = Task.query.get(task_id)
     if task and task.user_id == get_jwt_identity()['id']:
-        return jsonify({
-            'id': task.id,
-            'title': task.title,
-            'completed': task.completed,
-            'created_at': task.created_at,
-            'updated_at': task.updated_at
-        }), 200
+        return jsonify(serialize_task(task)), 200
     return jsonify(message="Task not found"), 404
 
 @api_bp.route('/tasks', methods=['POST'])
@@ -89,13 +123,27 @@ def delete_task(task_id):
         return jsonify(message="Task deleted"), 200
     return jsonify(message="Task not found or unauthorized"), 404
 
+@api_bp.route('/tasks:batch', methods=['POST'])
+@jwt_required()
+def batch_tasks():
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'operations must be a non-empty list'}), 400
+    if len(operations) > current_app.config['TASK_BATCH_MAX_OPERATIONS']:
+        return jsonify({'error': f"At most {current_app.config['TASK_BATCH_MAX_OPERATIONS']} operations per batch"}), 413
+
+    results = apply_task_batch(get_jwt_identity()['id'], operations)
+    return jsonify({'results': results}), 200
+
 # --- USER ROUTE ---
 
 @api_bp.route('/user', methods=['PUT'])
 @jwt_required()
 def update_user_info():
     current_user = get_jwt_identity()
-    user = User.query.filter_by(id=current_user['id']).first()
+    user = db.session.get(User, current_user['id'])
     
     if not user:
         return jsonify(message="User not found"), 404
@@ -105,6 +153,7 @@ def update_user_info():
     user.email = data.get('email', user.email)
     
     db.session.commit()
+    identity.invalidate_user(user.id)
     return jsonify(message="User info updated successfully"), 200
 
 # --- PROFILE PICTURE UPLOAD ROUTE ---
@@ -112,65 +161,153 @@ def update_user_info():
 @api_bp.route('/upload', methods=['POST'])
 @cross_origin(origins=["http://localhost:8080"], supports_credentials=True)
 def upload():
-    if 'profile_picture' not in request.files:
+    source = request_upload(request, 'profile_picture')
+    if source is None:
         return jsonify({'message': 'No file uploaded'}), 400
 
-    file = request.files['profile_picture']
-    
-    # Save the file
-    upload_folder = os.path.join(current_app.root_path, 'static/uploads')
-    if not os.path.exists(upload_folder):
-        os.makedirs(upload_folder)
-
-    file_path = os.path.join(upload_folder, file.filename)
-    file.save(file_path)
+    # Uploads stay anonymous, but a signed-in uploader is recorded so the
+    # object can be removed with their account
+    user_id = get_jwt_identity()['id'] if verify_jwt_in_request(optional=True) else None
+    try:
+        stored = storage.save_stream(*source, user_id=user_id)
+    except UploadError as e:
+        return jsonify({'message': e.message}), e.status
+    db.session.commit()
 
     # Generate the URL to access the file
-    file_url = f"{request.host_url}static/uploads/{file.filename}"
+    file_url = url_for('api.get_media', path=stored.path, _external=True)
     
     return jsonify({'message': 'File uploaded successfully', 'profile_picture': file_url}), 200
 
+@api_bp.route('/media/<path:path>', methods=['GET'])
+def get_media(path):
+    if not path.startswith(('objects/', 'thumbs/')):
+        return jsonify(message="File not found"), 404
+
+    # Stored names are content hashes, so a URL's content never changes
+    max_age = current_app.config['MEDIA_MAX_AGE']
+    response = send_from_directory(storage.root, path, max_age=max_age)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    return response
+
 
 # --- TIMELINE ROUTES ---
 
 @api_bp.route('/timeline', methods=['GET'])
 @jwt_required()
+@read_replica
+@versioned_etag
+@response_cache.cached('timeline')
 def get_timeline_events():
     current_user = get_jwt_identity()
-    
-    # Get 'current_date' parameter from the request
-    current_date = request.args.get('current_date')  # 'YYYY-MM-DD'
-    
-    # Check if 'current_date' is provided
-    if not current_date:
-        return jsonify({'error': 'Missing current_date parameter'}), 400
-    
+
+    # Either from/to, or a week/month/±7 day view around current_date
     try:
-        # Parse 'current_date' string into a datetime object
-        current_date_obj = datetime.strptime(current_date, '%Y-%m-%d')
+        start_date, end_date = timeline_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Served from per-month buckets, reloaded only when the user's data changed
+    events_data = calendar.events_between(current_user['id'], start_date, end_date, g.change_version)
+
+    return stream_json_array(events_data)
+
+
+# --- SEARCH ROUTE ---
+
+@api_bp.route('/search', methods=['GET'])
+@jwt_required()
+@versioned_etag
+@response_cache.cached('search')
+def search():
+    current_user = get_jwt_identity()
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing q parameter'}), 400
+
+    try:
+        limit = min(int(request.args.get('limit', 20)), current_app.config['SEARCH_MAX_LIMIT'])
     except ValueError:
-        return jsonify({'error': 'Invalid date format, expected YYYY-MM-DD'}), 400
-    
-    # Calculate 7 days before and after the current date
-    start_date = current_date_obj - timedelta(days=7)
-    end_date = current_date_obj + timedelta(days=7)
-    
-    # Query the database for events in the date range for the current user
-    events = Event.query.filter_by(user_id=current_user['id']).filter(
-        Event.event_date.between(start_date, end_date)
-    ).order_by(Event.event_date.asc()).all()
-    
-    # Convert events to JSON format
-    events_data = [{
-        'id': event.id,
-        'title': event.title,
-        'description': event.description,
-        'event_date': event.event_date.isoformat(),  # Change this
-        'created_at': event.created_at.isoformat(),
-        'updated_at': event.updated_at.isoformat(),
-    } for event in events]
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    types = SEARCH_TYPES
+    if request.args.get('type'):
+        types = tuple(t for t in request.args['type'].split(',') if t in SEARCH_TYPES)
+        if not types:
+            return jsonify({'error': f"type must be one of {', '.join(SEARCH_TYPES)}"}), 400
+
+    results = search_index.search(current_user['id'], g.change_version, query, limit, types)
+    return jsonify(results), 200
+
 
-    return jsonify(events_data), 200  # This line should be indented properly
+# --- SYNC ROUTE ---
+
+@api_bp.route('/sync', methods=['GET'])
+@jwt_required()
+@versioned_etag
+def sync_changes():
+    current_user = get_jwt_identity()
+
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', current_app.config['SYNC_PAGE_DEFAULT_LIMIT']))
+    except ValueError:
+        return jsonify({'error': 'since and limit must be integers'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+    limit = min(limit, current_app.config['SYNC_PAGE_MAX_LIMIT'])
+
+    user_id = current_user['id']
+    version, pruned_version = db.session.execute(
+        select(User.change_version, User.tombstones_pruned_version).where(User.id == user_id)
+    ).one()
+    # Everything at or below `since` is already on the client
+    if since >= version:
+        return jsonify({
+            'version': version, 'next_since': None, 'tasks': [], 'events': [], 'event_exceptions': [],
+            'deleted': {'tasks': [], 'events': []},
+        }), 200
+    # Deletions after `since` may be gone; a client starting from 0 needs none
+    if 0 < since < pruned_version:
+        return jsonify({'error': 'Full resync required',
+                        'message': f'Changes before version {pruned_version} are no longer kept; sync from since=0'}), 410
+
+    # Pages end on a version boundary: the client stores `version` and asks
+    # for the next page with since=next_since until that is null
+    upto = page_end(user_id, since, version, limit)
+    next_since = upto if upto < version else None
+
+    def rows(stmt):
+        return db.session.scalars(stmt.execution_options(yield_per=STREAM_CHUNK_ITEMS))
+
+    def changed(model):
+        return (model.user_id == user_id, model.version > since, model.version <= upto)
+
+    def deleted(kind):
+        return rows(select(Tombstone.entity_id).where(*changed(Tombstone), Tombstone.entity_type == kind))
+
+    # Streamed one chunk of rows at a time, so a full resync does not buffer every
+    # row. The queries run inside the generator, once the response is being sent.
+    def body():
+        yield f'{{"version":{upto},"next_since":{"null" if next_since is None else next_since},"tasks":'
+        yield from iter_json_array(rows(select(Task).where(*changed(Task))), serialize_task)
+        yield ',"events":'
+        yield from iter_json_array(rows(select(Event).where(*changed(Event))), serialize_event)
+        # Exception changes touch their series, so exceptions of changed series are complete
+        yield ',"event_exceptions":'
+        yield from iter_json_array(rows(select(EventException).join(Event).where(
+            *changed(Event), Event.rrule.is_not(None)
+        )), serialize_event_exception)
+        yield ',"deleted":{"tasks":'
+        yield from iter_json_array(deleted('task'))
+        yield ',"events":'
+        yield from iter_json_array(deleted('event'))
+        yield '}}'
+
+    return stream_json(stream_with_context(body()))
 
 
 # --- EVENT ROUTES ---
@@ -184,9 +321,22 @@ def create_event():
     if 'title' not in data or 'event_date' not in data:
         return jsonify({'error': 'Title and event_date are required fields'}), 400
 
-    event_date_obj = datetime.strptime(data['event_date'], '%Y-%m-%d')
+    try:
+        event_date_obj = parse_date(data['event_date'])
+    except ValueError:
+        return jsonify({'error': 'Invalid date format for event_date, expected YYYY-MM-DD'}), 400
 
     new_event = Event(title=data['title'], description=data.get('description', ''), event_date=event_date_obj, user_id=current_user['id'])
+
+    # A recurring event is stored once as a series and expanded when read
+    if data.get('rrule'):
+        if not isinstance(data['rrule'], str) or len(data['rrule']) > 255:
+            return jsonify({'error': 'rrule must be a string of at most 255 characters'}), 400
+        try:
+            new_event.rrule = data['rrule']
+            new_event.recurrence_end = last_occurrence(data['rrule'], event_date_obj)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid rrule: {e}'}), 400
     db.session.add(new_event)
     db.session.commit()
 
@@ -205,9 +355,20 @@ def update_event(id):
     event.description = data.get('description', event.description)
     if 'event_date' in data:
         try:
-            event.event_date = datetime.strptime(data['event_date'], '%Y-%m-%d')
+            event.event_date = parse_date(data['event_date'])
         except ValueError:
             return jsonify({'error': 'Invalid date format for event_date, expected YYYY-MM-DD'}), 400
+    if 'rrule' in data:
+        if data['rrule'] and (not isinstance(data['rrule'], str) or len(data['rrule']) > 255):
+            return jsonify({'error': 'rrule must be a string of at most 255 characters'}), 400
+        event.rrule = data['rrule'] or None
+    if event.rrule:
+        try:
+            event.recurrence_end = last_occurrence(event.rrule, event.event_date)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid rrule: {e}'}), 400
+    else:
+        event.recurrence_end = None
 
     db.session.commit()
     return jsonify({'message': 'Event updated successfully'})
@@ -220,7 +381,127 @@ def delete_event(id):
     if event.user_id != get_jwt_identity()['id']:
         return jsonify({'error': 'Unauthorized'}), 403
 
+    EventException.query.filter_by(event_id=event.id).delete()
     db.session.delete(event)
     db.session.commit()
 
     return jsonify({'message': 'Event deleted successfully'})
+
+@api_bp.route('/events/<int:id>/occurrences/<occurrence_date>', methods=['PUT', 'DELETE'])
+@jwt_required()
+def update_occurrence(id, occurrence_date):
+    event = Event.query.get_or_404(id)
+
+    if event.user_id != get_jwt_identity()['id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    if not event.rrule:
+        return jsonify({'error': 'Event is not recurring'}), 400
+
+    try:
+        original_date = parse_date(occurrence_date)
+    except ValueError:
+        return jsonify({'error': 'Invalid date format, expected YYYY-MM-DD'}), 400
+    if not is_occurrence(event.rrule, event.event_date, original_date):
+        return jsonify({'error': 'No occurrence on that date'}), 404
+
+    exception = EventException.query.filter_by(event_id=event.id, original_date=original_date).first()
+    if exception is None:
+        exception = EventException(event_id=event.id, original_date=original_date)
+        db.session.add(exception)
+
+    # DELETE cancels the occurrence, PUT overrides its fields
+    if request.method == 'DELETE':
+        exception.cancelled = True
+    else:
+        data = request.json or {}
+        exception.cancelled = False
+        exception.title = data.get('title', exception.title)
+        exception.description = data.get('description', exception.description)
+        if data.get('event_date'):
+            try:
+                exception.event_date = parse_date(data['event_date'])
+            except ValueError:
+                return jsonify({'error': 'Invalid date format for event_date, expected YYYY-MM-DD'}), 400
+
+    # Touch the series so the change is versioned and reaches sync clients and caches
+    event.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    return jsonify({'message': 'Occurrence updated successfully'})
+
+
+# --- JOB ROUTES ---
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # The status URL handed out with a job carries a token, so it keeps
+    # working once the owner's JWTs are revoked (account deletion)
+    token = request.args.get('token')
+    if token is not None:
+        if not jobs.check_status_token(job_id, token):
+            return jsonify(message="Job not found"), 404
+    else:
+        verify_jwt_in_request()
+    job = db.session.get(Job, job_id)
+    if job is None or (token is None and job.user_id != get_jwt_identity()['id']):
+        return jsonify(message="Job not found"), 404
+    return jsonify(serialize_job(job)), 200
+
+
+# --- IMPORT / EXPORT ROUTES ---
+
+@api_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_data():
+    user_id = get_jwt_identity()['id']
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in TRANSFER_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(TRANSFER_FORMATS)}"}), 400
+    types = request.args.get('types', ','.join(EXPORT_TYPES)).split(',')
+    if not set(types) <= set(EXPORT_TYPES):
+        return jsonify({'error': f"types must be a comma-separated subset of {', '.join(EXPORT_TYPES)}"}), 400
+
+    # Rows are read through a server-side cursor while the response is sent
+    if fmt == 'csv':
+        chunks = iter_csv_export(user_id, types)
+    else:
+        chunks = iter_ndjson_export(user_id, types, current_app.json.dumps)
+    headers = {'Content-Disposition': f'attachment; filename="export.{fmt}"'}
+    return current_app.response_class(stream_with_context(chunks), headers=headers, mimetype=TRANSFER_FORMATS[fmt])
+
+@api_bp.route('/import', methods=['POST'])
+@jwt_required()
+def import_data():
+    user_id = get_jwt_identity()['id']
+    request.max_content_length = current_app.config['IMPORT_MAX_BYTES']
+
+    # A multipart 'file' field or the raw body, parsed as it is read
+    if 'file' in request.files:
+        upload = request.files['file']
+        stream, mimetype, filename = upload.stream, upload.mimetype, upload.filename or ''
+    else:
+        stream, mimetype, filename = request.stream, request.mimetype, ''
+    fmt = request.args.get('format') or ('csv' if mimetype == 'text/csv' or filename.endswith('.csv') else 'ndjson')
+    if fmt not in TRANSFER_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(TRANSFER_FORMATS)}"}), 400
+
+    try:
+        records = read_csv(stream) if fmt == 'csv' else read_ndjson(stream, current_app.json.loads)
+        report = import_records(
+            user_id, records,
+            batch_size=current_app.config['IMPORT_BATCH_SIZE'],
+            max_errors=current_app.config['IMPORT_MAX_ERRORS'],
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Batches were versioned, so caches keyed by version are already stale;
+    # drop this process' copies rather than patch them row by row
+    response_cache.invalidate_user(user_id)
+    calendar.invalidate_user(user_id)
+    search_index.invalidate_user(user_id)
+    # Unreadable part way through: the rows before it stay imported, and the
+    # report says how many and where to resume
+    if report['stopped'] is not None:
+        return jsonify({'error': report['stopped']['error'], **report}), 400
+    return jsonify(report), 200
@@ -0,0 +1,306 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, text, or_, literal
+from sqlalchemy.dialects.mysql import match
+from .db import db
+from app.models import Task, Event
+from app.sync import on_commit
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Title matches count for more than description matches
+TITLE_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+SEARCH_TYPES = ('task', 'event')
+
+
+def tokenize(value):
+    return TOKEN_RE.findall(value.lower()) if value else []
+
+
+class InvertedIndex:
+    """In-process inverted index over one user's task and event text.
+
+    Postings map each term to the weighted term frequency per document. Query
+    terms match as prefixes through a sorted term list, every term must match,
+    and documents are ranked by the sum of tf * idf over the query terms.
+    """
+
+    def __init__(self):
+        self.postings = {}  # term -> {doc_key: weighted tf}
+        self.doc_terms = {}  # doc_key -> Counter of weighted terms
+        self.docs = {}  # doc_key -> result summary
+        self._sorted_terms = None
+
+    def add(self, kind, doc_id, title, description=None, **extra):
+        key = (kind, doc_id)
+        self.remove(kind, doc_id)
+        terms = Counter()
+        for term in tokenize(title):
+            terms[term] += TITLE_WEIGHT
+        for term in tokenize(description):
+            terms[term] += DESCRIPTION_WEIGHT
+        for term, weight in terms.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                self._sorted_terms = None
+            self.postings[term][key] = weight
+        self.doc_terms[key] = terms
+        self.docs[key] = dict(extra, type=kind, id=doc_id, title=title)
+
+    def remove(self, kind, doc_id):
+        key = (kind, doc_id)
+        for term in self.doc_terms.pop(key, ()):
+            docs = self.postings[term]
+            docs.pop(key, None)
+            if not docs:
+                del self.postings[term]
+                self._sorted_terms = None
+        self.docs.pop(key, None)
+
+    def _expand_prefix(self, prefix):
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.postings)
+        terms = self._sorted_terms
+        i = bisect_left(terms, prefix)
+        while i < len(terms) and terms[i].startswith(prefix):
+            yield terms[i]
+            i += 1
+
+    def search(self, query, limit, types=SEARCH_TYPES):
+        query_terms = tokenize(query)
+        if not query_terms or not self.docs:
+            return []
+        total = len(self.docs)
+        scores = None
+        for prefix in query_terms:
+            term_scores = Counter()
+            for term in self._expand_prefix(prefix):
+                docs = self.postings[term]
+                idf = math.log(1 + total / len(docs))
+                for key, weight in docs.items():
+                    term_scores[key] += weight * idf
+            # Every query term has to match
+            scores = term_scores if scores is None else Counter(
+                {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+            )
+            if not scores:
+                return []
+        ranked = sorted(
+            (item for item in scores.items() if item[0][0] in types),
+            key=lambda item: (-item[1], item[0]),
+        )[:limit]
+        return [dict(self.docs[key], score=round(score, 4)) for key, score in ranked]
+
+
+class MemorySearch:
+    """Per-user InvertedIndexes built on first search and kept current from commits.
+
+    Each index is labelled with the user's change version, like the timeline
+    buckets: committed writes seen by this process are applied in place, and
+    a gap (a write made by another worker) drops the index for a rebuild.
+    """
+
+    def __init__(self, max_users=1000):
+        self.max_users = max_users
+        self._indexes = OrderedDict()  # user_id -> [version, InvertedIndex]
+        self._lock = threading.Lock()
+
+    def build(self, user_id):
+        index = InvertedIndex()
+        for task_id, title in db.session.execute(select(Task.id, Task.title).where(Task.user_id == user_id)):
+            index.add('task', task_id, title)
+        for event_id, title, description, event_date in db.session.execute(
+            select(Event.id, Event.title, Event.description, Event.event_date).where(Event.user_id == user_id)
+        ):
+            index.add('event', event_id, title, description, event_date=event_date.isoformat())
+        return index
+
+    def _index(self, user_id, version):
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._indexes.move_to_end(user_id)
+                return entry[1]
+        index = self.build(user_id)
+        with self._lock:
+            self._indexes[user_id] = [version, index]
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def search(self, user_id, version, query, limit, types):
+        index = self._index(user_id, version)
+        with self._lock:
+            return index.search(query, limit, types)
+
+    def apply_changes(self, changes):
+        with self._lock:
+            for change in sorted(changes, key=lambda c: c.version):
+                entry = self._indexes.get(change.user_id)
+                if entry is None:
+                    continue
+                if entry[0] not in (change.version - 1, change.version):
+                    del self._indexes[change.user_id]
+                    continue
+                entry[0] = change.version
+                index, fields = entry[1], change.fields
+                if change.deleted:
+                    index.remove(change.kind, change.entity_id)
+                elif change.kind == 'task' and 'title' in fields:
+                    index.add('task', change.entity_id, fields['title'])
+                elif change.kind == 'event':
+                    index.add('event', change.entity_id, fields['title'], fields.get('description'),
+                              event_date=fields['event_date'].isoformat())
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+
+class FulltextSearch:
+    """MySQL FULLTEXT search in boolean mode with a trailing * for prefix matching.
+
+    A required term that InnoDB does not index (a stopword, or shorter than
+    innodb_ft_min_token_size) makes a boolean query match nothing, so such
+    terms are matched with LIKE instead. Both settings are read from the
+    server on first use unless given.
+    """
+
+    def __init__(self, min_token_size=None, stopwords=None):
+        self.min_token_size = min_token_size
+        self.stopwords = stopwords
+
+    def _load_token_rules(self):
+        min_token_size, stopwords_enabled, stopword_table = db.session.execute(text(
+            'SELECT @@innodb_ft_min_token_size, @@innodb_ft_enable_stopword, @@innodb_ft_server_stopword_table'
+        )).one()
+        stopwords = set()
+        if stopwords_enabled:
+            source = (stopword_table.replace('/', '.') if stopword_table
+                      else 'INFORMATION_SCHEMA.INNODB_FT_DEFAULT_STOPWORD')
+            stopwords = {value.lower() for value in db.session.execute(text(f'SELECT value FROM {source}')).scalars()}
+        self.min_token_size, self.stopwords = min_token_size, stopwords
+
+    def split_terms(self, terms):
+        """Split query terms into (terms FULLTEXT can match, terms to match with LIKE)."""
+        if self.min_token_size is None or self.stopwords is None:
+            self._load_token_rules()
+        indexed, unindexed = [], []
+        for term in terms:
+            if len(term) < self.min_token_size or term in self.stopwords:
+                unindexed.append(term)
+            else:
+                indexed.append(term)
+        return indexed, unindexed
+
+    @staticmethod
+    def _conditions(columns, indexed, unindexed):
+        """The rank expression and filters matching every term against columns."""
+        conditions = [or_(*(column.contains(term, autoescape=True) for column in columns)) for term in unindexed]
+        if not indexed:
+            return literal(0.0), conditions
+        score = match(*columns, against=' '.join(f'+{term}*' for term in indexed)).in_boolean_mode()
+        return score, conditions + [score > 0]
+
+    def search(self, user_id, version, query, limit, types):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        indexed, unindexed = self.split_terms(terms)
+        results = []
+        if 'task' in types:
+            score, conditions = self._conditions((Task.title,), indexed, unindexed)
+            for task_id, title, rank in db.session.execute(
+                select(Task.id, Task.title, score)
+                .where(Task.user_id == user_id, *conditions).order_by(score.desc(), Task.id).limit(limit)
+            ):
+                results.append({'type': 'task', 'id': task_id, 'title': title, 'score': round(float(rank), 4)})
+        if 'event' in types:
+            score, conditions = self._conditions((Event.title, Event.description), indexed, unindexed)
+            for event_id, title, event_date, rank in db.session.execute(
+                select(Event.id, Event.title, Event.event_date, score)
+                .where(Event.user_id == user_id, *conditions).order_by(score.desc(), Event.id).limit(limit)
+            ):
+                results.append({'type': 'event', 'id': event_id, 'title': title,
+                                'event_date': event_date.isoformat(), 'score': round(float(rank), 4)})
+        results.sort(key=lambda r: (-r['score'], r['type'], r['id']))
+        return results[:limit]
+
+    def apply_changes(self, changes):
+        pass  # MySQL maintains FULLTEXT indexes itself
+
+    def invalidate_user(self, user_id):
+        pass
+
+
+class SearchIndex:
+    """Dispatches to the FULLTEXT backend on MySQL and the in-process index elsewhere."""
+
+    def __init__(self):
+        self.backend = MemorySearch()
+
+    def init_app(self, app):
+        name = app.config['SEARCH_BACKEND']
+        if name == 'auto':
+            name = 'fulltext' if app.config['SQLALCHEMY_DATABASE_URI'].startswith('mysql') else 'memory'
+        if name == 'fulltext':
+            self.backend = FulltextSearch()
+        elif name == 'memory':
+            self.backend = MemorySearch(app.config['SEARCH_INDEX_MAX_USERS'])
+        else:
+            raise ValueError(f'Unknown SEARCH_BACKEND: {name}')
+        app.cli.add_command(search_cli)
+        app.extensions['search_index'] = self
+
+    def search(self, user_id, version, query, limit, types=SEARCH_TYPES):
+        return self.backend.search(user_id, version, query, limit, types)
+
+    def invalidate_user(self, user_id):
+        self.backend.invalidate_user(user_id)
+
+
+search_index = SearchIndex()
+
+
+@on_commit
+def _update_search_index(changes):
+    search_index.backend.apply_changes(changes)
+
+
+# FULLTEXT indexes created by `flask search rebuild` on MySQL
+FULLTEXT_INDEXES = {
+    'ft_tasks_title': ('tasks', 'title'),
+    'ft_events_title_description': ('events', 'title, description'),
+}
+
+
+search_cli = AppGroup('search', help='Search index maintenance.')
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Add any missing FULLTEXT indexes on MySQL, which indexes every existing row.
+
+    The in-process backend has nothing to rebuild: each server process builds
+    a user's index from the database on their first search.
+    """
+    if not isinstance(search_index.backend, FulltextSearch):
+        click.echo('The in-process search backend needs no rebuild; indexes are built on first search.')
+        return
+    existing = {row[2] for table in ('tasks', 'events')
+                for row in db.session.execute(text(f'SHOW INDEX FROM {table}'))}
+    for name, (table, columns) in FULLTEXT_INDEXES.items():
+        if name in existing:
+            click.echo(f'{name} already exists')
+            continue
+        click.echo(f'Creating {name} on {table}({columns})...')
+        db.session.execute(text(f'ALTER TABLE {table} ADD FULLTEXT INDEX {name} ({columns})'))
+    db.session.commit()
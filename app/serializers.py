@@ -0,0 +1,172 @@
+import time
+from datetime import date
+from itertools import islice
+from operator import attrgetter
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+from .instrumentation import timed, current_spans
+
+try:
+    import orjson
+except ImportError:  # JSONProvider (stdlib json) is used without orjson
+    orjson = None
+
+# Items serialized per chunk of a streamed JSON array
+STREAM_CHUNK_ITEMS = 500
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+class Serializer:
+    """Turns model instances (or rows with the same attributes) into JSON-ready dicts.
+
+    The field list is read with one operator.attrgetter, built once, and its
+    values are zipped with the field names. Dates and datetimes are left as
+    they are and rendered as ISO 8601 by either JSON provider below;
+    converters apply to fields that must be converted up front.
+    """
+
+    def __init__(self, fields, converters=None):
+        self.fields = tuple(fields)
+        self.converters = dict(converters or {})
+        getter = attrgetter(*self.fields)
+        # attrgetter returns a bare value, not a 1-tuple, for a single field
+        self._values = getter if len(self.fields) > 1 else lambda obj: (getter(obj),)
+        self._convert = tuple((field, convert) for field, convert in self.converters.items() if field in self.fields)
+        self._subsets = {}
+
+    def __call__(self, obj):
+        data = dict(zip(self.fields, self._values(obj)))
+        for field, convert in self._convert:
+            value = data[field]
+            if value is not None:
+                data[field] = convert(value)
+        return data
+
+    def many(self, objs):
+        return [self(obj) for obj in objs]
+
+    def only(self, fields):
+        """A Serializer for a subset of the fields, built once per distinct subset."""
+        fields = tuple(fields)
+        if fields == self.fields:
+            return self
+        serializer = self._subsets.get(fields)
+        if serializer is None:
+            serializer = self._subsets[fields] = Serializer(fields, self.converters)
+        return serializer
+
+
+serialize_task = Serializer(('id', 'title', 'completed', 'created_at', 'updated_at'))
+
+# The timeline compares and sorts event dates as strings, so those are converted here
+serialize_event = Serializer(
+    ('id', 'title', 'description', 'event_date', 'rrule', 'created_at', 'updated_at'),
+    {'event_date': _isoformat},
+)
+
+serialize_event_exception = Serializer(
+    ('event_id', 'original_date', 'cancelled', 'title', 'description', 'event_date'),
+)
+
+serialize_job = Serializer(
+    ('id', 'kind', 'status', 'progress', 'error', 'attempts', 'created_at', 'started_at', 'finished_at'),
+)
+
+
+def iter_json_array(items, serialize=None, chunk_size=STREAM_CHUNK_ITEMS):
+    """Yield a JSON array of serialize(item) in chunks of chunk_size items.
+
+    Only one chunk is held at a time, so items can be a lazily fetched result
+    (e.g. a yield_per query) and memory stays flat however long the list is.
+    Without serialize, items are encoded as they are. The app's JSON provider
+    is looked up here, so the chunks can be produced outside the app context;
+    so is the request's 'serialize' span, which the encoding time is added to.
+    """
+    return _iter_json_array(current_app.json.dumps, iter(items), serialize, chunk_size, current_spans())
+
+
+def _iter_json_array(dumps, items, serialize, chunk_size, spans):
+    yield '['
+    separator = ''
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            break
+        start = time.perf_counter()
+        if serialize is not None:
+            chunk = [serialize(item) for item in chunk]
+        encoded = dumps(chunk)[1:-1]
+        if spans is not None:
+            spans['serialize'] += time.perf_counter() - start
+        yield separator + encoded
+        separator = ','
+    yield ']'
+
+
+def stream_json(chunks, status=200, headers=None):
+    """Response streaming pre-encoded JSON chunks.
+
+    Wrap chunks in flask.stream_with_context if producing them queries the
+    database or otherwise needs the request.
+    """
+    return current_app.response_class(chunks, status=status, headers=headers, mimetype='application/json')
+
+
+def stream_json_array(items, serialize=None, status=200, headers=None):
+    return stream_json(iter_json_array(items, serialize), status, headers)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's stdlib JSON provider, but with ISO 8601 dates instead of HTTP dates."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def response(self, *args, **kwargs):
+        with timed('serialize'):
+            return super().response(*args, **kwargs)
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson.
+
+    Output matches JSONProvider (sorted keys, ISO 8601 dates) but is compact
+    and encoded in C straight to bytes, dates included. Types orjson does not
+    know fall back to JSONProvider.default (e.g. Decimal).
+    """
+
+    def dumps(self, obj, **kwargs):
+        return self._dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def _dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+    def response(self, *args, **kwargs):
+        with timed('serialize'):
+            obj = self._prepare_response_obj(args, kwargs)
+            body = self._dumps_bytes(obj) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_app(app):
+    """Install the JSON provider named by JSON_PROVIDER ('auto' picks orjson when installed)."""
+    name = app.config['JSON_PROVIDER']
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name == 'orjson':
+        if orjson is None:
+            raise RuntimeError("JSON_PROVIDER='orjson' requires the orjson package")
+        app.json = OrjsonProvider(app)
+    elif name == 'json':
+        app.json = JSONProvider(app)
+    else:
+        raise ValueError(f'Unknown JSON_PROVIDER: {name}')
@@ -0,0 +1,248 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, Data, Epilogue, File
+from .db import db
+from app.models import Upload, User
+
+try:
+    from PIL import Image
+except ImportError:  # Thumbnails are skipped without Pillow
+    Image = None
+
+CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+StoredFile = namedtuple('StoredFile', 'path digest size created')
+
+
+class UploadError(Exception):
+    """Raised for uploads that cannot be stored; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class Storage:
+    """Content-addressed file storage for uploads.
+
+    Bodies (raw, or one multipart part, see request_upload) are streamed to
+    a temporary file in CHUNK_SIZE pieces while being hashed, then moved to
+    objects/<aa>/<bb>/<sha256>.<ext> under STORAGE_ROOT. Identical uploads
+    therefore share one file and can never overwrite a different one. Every
+    upload is recorded as an Upload row, so an object is only deleted once
+    no row and no profile picture refers to it. New images get thumbnails
+    rendered by a background thread pool (Pillow releases the GIL while
+    resizing).
+    """
+
+    def __init__(self):
+        self.root = None
+        self.max_bytes = None
+        self.allowed_extensions = frozenset()
+        self.thumbnail_sizes = ()
+        self._executor = None
+        self._executor_workers = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.root = app.config['STORAGE_ROOT'] or app.config['UPLOAD_FOLDER']
+        self.max_bytes = app.config['MAX_CONTENT_LENGTH']
+        self.allowed_extensions = frozenset(app.config['UPLOAD_ALLOWED_EXTENSIONS'])
+        self.thumbnail_sizes = tuple(app.config['STORAGE_THUMBNAIL_SIZES'])
+        self._executor_workers = app.config['STORAGE_THUMBNAIL_WORKERS']
+        os.makedirs(os.path.join(self.root, 'tmp'), exist_ok=True)
+        app.extensions['storage'] = self
+
+    def _extension(self, filename, content_type):
+        ext = ''
+        if filename and '.' in filename:
+            ext = filename.rsplit('.', 1)[1].lower()
+        elif content_type and content_type.startswith('image/'):
+            ext = content_type.split('/', 1)[1].split(';', 1)[0].strip().lower()
+        if ext == 'jpeg':
+            ext = 'jpg'
+        if ext not in self.allowed_extensions:
+            allowed = ', '.join(sorted(self.allowed_extensions))
+            raise UploadError(f'File type not allowed, expected one of: {allowed}', 415)
+        return ext
+
+    def save_stream(self, stream, filename=None, content_type=None, user_id=None):
+        """Stream a file-like object into storage and return a StoredFile.
+
+        The upload is recorded for user_id (None when anonymous) in the
+        session, which the caller commits.
+        """
+        ext = self._extension(filename, content_type)
+        digest = hashlib.sha256()
+        size = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if self.max_bytes is not None and size > self.max_bytes:
+                        raise UploadError('File too large', 413)
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            if size == 0:
+                raise UploadError('Empty file')
+
+            hexdigest = digest.hexdigest()
+            path = f'objects/{hexdigest[:2]}/{hexdigest[2:4]}/{hexdigest}.{ext}'
+            # Recorded before the object is placed: a concurrent delete_unreferenced
+            # either sees this row, or finished first and the object is written again
+            db.session.add(Upload(path=path, user_id=user_id))
+            db.session.flush()
+            full_path = self.full_path(path)
+            created = not os.path.exists(full_path)
+            if created:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(tmp_path, full_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        if created:
+            self._schedule_thumbnails(path)
+        return StoredFile(path, hexdigest, size, created)
+
+    def full_path(self, path):
+        return os.path.join(self.root, *path.split('/'))
+
+    def delete(self, path):
+        """Remove a stored file and its thumbnails; files already gone are ignored."""
+        for target in [path] + [self.thumbnail_path(path, size) for size in self.thumbnail_sizes]:
+            try:
+                os.remove(self.full_path(target))
+            except FileNotFoundError:
+                pass
+
+    def delete_unreferenced(self, path):
+        """Delete an object unless an upload or a live account's profile picture refers to it.
+
+        Call with the caller's own Upload rows already deleted, and commit
+        afterwards. The locking read holds off uploads of the same object
+        until then (a gap lock on MySQL, the write lock on SQLite). Returns
+        whether the object was deleted.
+        """
+        referenced = db.session.execute(
+            select(Upload.id).where(Upload.path == path).limit(1).with_for_update()
+        ).first() or db.session.execute(
+            # Pictures set before uploads were recorded have no Upload row
+            select(User.id).where(User.profile_picture == path, User.deleted_at.is_(None)).limit(1)
+        ).first()
+        if referenced:
+            return False
+        self.delete(path)
+        return True
+
+    def thumbnail_path(self, path, size):
+        digest = path.rsplit('/', 1)[1].split('.', 1)[0]
+        return f'thumbs/{digest[:2]}/{digest}_{size}.jpg'
+
+    def _schedule_thumbnails(self, path):
+        if Image is None or not self.thumbnail_sizes or self._executor_workers <= 0:
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._executor_workers, thread_name_prefix='thumbnails'
+                )
+        self._executor.submit(self._render_thumbnails, path)
+
+    def _render_thumbnails(self, path):
+        try:
+            with Image.open(self.full_path(path)) as image:
+                image = image.convert('RGB')
+                for size in self.thumbnail_sizes:
+                    thumb = image.copy()
+                    thumb.thumbnail((size, size))
+                    target = self.full_path(self.thumbnail_path(path, size))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    # Write then rename so readers never see a partial thumbnail
+                    tmp_target = f'{target}.{threading.get_ident()}.tmp'
+                    thumb.save(tmp_target, 'JPEG', quality=85)
+                    os.replace(tmp_target, target)
+        except Exception:
+            # Not every allowed upload is decodable; the original is still served
+            logger.exception('Could not render thumbnails for %s', path)
+
+
+class _MultipartFile:
+    """Read-only stream over one file part of a multipart body, parsed as it is read."""
+
+    def __init__(self, events):
+        self._events = events
+        self._buffer = b''
+        self._done = False
+
+    def read(self, size=-1):
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            event = next(self._events)
+            self._buffer += event.data
+            if not event.more_data:
+                self._done = True
+                # Parse the rest, so the body is consumed and malformed input still fails
+                for _ in self._events:
+                    pass
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def _multipart_events(request):
+    decoder = MultipartDecoder(request.mimetype_params['boundary'].encode(),
+                               max_form_memory_size=request.max_form_memory_size)
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError:
+            raise UploadError('Malformed multipart body')
+        if event is NEED_DATA:
+            decoder.receive_data(request.stream.read(CHUNK_SIZE) or None)
+        elif isinstance(event, Epilogue):
+            return
+        else:
+            yield event
+
+
+def request_upload(request, field):
+    """Return (stream, filename, content_type) for an upload, or None if there is none.
+
+    Accepts either a multipart form file in `field` or a raw image/* request
+    body. Neither goes through request.files: a multipart body is parsed from
+    the WSGI input with werkzeug's incremental MultipartDecoder, so the file
+    reaches save_stream chunk by chunk instead of being spooled to a
+    temporary file first. Parts before the file are skipped and the ones
+    after it are discarded. A malformed body counts as no upload, or makes
+    save_stream raise UploadError once the file has been found.
+    """
+    if request.mimetype == 'multipart/form-data' and 'boundary' in request.mimetype_params:
+        events = _multipart_events(request)
+        try:
+            for event in events:
+                if isinstance(event, File) and event.name == field:
+                    return _MultipartFile(events), event.filename, event.headers.get('Content-Type')
+        except UploadError:
+            pass
+        return None
+    if request.mimetype.startswith('image/'):
+        return request.stream, request.headers.get('X-Filename'), request.mimetype
+    return None
+
+
+storage = Storage()
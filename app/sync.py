@@ -0,0 +1,227 @@
+import hashlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import wraps
+import click
+from flask import request, current_app, g
+from flask.cli import AppGroup
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event, select, inspect, union_all, update, delete, func
+from .db import db
+from app.models import User, Task, Event, Tombstone
+
+# Models whose writes bump the owner's change version, keyed to their sync name
+SYNCED_MODELS = {Task: 'task', Event: 'event'}
+
+# One committed write to a synced row. fields holds the column values known at
+# flush time (for bulk updates, only the columns that were written).
+Change = namedtuple('Change', 'kind user_id entity_id version deleted fields')
+
+_commit_listeners = []
+
+
+def on_commit(listener):
+    """Register listener(changes) to be called after a commit that wrote synced rows.
+
+    Listeners run outside the transaction and must not use the session.
+    """
+    _commit_listeners.append(listener)
+    return listener
+
+
+def next_version(session, user_id):
+    """Atomically increment and return a user's change version.
+
+    The UPDATE takes a row lock on the user, so concurrent writers for the same
+    user are serialized and versions are never handed out twice.
+    """
+    users = User.__table__
+    connection = session.connection()
+    connection.execute(
+        users.update().where(users.c.id == user_id).values(change_version=users.c.change_version + 1)
+    )
+    return connection.execute(select(users.c.change_version).where(users.c.id == user_id)).scalar_one()
+
+
+def version_query(user_id):
+    return select(User.change_version).where(User.id == user_id)
+
+
+def current_version(user_id):
+    """Return a user's change version with a primary-key lookup on users."""
+    return db.session.execute(version_query(user_id)).scalar() or 0
+
+
+def request_version(user_id):
+    """current_version, looked up once per request and also left in g.change_version.
+
+    Remembered in the WSGI environ rather than g, which outlives the request
+    when an app context was already pushed (tests, scripts).
+    """
+    version = request.environ.get('app.change_version')
+    if version is None:
+        version = request.environ['app.change_version'] = current_version(user_id)
+    g.change_version = version
+    return version
+
+
+def page_end(user_id, since, version, limit):
+    """The last version a sync page after `since` covers, with at most about `limit` changed rows.
+
+    Returns version when everything fits. A page always ends on a version
+    boundary, because one version can stamp many rows (a batch or an import
+    chunk), so a page holding a single version may exceed the limit.
+    """
+    changed = union_all(*(
+        select(model.version.label('version')).where(model.user_id == user_id, model.version > since)
+        for model in (Task, Event, Tombstone)
+    )).subquery()
+    versions = db.session.scalars(select(changed.c.version).order_by(changed.c.version).limit(limit + 1)).all()
+    if len(versions) <= limit:
+        return version
+    boundary = versions[limit]
+    return boundary if versions[0] == boundary else boundary - 1
+
+
+def prune_tombstones(session, before):
+    """Delete tombstones recorded before `before` and return how many went.
+
+    Each affected user's tombstones_pruned_version moves up to the newest
+    pruned version, so /api/sync can tell clients that last synced before it
+    to start over instead of silently missing those deletions.
+    """
+    pruned = session.execute(
+        select(Tombstone.user_id, func.max(Tombstone.version))
+        .where(Tombstone.deleted_at < before).group_by(Tombstone.user_id)
+    ).all()
+    for user_id, version in pruned:
+        session.execute(update(User).where(User.id == user_id, User.tombstones_pruned_version < version)
+                        .values(tombstones_pruned_version=version))
+    count = session.execute(delete(Tombstone).where(Tombstone.deleted_at < before)).rowcount
+    session.commit()
+    return count
+
+
+sync_cli = AppGroup('sync', help='Sync feed maintenance.')
+
+
+@sync_cli.command('prune-tombstones')
+def prune_tombstones_command():
+    """Delete tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS; run it daily."""
+    before = datetime.utcnow() - timedelta(days=current_app.config['SYNC_TOMBSTONE_RETENTION_DAYS'])
+    click.echo(f'{prune_tombstones(db.session, before)} tombstone(s) pruned')
+
+
+def version_etag(user_id, version):
+    """The weak ETag of the current request for a user at a change version."""
+    query_hash = hashlib.sha1(request.full_path.encode()).hexdigest()[:16]
+    return f'{user_id}-{version}-{query_hash}'
+
+
+def _snapshot(obj):
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+
+
+def record_bulk_changes(session, kind, user_id, updated_rows=(), deleted_ids=(), created_rows=()):
+    """Version writes that bypass the unit of work (bulk INSERT / UPDATE / DELETE).
+
+    Stamps each row dict in created_rows and updated_rows with the new
+    version, so it must be called before the bulk statements run, and queues
+    tombstones for deleted_ids. Created rows have no id yet: pass them to
+    record_bulk_inserts once inserted. Returns the version assigned.
+    """
+    version = next_version(session, user_id)
+    for row in created_rows:
+        row['version'] = version
+    changes = session.info.setdefault('sync_changes', [])
+    for row in updated_rows:
+        row['version'] = version
+        changes.append(Change(kind, user_id, row['id'], version, False, dict(row)))
+    for entity_id in deleted_ids:
+        session.add(Tombstone(user_id=user_id, entity_type=kind, entity_id=entity_id, version=version))
+        changes.append(Change(kind, user_id, entity_id, version, True, {}))
+    return version
+
+
+def record_bulk_inserts(session, kind, user_id, rows, version):
+    """Record rows from a bulk INSERT, each dict holding its new 'id'."""
+    changes = session.info.setdefault('sync_changes', [])
+    for row in rows:
+        changes.append(Change(kind, user_id, row['id'], version, False, dict(row)))
+
+
+@event.listens_for(db.session, 'before_flush')
+def _stamp_versions(session, flush_context, instances):
+    touched = {}
+    for obj in session.new:
+        if type(obj) in SYNCED_MODELS and obj.user_id is not None:
+            touched.setdefault(obj.user_id, []).append((obj, False))
+    for obj in session.dirty:
+        if type(obj) in SYNCED_MODELS and session.is_modified(obj, include_collections=False):
+            touched.setdefault(obj.user_id, []).append((obj, False))
+    for obj in session.deleted:
+        if type(obj) in SYNCED_MODELS:
+            touched.setdefault(obj.user_id, []).append((obj, True))
+
+    pending = session.info.setdefault('sync_pending', [])
+    for user_id, objs in touched.items():
+        version = next_version(session, user_id)
+        for obj, deleted in objs:
+            if deleted:
+                session.add(Tombstone(
+                    user_id=user_id, entity_type=SYNCED_MODELS[type(obj)], entity_id=obj.id, version=version
+                ))
+            else:
+                obj.version = version
+            pending.append((obj, deleted, version))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changes(session, flush_context):
+    # Primary keys of new rows are only known once the flush has run
+    pending = session.info.pop('sync_pending', [])
+    changes = session.info.setdefault('sync_changes', [])
+    for obj, deleted, version in pending:
+        changes.append(Change(
+            SYNCED_MODELS[type(obj)], obj.user_id, obj.id, version, deleted, _snapshot(obj)
+        ))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_listeners(session):
+    changes = session.info.pop('sync_changes', None)
+    if changes:
+        for listener in _commit_listeners:
+            listener(changes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('sync_pending', None)
+    session.info.pop('sync_changes', None)
+
+
+def versioned_etag(view):
+    """Serve a user-scoped GET with a weak ETag derived from the change version.
+
+    The ETag combines the user's change version with the request path and
+    query string, so If-None-Match is answered with a 304 after a single
+    primary-key lookup on users, without running the view. The version is left
+    in g.change_version for the view and response cache. Must be applied
+    inside jwt_required (and read_replica, when used).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = get_jwt_identity()['id']
+        etag = version_etag(user_id, request_version(user_id))
+
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
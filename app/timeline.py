@@ -0,0 +1,340 @@
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, timedelta
+from sqlalchemy import select
+from .db import db
+from app.models import Event, EventException
+from app.sync import on_commit
+from app.recurrence import expand, is_occurrence
+from app.serializers import serialize_event
+
+# Widest window a single timeline request may ask for
+MAX_WINDOW_DAYS = 366
+
+# Approximate memory of a cached event beyond its title and description
+# (the dict, its timestamps and date string), and of an occurrence exception
+EVENT_OVERHEAD_BYTES = 500
+EXCEPTION_OVERHEAD_BYTES = 200
+
+
+def _event_bytes(event):
+    return EVENT_OVERHEAD_BYTES + len(event['title']) + len(event['description'] or '')
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD string into a date, raising ValueError otherwise."""
+    if not isinstance(value, str) or len(value) != 10:
+        raise ValueError(value)
+    return date.fromisoformat(value)
+
+
+def timeline_window(args):
+    """Resolve the inclusive (start, end) dates a timeline request covers.
+
+    Either an explicit from/to pair, or a view around current_date: 'week'
+    (Monday to Sunday), 'month' (the calendar month) or, by default, seven
+    days either side. Raises ValueError with a client-facing message.
+    """
+    if args.get('from') or args.get('to'):
+        if not (args.get('from') and args.get('to')):
+            raise ValueError('Both from and to are required')
+        try:
+            start, end = parse_date(args['from']), parse_date(args['to'])
+        except ValueError:
+            raise ValueError('Invalid date format, expected YYYY-MM-DD')
+        if end < start:
+            raise ValueError('to must not be before from')
+        if (end - start).days > MAX_WINDOW_DAYS:
+            raise ValueError(f'Window may span at most {MAX_WINDOW_DAYS} days')
+        return start, end
+
+    if not args.get('current_date'):
+        raise ValueError('Missing current_date parameter')
+    try:
+        current = parse_date(args['current_date'])
+    except ValueError:
+        raise ValueError('Invalid date format, expected YYYY-MM-DD')
+
+    view = args.get('view')
+    if view == 'week':
+        start = current - timedelta(days=current.weekday())
+        return start, start + timedelta(days=6)
+    if view == 'month':
+        return current.replace(day=1), _month_end(current.year, current.month)
+    if view is not None:
+        raise ValueError('view must be week or month')
+    return current - timedelta(days=7), current + timedelta(days=7)
+
+
+def _month_end(year, month):
+    first_of_next = date(year + month // 12, month % 12 + 1, 1)
+    return first_of_next - timedelta(days=1)
+
+
+def _months(start, end):
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield year, month
+        year, month = year + month // 12, month % 12 + 1
+
+
+class _Fields:
+    """Attribute view over a change snapshot so serialize_event can read it."""
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+
+# Detached copy of an EventException row, safe to keep across requests
+_Exception = namedtuple('_Exception', 'original_date cancelled title description event_date')
+
+
+class _Series:
+    """A recurring event with its exceptions keyed by the occurrence they replace."""
+
+    __slots__ = ('event', 'rrule', 'dtstart', 'recurrence_end', 'exceptions', 'size')
+
+    def __init__(self, event, exceptions):
+        self.event = serialize_event(event)
+        self.rrule = event.rrule
+        self.dtstart = event.event_date
+        self.recurrence_end = event.recurrence_end
+        self.exceptions = {
+            e.original_date: _Exception(e.original_date, e.cancelled, e.title, e.description, e.event_date)
+            for e in exceptions
+        }
+        self.size = _event_bytes(self.event) + sum(
+            EXCEPTION_OVERHEAD_BYTES + len(e.title or '') + len(e.description or '') for e in self.exceptions.values()
+        )
+
+    def occurrence(self, original_date, exception=None):
+        occurrence = dict(self.event, event_date=original_date.isoformat(), occurrence_date=original_date.isoformat())
+        if exception is not None:
+            if exception.title is not None:
+                occurrence['title'] = exception.title
+            if exception.description is not None:
+                occurrence['description'] = exception.description
+            if exception.event_date is not None:
+                occurrence['event_date'] = exception.event_date.isoformat()
+        return occurrence
+
+    def between(self, start, end):
+        """Occurrences with start <= event_date <= end, after exceptions are applied."""
+        results = []
+        if self.dtstart <= end and self.recurrence_end >= start:
+            for day in expand(self.rrule, self.dtstart, start, end):
+                exception = self.exceptions.get(day)
+                if exception is None:
+                    results.append(self.occurrence(day))
+                elif not exception.cancelled and start <= (exception.event_date or day) <= end:
+                    results.append(self.occurrence(day, exception))
+        # Occurrences moved into the window from outside it
+        for day, exception in self.exceptions.items():
+            if (not exception.cancelled and exception.event_date is not None
+                    and start <= exception.event_date <= end and not start <= day <= end
+                    and is_occurrence(self.rrule, self.dtstart, day)):
+                results.append(self.occurrence(day, exception))
+        return results
+
+
+class EventCalendar:
+    """Per-user, per-month buckets of serialized events.
+
+    A bucket holds every single (non-recurring) event of one user in one
+    calendar month, labelled with the user's change version at load time. A
+    read for a given version reuses the bucket only if the labels match, so a
+    month view is one dict lookup and any write made elsewhere forces a reload
+    of just that month. Writes committed in this process are applied to loaded
+    buckets in place and advance their label, so they do not cost a reload.
+
+    Recurring events are kept per user as a list of series, labelled the same
+    way, and expanded lazily into the requested window only.
+
+    Buckets are capped at max_buckets months and series at max_series_users
+    users. Both also share max_bytes, an estimate from the events' text and
+    EVENT_OVERHEAD_BYTES, so a few crowded months cannot take unbounded
+    memory. Past it, the least recently used month buckets go first (one
+    indexed query to reload), then series.
+    """
+
+    def __init__(self, max_buckets=5000, max_series_users=1000, max_bytes=64 * 1024 * 1024):
+        self.max_buckets = max_buckets
+        self.max_series_users = max_series_users
+        self.max_bytes = max_bytes
+        self._buckets = OrderedDict()  # (user_id, year, month) -> [version, {event_id: event}, bytes]
+        self._user_months = {}
+        self._series = OrderedDict()  # user_id -> [version, {event_id: _Series}, bytes]
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_buckets = app.config['TIMELINE_CACHE_MAX_MONTHS']
+        self.max_series_users = app.config['TIMELINE_CACHE_MAX_SERIES_USERS']
+        self.max_bytes = app.config['TIMELINE_CACHE_MAX_BYTES']
+        app.extensions['event_calendar'] = self
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._drop_series(user_id)
+            for key in list(self._user_months.get(user_id, ())):
+                self._drop(key)
+
+    def _drop(self, key):
+        bucket = self._buckets.pop(key, None)
+        if bucket is not None:
+            self._bytes -= bucket[2]
+        months = self._user_months.get(key[0])
+        if months is not None:
+            months.discard(key)
+            if not months:
+                del self._user_months[key[0]]
+
+    def _drop_series(self, user_id):
+        entry = self._series.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _evict(self):
+        while len(self._buckets) > self.max_buckets:
+            self._drop(next(iter(self._buckets)))
+        while len(self._series) > self.max_series_users:
+            self._drop_series(next(iter(self._series)))
+        while self._bytes > self.max_bytes and (self._buckets or self._series):
+            if self._buckets:
+                self._drop(next(iter(self._buckets)))
+            else:
+                self._drop_series(next(iter(self._series)))
+
+    def _load_month(self, user_id, year, month):
+        rows = db.session.execute(
+            select(Event).where(
+                Event.user_id == user_id,
+                Event.event_date.between(date(year, month, 1), _month_end(year, month)),
+                Event.rrule.is_(None),
+            )
+        ).scalars()
+        return {event.id: serialize_event(event) for event in rows}
+
+    def _load_series(self, user_id):
+        # Only recurring events have a recurrence_end, so this stays on the index
+        events = db.session.execute(
+            select(Event).where(Event.user_id == user_id, Event.recurrence_end >= date.min)
+        ).scalars().all()
+        exceptions = {}
+        if events:
+            for exception in db.session.execute(
+                select(EventException).where(EventException.event_id.in_([e.id for e in events]))
+            ).scalars():
+                exceptions.setdefault(exception.event_id, []).append(exception)
+        return {e.id: _Series(e, exceptions.get(e.id, ())) for e in events}
+
+    def _user_series(self, user_id, version):
+        with self._lock:
+            entry = self._series.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._series.move_to_end(user_id)
+                return entry[1]
+
+        series = self._load_series(user_id)
+        with self._lock:
+            self._drop_series(user_id)
+            size = sum(s.size for s in series.values())
+            self._series[user_id] = [version, series, size]
+            self._bytes += size
+            self._evict()
+        return series
+
+    def _bucket(self, user_id, year, month, version):
+        key = (user_id, year, month)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None and bucket[0] == version:
+                self._buckets.move_to_end(key)
+                return bucket[1]
+
+        events = self._load_month(user_id, year, month)
+        with self._lock:
+            self._drop(key)
+            size = sum(_event_bytes(e) for e in events.values())
+            self._buckets[key] = [version, events, size]
+            self._bytes += size
+            self._user_months.setdefault(user_id, set()).add(key)
+            self._evict()
+        return events
+
+    def events_between(self, user_id, start, end, version):
+        """Serialized events for a user with start <= event_date <= end, by date."""
+        buckets = [self._bucket(user_id, year, month, version) for year, month in _months(start, end)]
+        return _window(buckets, self._user_series(user_id, version), start, end)
+
+    def loaded_events_between(self, user_id, start, end, version):
+        """events_between if every bucket it needs is loaded and current, else None.
+
+        Never queries the database, so it can run on an event loop.
+        """
+        keys = [(user_id, year, month) for year, month in _months(start, end)]
+        with self._lock:
+            buckets = [self._buckets.get(key) for key in keys]
+            series = self._series.get(user_id)
+            if series is None or series[0] != version or any(b is None or b[0] != version for b in buckets):
+                return None
+            for key in keys:
+                self._buckets.move_to_end(key)
+            self._series.move_to_end(user_id)
+        return _window([bucket[1] for bucket in buckets], series[1], start, end)
+
+    def apply_changes(self, changes):
+        """Fold committed changes into loaded buckets, dropping any that fell behind."""
+        with self._lock:
+            for change in sorted(changes, key=lambda c: c.version):
+                entry = self._series.get(change.user_id)
+                if entry is not None:
+                    touches_series = change.kind == 'event' and (
+                        change.entity_id in entry[1] or change.fields.get('rrule') is not None
+                    )
+                    if touches_series or entry[0] not in (change.version - 1, change.version):
+                        self._drop_series(change.user_id)
+                    else:
+                        entry[0] = change.version
+
+                for key in list(self._user_months.get(change.user_id, ())):
+                    bucket = self._buckets[key]
+                    if bucket[0] not in (change.version - 1, change.version):
+                        # A write from another process was missed
+                        self._drop(key)
+                        continue
+                    bucket[0] = change.version
+                    if change.kind == 'event':
+                        removed = bucket[1].pop(change.entity_id, None)
+                        if removed is not None:
+                            bucket[2] -= _event_bytes(removed)
+                            self._bytes -= _event_bytes(removed)
+
+                if change.kind != 'event' or change.deleted or change.fields.get('rrule') is not None:
+                    continue
+                event_date = change.fields['event_date']
+                bucket = self._buckets.get((change.user_id, event_date.year, event_date.month))
+                if bucket is not None:
+                    event = bucket[1][change.entity_id] = serialize_event(_Fields(change.fields))
+                    bucket[2] += _event_bytes(event)
+                    self._bytes += _event_bytes(event)
+            self._evict()
+
+
+def _window(buckets, series, start, end):
+    start_iso, end_iso = start.isoformat(), end.isoformat()
+    events = []
+    for bucket in buckets:
+        events.extend(e for e in bucket.values() if start_iso <= e['event_date'] <= end_iso)
+    for recurring in series.values():
+        events.extend(recurring.between(start, end))
+    events.sort(key=lambda e: (e['event_date'], e['id']))
+    return events
+
+
+calendar = EventCalendar()
+
+
+@on_commit
+def _update_calendar(changes):
+    calendar.apply_changes(changes)
@@ -0,0 +1,371 @@
+import csv
+import io
+from array import array
+from datetime import datetime, timezone
+from sqlalchemy import select, insert, update, func
+from .db import db
+from app.models import Task, Event, EventException
+from app.batch import validate_task_values
+from app.recurrence import last_occurrence
+from app.serializers import serialize_task, serialize_event, serialize_event_exception
+from app.sync import next_version
+from app.timeline import parse_date
+
+TRANSFER_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_TYPES = ('tasks', 'events')
+
+# Columns of the CSV format; 'type' is task, event or exception and id is ignored on import.
+# An exception's 'event' is the 1-based position of its event among the file's event records.
+CSV_COLUMNS = ('type', 'id', 'title', 'completed', 'description', 'event_date', 'rrule', 'created_at', 'updated_at',
+               'event', 'original_date', 'cancelled')
+
+# Exception fields exported as they are; the event they belong to is given by position
+EXCEPTION_FIELDS = ('original_date', 'cancelled', 'title', 'description', 'event_date')
+
+# Rows fetched per round trip from the server-side cursor, and per yielded chunk
+EXPORT_CHUNK_ROWS = 1000
+
+
+def _export_records(user_id, types):
+    """Yield a user's tasks, events, then event exceptions, as dicts tagged with their type.
+
+    Events come in id order, and each exception carries its event's position
+    in that order as 'event', which import maps to the event's new id.
+    """
+    models = (('tasks', 'task', Task, serialize_task), ('events', 'event', Event, serialize_event))
+    for name, kind, model, serialize in models:
+        if name not in types:
+            continue
+        stmt = (select(*[getattr(model, field) for field in serialize.fields])
+                .where(model.user_id == user_id).order_by(model.id)
+                .execution_options(yield_per=EXPORT_CHUNK_ROWS))
+        for row in db.session.execute(stmt):
+            record = serialize(row)
+            record['type'] = kind
+            yield record
+    if 'events' not in types:
+        return
+    positions = (select(Event.id, func.row_number().over(order_by=Event.id).label('position'))
+                 .where(Event.user_id == user_id).subquery())
+    serialize = serialize_event_exception.only(EXCEPTION_FIELDS)
+    stmt = (select(positions.c.position, *[getattr(EventException, field) for field in EXCEPTION_FIELDS])
+            .join(positions, EventException.event_id == positions.c.id)
+            .order_by(positions.c.position, EventException.original_date)
+            .execution_options(yield_per=EXPORT_CHUNK_ROWS))
+    for row in db.session.execute(stmt):
+        record = serialize(row)
+        record['type'] = 'exception'
+        record['event'] = row.position
+        yield record
+
+
+def iter_ndjson_export(user_id, types, dumps):
+    """Yield one JSON object per line, EXPORT_CHUNK_ROWS lines at a time."""
+    lines = []
+    for record in _export_records(user_id, types):
+        lines.append(dumps(record))
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def iter_csv_export(user_id, types):
+    """Yield a CSV with a CSV_COLUMNS header, EXPORT_CHUNK_ROWS rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for count, record in enumerate(_export_records(user_id, types), 1):
+        writer.writerow([_csv_value(record.get(column)) for column in CSV_COLUMNS])
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class UnreadableInput(Exception):
+    """Raised when an import cannot be read past a line (bad encoding or CSV syntax)."""
+
+    def __init__(self, message, line):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+
+
+def _text(stream):
+    if isinstance(stream, io.RawIOBase):
+        stream = io.BufferedReader(stream)
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def read_ndjson(stream, loads):
+    """Yield (line number, record, error) for each non-blank line of an NDJSON stream.
+
+    Raises UnreadableInput with the first line not read if the stream is not UTF-8.
+    """
+    number = 0
+    try:
+        for number, line in enumerate(_text(stream), 1):
+            if not line.strip():
+                continue
+            try:
+                record = loads(line)
+            except ValueError:
+                yield number, None, 'Invalid JSON'
+                continue
+            if not isinstance(record, dict):
+                yield number, None, 'Expected a JSON object'
+                continue
+            yield number, record, None
+    except UnicodeDecodeError:
+        raise UnreadableInput('The file must be UTF-8 encoded', number + 1)
+
+
+def read_csv(stream):
+    """Yield (line number, record, error) for each row of a CSV stream with a header.
+
+    Empty cells are left out, and completed and cancelled are read as true/false or 1/0.
+    Raises ValueError when the header has no type column, and UnreadableInput
+    with the line it stopped at if the stream is not UTF-8 or not valid CSV.
+    """
+    reader = csv.DictReader(_text(stream))
+    try:
+        if reader.fieldnames is None or 'type' not in reader.fieldnames:
+            raise ValueError('The CSV header must include a type column')
+        for row in reader:
+            record = {key: value for key, value in row.items() if key is not None and value != ''}
+            for flag in ('completed', 'cancelled'):
+                value = record.get(flag)
+                if value is not None:
+                    record[flag] = {'true': True, 'false': False, '1': True, '0': False}.get(value.lower(), value)
+            yield reader.line_num, record, None
+    except UnicodeDecodeError:
+        raise UnreadableInput('The file must be UTF-8 encoded', reader.line_num + 1)
+    except csv.Error as e:
+        raise UnreadableInput(f'Invalid CSV: {e}', reader.line_num)
+
+
+def _timestamp(record, name, default):
+    value = record.get(name)
+    if value is None:
+        return default
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an ISO 8601 datetime')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _task_row(record, user_id, now):
+    values, error = validate_task_values(record, require_title=True)
+    if error:
+        raise ValueError(error)
+    created_at = _timestamp(record, 'created_at', now)
+    return {
+        'title': values['title'],
+        'completed': values.get('completed', False),
+        'user_id': user_id,
+        'created_at': created_at,
+        'updated_at': _timestamp(record, 'updated_at', created_at),
+    }
+
+
+def _event_row(record, user_id, now):
+    title = record.get('title')
+    if not isinstance(title, str) or not title or len(title) > 255:
+        raise ValueError('title must be a non-empty string of at most 255 characters')
+    description = record.get('description', '')
+    if description is not None and not isinstance(description, str):
+        raise ValueError('description must be a string')
+    try:
+        event_date = parse_date(record.get('event_date'))
+    except ValueError:
+        raise ValueError('event_date must be a date in YYYY-MM-DD format')
+    rrule = record.get('rrule') or None
+    recurrence_end = None
+    if rrule is not None:
+        if not isinstance(rrule, str) or len(rrule) > 255:
+            raise ValueError('rrule must be a string of at most 255 characters')
+        try:
+            recurrence_end = last_occurrence(rrule, event_date)
+        except ValueError as e:
+            raise ValueError(f'Invalid rrule: {e}')
+    created_at = _timestamp(record, 'created_at', now)
+    return {
+        'title': title,
+        'description': description,
+        'event_date': event_date,
+        'rrule': rrule,
+        'recurrence_end': recurrence_end,
+        'user_id': user_id,
+        'created_at': created_at,
+        'updated_at': _timestamp(record, 'updated_at', created_at),
+    }
+
+
+def _optional_date(record, name):
+    value = record.get(name)
+    if value is None:
+        return None
+    try:
+        return parse_date(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a date in YYYY-MM-DD format')
+
+
+def _exception_row(record, events):
+    """Return (event position, row) for an exception record.
+
+    events holds an entry per event record read so far, 0 for those that
+    were skipped as invalid.
+    """
+    position = record.get('event')
+    if isinstance(position, str) and position.isdigit():
+        position = int(position)  # CSV cells are strings
+    if isinstance(position, bool) or not isinstance(position, int) or not 1 <= position <= len(events):
+        raise ValueError('event must be the position of an earlier event record')
+    if not events[position - 1]:
+        raise ValueError(f'event {position} was not imported')
+    original_date = _optional_date(record, 'original_date')
+    if original_date is None:
+        raise ValueError('original_date is required')
+    cancelled = record.get('cancelled', False)
+    if not isinstance(cancelled, bool):
+        raise ValueError('cancelled must be a boolean')
+    title = record.get('title')
+    if title is not None and (not isinstance(title, str) or len(title) > 255):
+        raise ValueError('title must be a string of at most 255 characters')
+    description = record.get('description')
+    if description is not None and not isinstance(description, str):
+        raise ValueError('description must be a string')
+    return position, {
+        'original_date': original_date,
+        'cancelled': cancelled,
+        'title': title,
+        'description': description,
+        'event_date': _optional_date(record, 'event_date'),
+    }
+
+
+IMPORT_TYPES = {'task': (Task, _task_row), 'event': (Event, _event_row)}
+
+# Entry in the position -> new event id map for an event not inserted yet
+_PENDING_EVENT = -1
+
+
+def import_records(user_id, records, batch_size=1000, max_errors=1000):
+    """Insert records from read_ndjson or read_csv for a user, batch_size rows at a time.
+
+    Each batch is one transaction: the user's change version is bumped once
+    and the batch's tasks and events go in as multi-row INSERTs stamped with
+    it, so sync clients and version-keyed caches see the new rows. Invalid
+    records are skipped and reported by line number, at most max_errors of
+    them in detail. ids in the input are ignored; rows get new ids. If the
+    input becomes unreadable (UnreadableInput), the rows before that point
+    are still imported and the report's 'stopped' says where and why.
+
+    Exception records name their event by its position among the event
+    records before them, as export writes them. The new id of every event
+    read is kept to resolve them, in an array of 8 bytes per event.
+
+    Returns a report dict with the rows imported per type and the errors.
+    """
+    report = {'imported': {'tasks': 0, 'events': 0, 'exceptions': 0}, 'errors': [], 'error_count': 0,
+              'stopped': None}
+    pending = {Task: [], Event: []}
+    pending_positions = []  # Position of each row in pending[Event]
+    pending_exceptions = []  # (event position, row)
+    events = array('q')  # New id per event position, 0 if skipped
+    seen_exceptions = set()  # (event position, original_date), which must be unique
+    size = 0
+
+    def flush():
+        version = next_version(db.session, user_id)
+        for model, rows in pending.items():
+            if rows:
+                for row in rows:
+                    row['version'] = version
+                # Against the table, not the mapper: the ORM's bulk path regroups
+                # the rows by their None values and costs a quarter more time
+                db.session.execute(insert(model.__table__), rows)
+                report['imported'][model.__tablename__] += len(rows)
+                rows.clear()
+        if pending_positions:
+            # The batch's events are the user's only rows at this version, and
+            # get ascending ids in the order they were inserted
+            new_ids = db.session.scalars(
+                select(Event.id).where(Event.user_id == user_id, Event.version == version).order_by(Event.id)
+            )
+            for position, event_id in zip(pending_positions, new_ids):
+                events[position - 1] = event_id
+            pending_positions.clear()
+        if pending_exceptions:
+            rows = []
+            for position, row in pending_exceptions:
+                row['event_id'] = events[position - 1]
+                rows.append(row)
+            db.session.execute(insert(EventException.__table__), rows)
+            # Events from earlier batches are already synced: bump them so the
+            # new exceptions reach sync clients, as the occurrence routes do
+            db.session.execute(update(Event).where(
+                Event.id.in_({row['event_id'] for row in rows}), Event.version < version
+            ).values(version=version))
+            report['imported']['exceptions'] += len(rows)
+            pending_exceptions.clear()
+        db.session.commit()
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    try:
+        for line, record, error in records:
+            if error is None and record.get('type') == 'exception':
+                try:
+                    position, row = _exception_row(record, events)
+                    if (position, row['original_date']) in seen_exceptions:
+                        raise ValueError('duplicate exception for this event and original_date')
+                    seen_exceptions.add((position, row['original_date']))
+                    pending_exceptions.append((position, row))
+                    size += 1
+                except ValueError as e:
+                    error = str(e)
+            elif error is None:
+                kind = IMPORT_TYPES.get(record.get('type'))
+                if kind is None:
+                    error = 'type must be task, event or exception'
+                else:
+                    model, make_row = kind
+                    try:
+                        pending[model].append(make_row(record, user_id, now))
+                        size += 1
+                    except ValueError as e:
+                        error = str(e)
+                    if model is Event:
+                        events.append(0 if error else _PENDING_EVENT)
+                        if not error:
+                            pending_positions.append(len(events))
+            if error is not None:
+                report['error_count'] += 1
+                if len(report['errors']) < max_errors:
+                    report['errors'].append({'line': line, 'error': error})
+                continue
+            if size >= batch_size:
+                flush()
+                size = 0
+    except UnreadableInput as e:
+        report['stopped'] = {'line': e.line, 'error': e.message}
+    if size:
+        flush()
+    return report
@@ -0,0 +1,6 @@
+from app import create_app
+from app.asgi import create_asgi_app
+
+# Production entry point, e.g. `uvicorn asgi:app --workers 4`; see app/asgi.py
+# for what runs on the event loop and how to size workers, threads and pools
+app = create_asgi_app(create_app())
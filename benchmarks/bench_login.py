@@ -0,0 +1,72 @@
+"""Measure POST /auth/login throughput with 1, 2, 4 and 8 hashing processes.
+
+Logins are driven from a thread pool sized at twice the hashing workers,
+against a temporary SQLite file so request threads can share the database.
+Run with:
+
+    python benchmarks/bench_login.py [logins per run]
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import BenchmarkConfig
+from app import create_app
+from app.db import db
+from app.hashing import password_hasher
+from app.models import User
+
+USERS = 20
+PASSWORD = 'correct horse battery staple'
+
+
+def run(workers, logins, db_path):
+    class Config(BenchmarkConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+        PASSWORD_HASH_WORKERS = workers
+        PASSWORD_HASH_QUEUE_SIZE = 4 * workers
+
+    app = create_app(Config)
+    client = app.test_client()
+
+    def login(i):
+        return client.post('/auth/login', json={'email': f'user{i % USERS}@example.com', 'password': PASSWORD}).status_code
+
+    login(0)  # Start the pool outside the timed section
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2 * workers) as pool:
+        statuses = list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+    password_hasher.shutdown()
+
+    ok = statuses.count(200)
+    print(f'{workers} worker(s): {ok}/{logins} ok, {statuses.count(503)} shed, '
+          f'{ok / elapsed:,.1f} logins/sec')
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench_login.db')
+
+    class SeedConfig(BenchmarkConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+        PASSWORD_HASH_WORKERS = 0
+
+    app = create_app(SeedConfig)
+    with app.app_context():
+        db.create_all()
+        pwhash = password_hasher.hash(PASSWORD)
+        db.session.add_all(
+            User(username=f'user{i}', email=f'user{i}@example.com', password=pwhash) for i in range(USERS)
+        )
+        db.session.commit()
+
+    print(f'{os.cpu_count()} CPUs available')
+    for workers in (1, 2, 4, 8):
+        run(workers, logins, db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Expand 10k recurring series over a one-year window.
+
+Measures a cold expansion (nothing memoized), a warm one (the repeated
+month view case, served from expand()'s memo) and the number of rows the
+same data would need if every occurrence were stored separately. Run with:
+
+    python benchmarks/bench_recurrence.py [series]
+"""
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import common  # noqa: F401  (puts the repo on sys.path)
+from app.recurrence import expand, last_occurrence, parse_rrule
+
+RULES = [
+    'FREQ=DAILY',
+    'FREQ=DAILY;INTERVAL=3',
+    'FREQ=WEEKLY',
+    'FREQ=WEEKLY;BYDAY=MO,WE,FR',
+    'FREQ=WEEKLY;INTERVAL=2;BYDAY=TU,TH',
+    'FREQ=MONTHLY',
+    'FREQ=MONTHLY;COUNT=24',
+    'FREQ=YEARLY',
+    'FREQ=DAILY;UNTIL=20251231',
+]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rng = random.Random(42)
+    series = [
+        (rng.choice(RULES), date(2020, 1, 1) + timedelta(days=rng.randrange(5 * 365)))
+        for _ in range(n)
+    ]
+    window_start, window_end = date(2025, 1, 1), date(2025, 12, 31)
+
+    def run():
+        start = time.perf_counter()
+        total = 0
+        for rule, dtstart in series:
+            if dtstart <= window_end and last_occurrence(rule, dtstart) >= window_start:
+                total += len(expand(rule, dtstart, window_start, window_end))
+        return total, time.perf_counter() - start
+
+    expand.cache_clear()
+    last_occurrence.cache_clear()
+    parse_rrule.cache_clear()
+    occurrences, cold = run()
+    _, warm = run()
+
+    print(f'{n} series -> {occurrences:,} occurrences in {window_start.year}')
+    print(f'cold expansion: {cold * 1000:.1f} ms ({occurrences / cold:,.0f} occurrences/sec)')
+    print(f'warm (memoized): {warm * 1000:.1f} ms')
+    print(f'rows stored: {n:,} series vs {occurrences:,} for one year of duplicated events')
+
+
+if __name__ == '__main__':
+    main()
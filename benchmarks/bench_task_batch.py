@@ -0,0 +1,49 @@
+"""Compare POST /api/tasks:batch against the per-row task routes.
+
+Each round creates N tasks, updates all of them and deletes all of them,
+once through the single-row endpoints and once through one batch request
+per phase. Run with:
+
+    python benchmarks/bench_task_batch.py [N]
+
+Set BENCH_DATABASE_URI to point at MySQL instead of in-memory SQLite.
+"""
+import sys
+import time
+
+from common import make_app
+
+
+def per_row(client, headers, n):
+    ids = []
+    for i in range(n):
+        ids.append(client.post('/api/tasks', json={'title': f'task {i}'}, headers=headers).json['task_id'])
+    for task_id in ids:
+        client.put(f'/api/tasks/{task_id}', json={'completed': True}, headers=headers)
+    for task_id in ids:
+        client.delete(f'/api/tasks/{task_id}', headers=headers)
+
+
+def batched(client, headers, n):
+    def batch(operations):
+        return client.post('/api/tasks:batch', json={'operations': operations}, headers=headers).json['results']
+
+    ids = [r['id'] for r in batch([{'op': 'create', 'title': f'task {i}'} for i in range(n)])]
+    batch([{'op': 'update', 'id': task_id, 'completed': True} for task_id in ids])
+    batch([{'op': 'delete', 'id': task_id} for task_id in ids])
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    app, headers = make_app()
+    client = app.test_client()
+
+    for name, fn in (('per-row', per_row), ('batch', batched)):
+        start = time.perf_counter()
+        fn(client, headers, n)
+        elapsed = time.perf_counter() - start
+        print(f'{name:>8}: {3 * n} ops in {elapsed:.3f}s ({3 * n / elapsed:,.0f} ops/sec)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.config import Config
+from app.db import db
+from app.models import User
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.getenv('BENCH_DATABASE_URI', 'sqlite://')
+    # Identities are {'id': ...} dicts, which newer flask_jwt_extended rejects by default
+    JWT_VERIFY_SUB = False
+    # Benchmarks deliberately exceed per-client budgets
+    RATELIMIT_ENABLED = False
+
+
+def make_app(config_class=BenchmarkConfig):
+    """Create the app against a fresh schema and return (app, auth headers) for one user."""
+    app = create_app(config_class)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench', email='bench@example.com', password='unused')
+        db.session.add(user)
+        db.session.commit()
+        token = create_access_token(identity={'id': user.id})
+    return app, {'Authorization': f'Bearer {token}'}
@@ -0,0 +1,55 @@
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from app.config import Config
+from app.db import db
+from app.models import User
+
+
+class TestConfig(Config):
+    TESTING = True
+    JWT_SECRET_KEY = 'test-jwt-secret-key-of-at-least-32-bytes'
+    # Identities are {'id': ...} dicts, which newer flask_jwt_extended rejects by default
+    JWT_VERIFY_SUB = False
+    RATELIMIT_ENABLED = False
+    ADMISSION_MAX_CONCURRENT = 0
+    METRICS_ENABLED = False
+    PASSWORD_HASH_WORKERS = 0
+    JOB_QUEUE_BACKEND = 'inline'
+    SEARCH_BACKEND = 'memory'
+    DATABASE_REPLICA_URLS = []
+
+
+@pytest.fixture
+def app(tmp_path):
+    class Config(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        STORAGE_ROOT = str(tmp_path / 'storage')
+    app = create_app(Config)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    """Create a user and return (user id, auth headers)."""
+    def make(username='alice'):
+        user = User(username=username, email=f'{username}@example.com', password='unused')
+        db.session.add(user)
+        db.session.commit()
+        token = create_access_token(identity={'id': user.id})
+        return user.id, {'Authorization': f'Bearer {token}'}
+    return make
+
+
+@pytest.fixture
+def user(make_user):
+    return make_user()
@@ -0,0 +1,56 @@
+import os
+
+from sqlalchemy import select, func
+
+from app.db import db
+from app.models import User, Task, Upload
+from app.storage import storage
+
+PNG = b'\x89PNG\r\n\x1a\n'
+
+
+def upload(client, body, headers=None):
+    url = client.post('/api/upload', data=PNG + body, content_type='image/png', headers=headers).json['profile_picture']
+    return url[url.index('/media/') + len('/media/'):]
+
+
+def test_account_deletion_removes_rows_and_files_nobody_else_has(client, make_user):
+    user_id, headers = make_user('alice')
+    _, other_headers = make_user('bob')
+    client.post('/api/tasks:batch', json={'operations': [{'op': 'create', 'title': 't'}] * 5}, headers=headers)
+    picture = client.post('/auth/profile-picture', data=PNG + b'picture', content_type='image/png',
+                          headers={**headers, 'X-Filename': 'me.png'}).json['file_path']
+    own = upload(client, b'own', headers)
+    shared = upload(client, b'shared', headers)
+    assert upload(client, b'shared', other_headers) == shared
+    anonymous = upload(client, b'anonymous', headers)
+    assert upload(client, b'anonymous') == anonymous
+    for size in storage.thumbnail_sizes:
+        thumbnail = storage.full_path(storage.thumbnail_path(own, size))
+        os.makedirs(os.path.dirname(thumbnail), exist_ok=True)
+        open(thumbnail, 'wb').close()
+
+    response = client.delete('/auth/delete', headers=headers)
+    assert response.status_code == 202
+    assert client.get('/api/tasks', headers=headers).status_code == 401
+
+    assert db.session.get(User, user_id) is None
+    assert db.session.scalar(select(func.count()).select_from(Task)) == 0
+    assert db.session.scalar(select(func.count()).where(Upload.user_id == user_id)) == 0
+    assert not os.path.exists(storage.full_path(picture))
+    assert not os.path.exists(storage.full_path(own))
+    assert not any(os.path.exists(storage.full_path(storage.thumbnail_path(own, size)))
+                   for size in storage.thumbnail_sizes)
+    assert os.path.exists(storage.full_path(shared))
+    assert os.path.exists(storage.full_path(anonymous))
+
+
+def test_an_upload_after_deletion_writes_the_object_again(client, make_user):
+    _, headers = make_user('alice')
+    path = upload(client, b'again', headers)
+    client.delete('/auth/delete', headers=headers)
+    assert not os.path.exists(storage.full_path(path))
+
+    assert upload(client, b'again') == path
+
+    assert os.path.exists(storage.full_path(path))
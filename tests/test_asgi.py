@@ -0,0 +1,97 @@
+import asyncio
+import threading
+
+import fakeredis
+import httpx
+import pytest
+
+from app.asgi import create_asgi_app
+from app.cache import RedisBackend, response_cache
+from app.db import db
+from app.identity import identity
+from app.timeline import calendar
+
+
+@pytest.fixture
+def asgi_get(app):
+    asgi = create_asgi_app(app)
+
+    def get(url, headers):
+        async def run():
+            transport = httpx.ASGITransport(app=asgi)
+            async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as client:
+                return await client.get(url, headers=headers), threading.get_ident()
+        return asyncio.run(run())
+    return get
+
+
+def test_event_loop_views_check_tokens_off_the_loop(app, client, user, asgi_get, monkeypatch):
+    _, headers = user
+    client.post('/api/tasks', json={'title': 'one'}, headers=headers)
+    threads = []
+    is_jti_revoked = identity.denylist.is_jti_revoked
+    monkeypatch.setattr(identity.denylist, 'is_jti_revoked',
+                        lambda jti: threads.append(threading.get_ident()) or is_jti_revoked(jti))
+    app.extensions['rate_limiter'].enabled = True
+
+    response, loop_thread = asgi_get('/api/tasks', headers)
+
+    # The rate limiter's hook checks the token first, the view reuses its answer
+    assert threads and loop_thread not in threads
+    assert response.status_code == 200
+    assert response.content == client.get('/api/tasks', headers=headers).data
+
+
+def test_threaded_views_are_bridged_and_closed(client, asgi_get):
+    url = client.post('/api/upload', data=b'\x89PNG\r\n\x1a\n' + bytes(64), content_type='image/png').json['profile_picture']
+
+    response, _ = asgi_get(url, {})
+
+    assert response.status_code == 200
+    assert response.content.startswith(b'\x89PNG')
+
+
+def test_timeline_is_served_on_the_loop_once_its_buckets_are_loaded(client, user, asgi_get, monkeypatch):
+    user_id, headers = user
+    calendar.invalidate_user(user_id)
+    client.post('/api/events', json={'title': 'rent', 'event_date': '2026-02-28'}, headers=headers)
+    client.post('/api/events', json={'title': 'standup', 'event_date': '2026-02-02', 'rrule': 'FREQ=WEEKLY'},
+                headers=headers)
+
+    response, _ = asgi_get('/api/timeline?current_date=2026-02-14&view=month', headers)
+    assert response.status_code == 200
+    assert response.content == client.get('/api/timeline?current_date=2026-02-14&view=month', headers=headers).data
+
+    def no_loading(*args):
+        raise AssertionError('the buckets were reloaded')
+    monkeypatch.setattr(calendar, '_load_month', no_loading)
+    monkeypatch.setattr(calendar, '_load_series', no_loading)
+    response, _ = asgi_get('/api/timeline?from=2026-02-20&to=2026-02-28', headers)
+    assert [(e['event_date'], e['title']) for e in response.json()] == [
+        ('2026-02-23', 'standup'), ('2026-02-28', 'rent'),
+    ]
+    response, _ = asgi_get('/api/timeline?current_date=2026-02-14&view=year', headers)
+    assert response.status_code == 400
+
+
+def test_redis_cache_calls_and_teardown_run_off_the_loop(client, user, asgi_get, monkeypatch):
+    _, headers = user
+    client.post('/api/tasks', json={'title': 'one'}, headers=headers)
+    backend = RedisBackend(fakeredis.FakeRedis())
+    monkeypatch.setattr(response_cache, 'backend', backend)
+    threads = {'get': [], 'set': [], 'remove': []}
+
+    def record(name, fn):
+        return lambda *args: threads[name].append(threading.get_ident()) or fn(*args)
+    monkeypatch.setattr(backend, 'get', record('get', backend.get))
+    monkeypatch.setattr(backend, 'set', record('set', backend.set))
+    monkeypatch.setattr(db.session, 'remove', record('remove', db.session.remove))
+
+    first, loop_thread = asgi_get('/api/tasks', headers)
+    second, _ = asgi_get('/api/tasks', headers)
+
+    assert first.status_code == second.status_code == 200
+    assert second.content == first.content
+    assert backend.hits == 1
+    assert len(threads['get']) == 2 and len(threads['set']) == 1 and len(threads['remove']) == 2
+    assert loop_thread not in threads['get'] + threads['set'] + threads['remove']
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+from flask_jwt_extended import create_refresh_token, decode_token
+
+from app.hashing import password_hasher
+from app.identity import MemoryDenylist, identity
+
+
+@pytest.fixture
+def account(client, monkeypatch):
+    """Register alice and log in, returning the login response's tokens."""
+    monkeypatch.setattr(password_hasher, 'method', 'pbkdf2:sha256:1000')  # Fast enough to stay within a second
+    client.post('/auth/register', json={'username': 'alice', 'email': 'alice@example.com', 'password': 'old'})
+    return login(client, 'old')
+
+
+def login(client, password):
+    return client.post('/auth/login', json={'email': 'alice@example.com', 'password': password}).json
+
+
+def bearer(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def refresh(client, token):
+    return client.post('/auth/refresh', json={'refresh_token': token})
+
+
+def test_a_password_change_revokes_every_other_token_even_within_the_same_second(client, account):
+    # Start early in a second, so all the tokens below share it
+    time.sleep(1 - time.time() % 1)
+    other = login(client, 'old')
+
+    response = client.put('/auth/password', json={'current_password': 'old', 'new_password': 'new'},
+                          headers=bearer(account['access_token']))
+
+    assert response.status_code == 200
+    for tokens in (account, other):
+        assert client.get('/api/tasks', headers=bearer(tokens['access_token'])).status_code == 401
+        assert refresh(client, tokens['refresh_token']).status_code == 401
+    assert client.get('/api/tasks', headers=bearer(response.json['access_token'])).status_code == 200
+    assert refresh(client, response.json['refresh_token']).status_code == 200
+
+
+def test_logout_revokes_only_that_token(client, account):
+    other = login(client, 'old')
+
+    assert client.post('/auth/logout', headers=bearer(account['access_token'])).status_code == 200
+
+    assert client.get('/api/tasks', headers=bearer(account['access_token'])).status_code == 401
+    assert client.get('/api/tasks', headers=bearer(other['access_token'])).status_code == 200
+
+
+def test_refresh_takes_only_live_refresh_tokens(app, client, account):
+    assert refresh(client, account['access_token']).status_code == 401
+    response = refresh(client, account['refresh_token'])
+    assert response.status_code == 200
+    assert client.get('/api/tasks', headers=bearer(response.json['new_access_token'])).status_code == 200
+
+    identity.revoke_token(decode_token(account['refresh_token']))
+    assert refresh(client, account['refresh_token']).status_code == 401
+
+
+def test_deleted_users_are_dropped_from_the_cache_at_once(app, client, account):
+    user_id = identity.load_user(1).id
+    assert client.put('/auth/update', json={'username': 'alicia'},
+                      headers=bearer(account['access_token'])).status_code == 200
+    assert identity.load_user(user_id).username == 'alicia'
+
+    assert client.delete('/auth/delete', headers=bearer(account['access_token'])).status_code == 202
+    # Issued after the deletion, so only the user lookup can reject it
+    late = create_refresh_token(identity={'id': user_id})
+
+    assert identity.load_user(user_id) is None
+    assert refresh(client, late).status_code == 401
+
+
+def test_memory_denylist_forgets_entries_once_their_tokens_expired(monkeypatch):
+    denylist = MemoryDenylist(cutoff_ttl=100)
+    now = time.time()
+    denylist.revoke_user(1, now)
+    denylist.revoke_jti('old', now + 10)
+    denylist.revoke_jti('new', now + 1000)
+
+    monkeypatch.setattr(time, 'time', lambda: now + 200)
+    denylist.revoke_user(2, now + 200)
+
+    assert denylist.user_cutoff(1) is None
+    assert not denylist.is_jti_revoked('old')
+    assert denylist.is_jti_revoked('new')
+    assert denylist.user_cutoff(2) == now + 200
@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy import select, func, event
+
+from app.db import db
+from app.models import Task, Tombstone, User
+
+
+def batch(client, headers, operations):
+    response = client.post('/api/tasks:batch', json={'operations': operations}, headers=headers)
+    assert response.status_code == 200
+    return response.json['results']
+
+
+def test_mixed_operations_keep_request_order(client, user):
+    user_id, headers = user
+    first, second = batch(client, headers, [{'op': 'create', 'title': 'one'}, {'op': 'create', 'title': 'two'}])
+
+    results = batch(client, headers, [
+        {'op': 'update', 'id': first['id'], 'completed': True},
+        {'op': 'create', 'title': 'three', 'completed': True},
+        {'op': 'delete', 'id': second['id']},
+        {'op': 'create', 'title': 'four'},
+    ])
+
+    assert [r['status'] for r in results] == [200, 201, 200, 201]
+    assert results[0]['id'] == first['id'] and results[2]['id'] == second['id']
+    titles = dict(db.session.execute(select(Task.id, Task.title)).all())
+    assert titles == {first['id']: 'one', results[1]['id']: 'three', results[3]['id']: 'four'}
+    assert db.session.get(Task, first['id']).completed is True
+    assert db.session.get(Task, results[1]['id']).completed is True
+
+
+@pytest.mark.parametrize('returning', [True, False], ids=['returning', 'no-returning'])
+def test_creates_are_one_insert_stamped_with_the_batch_version(client, user, monkeypatch, returning):
+    user_id, headers = user
+    # MySQL has no INSERT ... RETURNING
+    monkeypatch.setattr(db.engine.dialect, 'insert_executemany_returning', returning)
+    (existing,) = batch(client, headers, [{'op': 'create', 'title': 'existing'}])
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        results = batch(client, headers, [{'op': 'update', 'id': existing['id'], 'title': 'updated'}]
+                        + [{'op': 'create', 'title': f'task {i}'} for i in range(50)])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert len([s for s in statements if s.lstrip().upper().startswith('INSERT INTO TASKS')]) == 1
+    version = db.session.get(User, user_id).change_version
+    rows = db.session.execute(select(Task.id, Task.title, Task.version).order_by(Task.id)).all()
+    assert [r['id'] for r in results[1:]] == [row.id for row in rows[1:]]
+    assert [row.title for row in rows] == ['updated'] + [f'task {i}' for i in range(50)]
+    assert {row.version for row in rows} == {version}
+
+
+def test_per_operation_errors_do_not_abort_the_batch(client, make_user):
+    _, headers = make_user('alice')
+    _, other_headers = make_user('bob')
+    (other,) = batch(client, other_headers, [{'op': 'create', 'title': 'not yours'}])
+    (mine,) = batch(client, headers, [{'op': 'create', 'title': 'mine'}])
+
+    results = batch(client, headers, [
+        {'op': 'rename', 'id': mine['id']},
+        {'op': 'create', 'title': ''},
+        {'op': 'update', 'id': True, 'completed': True},
+        {'op': 'update', 'id': '1', 'completed': True},
+        {'op': 'update', 'id': other['id'], 'title': 'stolen'},
+        {'op': 'update', 'id': mine['id'], 'completed': 'yes'},
+        {'op': 'delete', 'id': mine['id']},
+        {'op': 'update', 'id': mine['id'], 'title': 'too late'},
+        'not an object',
+    ])
+
+    assert [r['status'] for r in results] == [400, 400, 400, 400, 404, 400, 200, 404, 400]
+    assert results[2]['error'] == 'id must be an integer'
+    assert db.session.get(Task, mine['id']) is None
+    assert db.session.get(Task, other['id']).title == 'not yours'
+    assert db.session.scalar(select(func.count()).select_from(Tombstone)) == 1
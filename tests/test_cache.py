@@ -0,0 +1,93 @@
+import pytest
+
+from app.cache import MemoryBackend, RedisBackend, response_cache
+from app.db import db
+from app.models import Task
+from app.sync import current_version
+
+
+def redis_backend():
+    fakeredis = pytest.importorskip('fakeredis')
+    return RedisBackend(fakeredis.FakeRedis())
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def backend(request, app):
+    backend = MemoryBackend() if request.param == 'memory' else redis_backend()
+    response_cache.init_app(app, backend=backend)
+    return backend
+
+
+def hits(backend):
+    return backend.stats()['hits']
+
+
+def get(client, headers, url='/api/tasks'):
+    """GET url and read the body, which is only cached once fully sent."""
+    response = client.get(url, headers=headers)
+    response.get_data()
+    return response
+
+
+def test_repeated_reads_are_served_from_the_cache_with_their_headers(client, user, backend):
+    _, headers = user
+    client.post('/api/tasks:batch', json={'operations': [{'op': 'create', 'title': f't{i}'} for i in range(3)]},
+                headers=headers)
+    first = get(client, headers, '/api/tasks?limit=2')
+    before = hits(backend)
+
+    second = get(client, headers, '/api/tasks?limit=2')
+
+    assert hits(backend) == before + 1
+    assert second.data == first.data
+    assert second.headers['X-Next-Cursor'] == first.headers['X-Next-Cursor']
+    assert second.headers['Link'] == first.headers['Link']
+
+
+def test_a_commit_drops_only_the_writers_entries(client, make_user, backend):
+    alice, headers = make_user('alice')
+    _, other_headers = make_user('bob')
+    client.post('/api/tasks', json={'title': 'first'}, headers=headers)
+    get(client, headers)
+    get(client, other_headers)
+    old_key = f'tasks:{alice}:{current_version(alice)}:/api/tasks?'
+    assert backend.get(alice, old_key) is not None
+
+    client.post('/api/tasks', json={'title': 'second'}, headers=headers)
+
+    # Gone, not merely unreachable under the new version
+    assert backend.get(alice, old_key) is None
+    assert [t['title'] for t in get(client, headers).json] == ['second', 'first']
+    before = hits(backend)
+    get(client, other_headers)
+    assert hits(backend) == before + 1
+
+
+def test_writes_outside_a_request_invalidate_on_commit(client, user, backend):
+    user_id, headers = user
+    get(client, headers)
+    db.session.add(Task(title='from a job', user_id=user_id))
+    db.session.flush()
+    db.session.rollback()
+    before = hits(backend)
+    get(client, headers)
+    assert hits(backend) == before + 1  # A rollback leaves the entries alone
+
+    db.session.add(Task(title='from a job', user_id=user_id))
+    db.session.commit()
+
+    assert [t['title'] for t in get(client, headers).json] == ['from a job']
+    assert hits(backend) == before + 1
+
+
+def test_oversized_streamed_bodies_are_sent_but_not_stored(client, user, backend):
+    _, headers = user
+    client.post('/api/tasks:batch', json={'operations': [{'op': 'create', 'title': 'x' * 200}] * 20}, headers=headers)
+    response_cache.max_entry_bytes = 1000
+    first = get(client, headers)
+    before = hits(backend)
+
+    second = get(client, headers)
+
+    assert len(first.json) == len(second.json) == 20
+    assert hits(backend) == before
@@ -0,0 +1,25 @@
+from app.database import replicas
+from app.db import db
+from app.metrics import metrics
+
+
+def gauge_value(name):
+    prefix = f'{name}{{pool="primary"}} '
+    (line,) = [line for line in metrics.render().splitlines() if line.startswith(prefix)]
+    return float(line[len(prefix):])
+
+
+def test_pool_saturation_uses_the_configured_overflow(app):
+    config = app.config
+    assert db.engine.pool.max_connections == config['DB_POOL_SIZE'] + config['DB_MAX_OVERFLOW']
+
+    with db.engine.connect():
+        assert gauge_value('db_pool_saturation') == 1 / db.engine.pool.max_connections
+    # Disposing the engine builds a new pool with the same settings
+    db.engine.dispose()
+    assert db.engine.pool.max_connections == config['DB_POOL_SIZE'] + config['DB_MAX_OVERFLOW']
+
+
+def test_sticky_primary_cache_has_its_own_size(app):
+    assert replicas.sticky.max_entries == app.config['DB_REPLICA_STICKY_MAX_USERS']
+    assert replicas.sticky.ttl == app.config['DB_REPLICA_STICKY_SECONDS']
@@ -0,0 +1,55 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app.db import db
+from app.hashing import method_parameters, password_hasher
+from app.models import User
+
+
+@pytest.mark.parametrize('method, stored, rehash', [
+    ('pbkdf2:sha256:600000', 'pbkdf2:sha256:600000', False),
+    ('pbkdf2:sha256:600000', 'pbkdf2:sha256:260000', True),
+    ('pbkdf2:sha256:600000', 'pbkdf2:sha512:600000', True),
+    # Stronger hashes than configured are kept
+    ('pbkdf2:sha256:600000', 'pbkdf2:sha256:1000000', False),
+    ('scrypt:16384:8:1', 'scrypt:32768:8:1', False),
+    # Parameters werkzeug fills in count as configured
+    ('pbkdf2', 'pbkdf2:sha256:1000', True),
+    ('scrypt', 'scrypt:32768:8:1', False),
+    ('scrypt', 'scrypt:16384:8:1', True),
+    ('scrypt', 'scrypt:32768:4:1', True),
+    ('scrypt:32768:8:1', 'pbkdf2:sha256:600000', True),
+    ('pbkdf2', 'pbkdf2:sha256:many', True),
+])
+def test_needs_rehash_compares_every_parameter(app, monkeypatch, method, stored, rehash):
+    monkeypatch.setattr(password_hasher, 'method', method)
+    assert password_hasher.needs_rehash(f'{stored}$salt$hash') is rehash
+
+
+def test_defaulted_methods_match_what_werkzeug_writes(app, monkeypatch):
+    for method in ('pbkdf2', 'pbkdf2:sha256', 'scrypt'):
+        monkeypatch.setattr(password_hasher, 'method', method)
+        assert not password_hasher.needs_rehash(generate_password_hash('pw', method))
+
+
+def test_the_default_method_keeps_werkzeug_default_hashes(client):
+    stored = generate_password_hash('pw', 'pbkdf2:sha256:1000000')
+    user = User(username='alice', email='alice@example.com', password=stored)
+    db.session.add(user)
+    db.session.commit()
+
+    assert client.post('/auth/login', json={'email': 'alice@example.com', 'password': 'pw'}).status_code == 200
+    assert db.session.get(User, user.id, populate_existing=True).password == stored
+
+
+def test_login_upgrades_old_hashes_once(client):
+    user = User(username='alice', email='alice@example.com', password=generate_password_hash('pw', 'pbkdf2:sha256:1000'))
+    db.session.add(user)
+    db.session.commit()
+
+    assert client.post('/auth/login', json={'email': 'alice@example.com', 'password': 'pw'}).status_code == 200
+    upgraded = db.session.get(User, user.id, populate_existing=True).password
+    assert upgraded.startswith(method_parameters(password_hasher.method) + '$')
+
+    assert client.post('/auth/login', json={'email': 'alice@example.com', 'password': 'pw'}).status_code == 200
+    assert db.session.get(User, user.id, populate_existing=True).password == upgraded
@@ -0,0 +1,55 @@
+import pytest
+
+from app.instrumentation import REQUEST_SECONDS, REQUEST_SQL_QUERIES
+
+
+def sample(metric, name, labels):
+    """The value of one sample (e.g. http_request_sql_queries_sum) of a metric."""
+    for sample_name, sample_labels, value in metric.samples():
+        if sample_name == name and sample_labels == labels:
+            return value
+    return 0
+
+
+def test_streamed_body_queries_are_counted_when_the_response_closes(client, user):
+    _, headers = user
+    client.post('/api/tasks', json={'title': 'warm the identity cache'}, headers=headers)
+    labels = '{endpoint="api.export_data"}'
+    count = sample(REQUEST_SQL_QUERIES, 'http_request_sql_queries_count', labels)
+    total = sample(REQUEST_SQL_QUERIES, 'http_request_sql_queries_sum', labels)
+
+    response = client.get('/api/export', headers=headers)
+    assert sample(REQUEST_SQL_QUERIES, 'http_request_sql_queries_count', labels) == count
+    assert response.get_data(as_text=True).count('\n') == 1
+    response.close()
+
+    assert sample(REQUEST_SQL_QUERIES, 'http_request_sql_queries_count', labels) == count + 1
+    # The tasks, events and exceptions selects run while the body streams
+    assert sample(REQUEST_SQL_QUERIES, 'http_request_sql_queries_sum', labels) == total + 3
+
+
+def test_requests_that_raise_are_observed_as_500(app, client):
+    def boom():
+        raise RuntimeError('boom')
+    app.add_url_rule('/boom', 'boom', boom)
+    labels = '{method="GET",endpoint="boom",status="500"}'
+    before = sample(REQUEST_SECONDS, 'http_request_duration_seconds_count', labels)
+
+    with pytest.raises(RuntimeError):
+        client.get('/boom')
+
+    assert sample(REQUEST_SECONDS, 'http_request_duration_seconds_count', labels) == before + 1
+
+
+def test_server_timing_breaks_down_jwt_sql_and_serialization(app, client, user):
+    _, headers = user
+    app.config['SERVER_TIMING_ENABLED'] = True
+    app.extensions['instrumentation'].server_timing = True
+    client.post('/api/tasks', json={'title': 'one'}, headers=headers)
+
+    with client.get('/api/tasks/1', headers=headers) as response:
+        timing = response.headers['Server-Timing']
+
+    names = [entry.split(';')[0] for entry in timing.split(', ')]
+    assert names == ['jwt', 'sql', 'serialize', 'app']
+    assert 'desc="' in timing
@@ -0,0 +1,95 @@
+import time
+from datetime import datetime, timedelta
+
+from app import create_app
+from app.db import db
+from app.jobs import jobs
+from app.models import Job
+from tests.conftest import TestConfig
+
+runs = []
+
+
+@jobs.handler('test_record')
+def record(job, value):
+    runs.append(value)
+
+
+def add_job(status='queued', user_id=None, attempts=0, started_at=None, value=1):
+    job = jobs.enqueue('test_record', {'value': value}, user_id=user_id)
+    job.status, job.attempts, job.started_at = status, attempts, started_at
+    db.session.commit()
+    return job.id
+
+
+def test_expired_running_jobs_are_requeued_or_failed(app):
+    runs.clear()
+    long_ago = datetime.utcnow() - jobs.lease - timedelta(minutes=1)
+    lost = add_job('running', attempts=1, started_at=long_ago, value='lost')
+    exhausted = add_job('running', attempts=jobs.max_attempts, started_at=long_ago, value='exhausted')
+    live = add_job('running', attempts=1, started_at=datetime.utcnow(), value='live')
+
+    assert jobs.run_pending() == 1
+
+    assert runs == ['lost']
+    statuses = {job.id: (job.status, job.attempts) for job in db.session.scalars(db.select(Job))}
+    assert statuses[lost] == ('succeeded', 2)
+    assert statuses[exhausted] == ('failed', jobs.max_attempts)
+    assert statuses[live] == ('running', 1)
+
+
+def test_thread_backend_drains_jobs_queued_before_startup_on_its_first_request(app):
+    runs.clear()
+    job_id = add_job(value='left over')
+
+    class Restarted(TestConfig):
+        SQLALCHEMY_DATABASE_URI = app.config['SQLALCHEMY_DATABASE_URI']
+        STORAGE_ROOT = app.config['STORAGE_ROOT']
+        JOB_QUEUE_BACKEND = 'thread'
+    restarted = create_app(Restarted)
+    try:
+        with restarted.app_context():
+            time.sleep(0.2)
+            assert db.session.get(Job, job_id, populate_existing=True).status == 'queued'
+            db.session.rollback()
+            restarted.test_client().get('/api/tasks')
+            deadline = time.monotonic() + 5
+            while db.session.get(Job, job_id, populate_existing=True).status != 'succeeded':
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+                db.session.rollback()
+        assert runs == ['left over']
+    finally:
+        jobs.init_app(app)
+
+
+def test_job_status_is_only_shown_to_its_owner(client, make_user):
+    alice, alice_headers = make_user('alice')
+    _, bob_headers = make_user('bob')
+    job_id = add_job(user_id=alice)
+
+    assert client.get(f'/api/jobs/{job_id}').status_code == 401
+    assert client.get(f'/api/jobs/{job_id}', headers=bob_headers).status_code == 404
+    response = client.get(f'/api/jobs/{job_id}', headers=alice_headers)
+    assert response.status_code == 200
+    assert response.json['status'] == 'queued'
+
+
+def test_account_deletion_can_be_polled_to_completion_with_its_status_url(client, user, monkeypatch):
+    _, headers = user
+    client.post('/api/tasks', json={'title': 'one'}, headers=headers)
+    monkeypatch.setattr(jobs, 'backend', 'thread')
+
+    response = client.delete('/auth/delete', headers=headers)
+
+    assert response.status_code == 202
+    status_url = response.headers['Location']
+    assert response.json['status_url'] == status_url
+    assert client.get(status_url, headers=headers).status_code == 200  # The revoked JWT is not needed
+    deadline = time.monotonic() + 5
+    while (status := client.get(status_url).json)['status'] != 'succeeded':
+        assert status['status'] in ('queued', 'running') and time.monotonic() < deadline
+        time.sleep(0.05)
+    assert status['progress']['tasks'] == 1
+    forged = status_url.replace(response.json['job_id'], add_job())
+    assert client.get(forged).status_code == 404
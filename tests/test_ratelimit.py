@@ -0,0 +1,66 @@
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from app.identity import identity
+
+
+@pytest.fixture
+def limited(app):
+    limiter = app.extensions['rate_limiter']
+    limiter.enabled = True
+    yield limiter
+    limiter.enabled = False
+
+
+def remaining(response):
+    return int(response.headers['RateLimit-Remaining'])
+
+
+def test_tokens_of_one_user_share_a_budget_and_hit_the_denylist_once(app, client, user, limited, monkeypatch):
+    user_id, headers = user
+    other_device = {'Authorization': f"Bearer {create_access_token(identity={'id': user_id})}"}
+    lookups = []
+    is_jti_revoked = identity.denylist.is_jti_revoked
+    monkeypatch.setattr(identity.denylist, 'is_jti_revoked', lambda jti: lookups.append(jti) or is_jti_revoked(jti))
+
+    first = client.get('/api/tasks', headers=headers)
+    second = client.get('/api/tasks', headers=other_device)
+
+    assert first.status_code == second.status_code == 200
+    assert remaining(second) == remaining(first) - 1
+    assert len(lookups) == 2
+
+
+def test_invalid_tokens_fall_back_to_the_client_address(client, user, limited):
+    _, headers = user
+    client.get('/api/tasks', headers=headers)
+
+    first = client.get('/api/tasks', headers={'Authorization': 'Bearer not-a-token'})
+    second = client.get('/api/tasks')
+
+    assert first.status_code in (401, 422)
+    assert remaining(second) == remaining(first) - 1
+
+
+def test_forwarded_client_addresses_are_trusted_only_behind_a_proxy(app):
+    def addresses_share_a_bucket(proxies):
+        config = {**app.config, 'PROXY_FIX_X_FOR': proxies, 'RATELIMIT_ENABLED': True}
+        client = create_app(type('Config', (), config)).test_client()
+        first = client.get('/api/tasks', headers={'X-Forwarded-For': '203.0.113.1'})
+        second = client.get('/api/tasks', headers={'X-Forwarded-For': '203.0.113.2'})
+        return remaining(second) == remaining(first) - 1
+
+    assert addresses_share_a_bucket(0)
+    assert not addresses_share_a_bucket(1)
+
+
+def test_a_revoked_token_is_rejected_on_the_next_request(client, user, limited):
+    _, headers = user
+    assert client.get('/api/tasks', headers=headers).status_code == 200
+    assert client.post('/auth/logout', headers=headers).status_code == 200
+
+    response = client.get('/api/tasks', headers=headers)
+
+    assert response.status_code == 401
+    assert 'RateLimit-Remaining' in response.headers
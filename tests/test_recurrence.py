@@ -0,0 +1,83 @@
+import re
+from datetime import date
+
+import pytest
+
+from app.recurrence import FOREVER, MAX_COUNT, expand, last_occurrence, parse_rrule
+
+
+def test_monthly_on_the_31st_skips_shorter_months():
+    days = expand('FREQ=MONTHLY', date(2026, 1, 31), date(2026, 1, 1), date(2026, 12, 31))
+    assert [d.month for d in days] == [1, 3, 5, 7, 8, 10, 12]
+    assert {d.day for d in days} == {31}
+
+
+def test_yearly_on_february_29th_only_falls_in_leap_years():
+    days = expand('FREQ=YEARLY', date(2024, 2, 29), date(2024, 1, 1), date(2032, 12, 31))
+    assert days == (date(2024, 2, 29), date(2028, 2, 29), date(2032, 2, 29))
+
+
+def test_weekly_byday_with_interval_skips_weeks_and_days_before_the_start():
+    # A Wednesday: the Monday of the first week is before the series starts
+    days = expand('FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE,FR', date(2026, 1, 7), date(2026, 1, 1), date(2026, 1, 31))
+    assert days == (date(2026, 1, 7), date(2026, 1, 9), date(2026, 1, 19), date(2026, 1, 21), date(2026, 1, 23))
+
+
+def test_a_window_far_from_the_start_lands_on_the_series_phase():
+    days = expand('FREQ=DAILY;INTERVAL=3', date(2026, 1, 1), date(2030, 6, 1), date(2030, 6, 7))
+    assert all((d - date(2026, 1, 1)).days % 3 == 0 for d in days) and len(days) == 2
+
+
+@pytest.mark.parametrize('rule, dtstart, expected', [
+    ('FREQ=DAILY;COUNT=3', date(2026, 1, 30), date(2026, 2, 1)),
+    ('FREQ=WEEKLY;BYDAY=TU,TH;COUNT=4', date(2026, 1, 6), date(2026, 1, 15)),
+    # Skipped months do not count towards COUNT
+    ('FREQ=MONTHLY;COUNT=3', date(2026, 1, 31), date(2026, 5, 31)),
+    ('FREQ=WEEKLY;UNTIL=20260301', date(2026, 1, 1), date(2026, 3, 1)),
+    ('RRULE:FREQ=DAILY;UNTIL=2026-03-01T00:00:00Z', date(2026, 1, 1), date(2026, 3, 1)),
+    ('FREQ=YEARLY', date(2026, 1, 1), FOREVER),
+])
+def test_last_occurrence(rule, dtstart, expected):
+    assert last_occurrence(rule, dtstart) == expected
+
+
+def test_until_bounds_the_expansion():
+    days = expand('FREQ=DAILY;UNTIL=20260105', date(2026, 1, 1), date(2026, 1, 1), date(2026, 1, 31))
+    assert days[-1] == date(2026, 1, 5) and len(days) == 5
+
+
+@pytest.mark.parametrize('rule, message', [
+    ('FREQ=HOURLY', 'FREQ must be one of'),
+    ('FREQ=DAILY;COUNT=0', 'must be positive'),
+    (f'FREQ=DAILY;COUNT={MAX_COUNT + 1}', f'COUNT must be at most {MAX_COUNT}'),
+    ('FREQ=DAILY;COUNT=2;UNTIL=20260101', 'cannot both be set'),
+    ('FREQ=MONTHLY;BYDAY=MO', 'only supported with FREQ=WEEKLY'),
+    ('FREQ=WEEKLY;BYDAY=XX', 'BYDAY must list days'),
+    ('FREQ=DAILY;BYHOUR=9', 'Unsupported rrule part(s): BYHOUR'),
+])
+def test_invalid_rules(rule, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        parse_rrule(rule)
+
+
+def test_events_reject_rrules_that_are_not_strings(client, user):
+    _, headers = user
+    response = client.post('/api/events', json={'title': 'standup', 'event_date': '2026-01-05',
+                                                'rrule': ['FREQ=DAILY']}, headers=headers)
+    assert response.status_code == 400
+    assert response.json['error'] == 'rrule must be a string of at most 255 characters'
+
+    event_id = client.post('/api/events', json={'title': 'standup', 'event_date': '2026-01-05'},
+                           headers=headers).json['event_id']
+    response = client.put(f'/api/events/{event_id}', json={'rrule': {'FREQ': 'DAILY'}}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_recurring_events_expand_into_the_timeline(client, user):
+    _, headers = user
+    client.post('/api/events', json={'title': 'rent', 'event_date': '2026-01-31', 'rrule': 'FREQ=MONTHLY;COUNT=3'},
+                headers=headers)
+
+    response = client.get('/api/timeline?from=2026-01-01&to=2026-12-31', headers=headers)
+
+    assert [e['event_date'] for e in response.json] == ['2026-01-31', '2026-03-31', '2026-05-31']
@@ -0,0 +1,83 @@
+from sqlalchemy import select
+from sqlalchemy.dialects import mysql
+
+from app.models import Task
+from app.search import FulltextSearch, InvertedIndex, MemorySearch, search_index
+
+
+def ids(results):
+    return [(r['type'], r['id']) for r in results]
+
+
+def test_terms_match_as_prefixes_and_all_must_match():
+    index = InvertedIndex()
+    index.add('task', 1, 'Quarterly report draft')
+    index.add('task', 2, 'Report bug')
+    index.add('event', 3, 'Quarter planning', 'Review the report', event_date='2026-01-01')
+
+    # Equal title scores fall back to (type, id) order; description matches rank last
+    assert ids(index.search('rep', 10)) == [('task', 1), ('task', 2), ('event', 3)]
+    assert ids(index.search('quart rep', 10)) == [('task', 1), ('event', 3)]
+    assert ids(index.search('quart bug', 10)) == []
+    assert ids(index.search('rep', 10, types=('event',))) == [('event', 3)]
+
+
+def test_titles_outrank_descriptions_and_rare_terms_outrank_common_ones():
+    index = InvertedIndex()
+    index.add('event', 1, 'Standup', 'dentist after', event_date='2026-01-01')
+    index.add('event', 2, 'Dentist', None, event_date='2026-01-02')
+    for i in range(3, 6):
+        index.add('task', i, f'Call mum {i}')
+    index.add('task', 6, 'Call dentist')
+
+    assert ids(index.search('dentist', 10)) == [('event', 2), ('task', 6), ('event', 1)]
+    ranked = index.search('call', 10)
+    assert ranked[0]['score'] == ranked[-1]['score']
+    assert index.search('dentist', 10)[0]['score'] > ranked[0]['score']
+
+
+def test_removed_documents_and_their_terms_are_gone():
+    index = InvertedIndex()
+    index.add('task', 1, 'alpha beta')
+    index.add('task', 1, 'alpha gamma')
+    index.remove('task', 2)
+
+    assert ids(index.search('beta', 10)) == []
+    assert 'beta' not in index.postings
+    index.remove('task', 1)
+    assert index.postings == {} and index.search('alpha', 10) == []
+
+
+def test_commits_update_a_built_index_in_place(app, client, user, monkeypatch):
+    user_id, headers = user
+    backend = MemorySearch()
+    monkeypatch.setattr(search_index, 'backend', backend)
+    task_id = client.post('/api/tasks', json={'title': 'buy milk'}, headers=headers).json['task_id']
+    assert ids(client.get('/api/search?q=milk', headers=headers).json) == [('task', task_id)]
+    builds = []
+    build = backend.build
+    monkeypatch.setattr(backend, 'build', lambda user_id: builds.append(user_id) or build(user_id))
+
+    client.put(f'/api/tasks/{task_id}', json={'title': 'buy bread'}, headers=headers)
+    event_id = client.post('/api/events', json={'title': 'milk run', 'event_date': '2026-01-05'},
+                           headers=headers).json['event_id']
+
+    assert ids(client.get('/api/search?q=milk', headers=headers).json) == [('event', event_id)]
+    assert ids(client.get('/api/search?q=bread', headers=headers).json) == [('task', task_id)]
+    client.delete(f'/api/tasks/{task_id}', headers=headers)
+    assert client.get('/api/search?q=bread', headers=headers).json == []
+    assert builds == []
+
+
+def test_fulltext_matches_unindexed_terms_with_like():
+    backend = FulltextSearch(min_token_size=3, stopwords={'the', 'with'})
+    assert backend.split_terms(['lunch', 'with', 'jo', 'the_team']) == (['lunch', 'the_team'], ['with', 'jo'])
+
+    score, conditions = backend._conditions((Task.title,), ['lunch'], ['jo'])
+    sql = select(Task.id, score).where(*conditions).compile(dialect=mysql.dialect())
+    assert "AGAINST (%s IN BOOLEAN MODE)" in str(sql)
+    assert '+lunch*' in sql.params.values()
+    assert "LIKE concat('%%', %s, '%%')" in str(sql) and 'jo' in sql.params.values()
+
+    score, conditions = backend._conditions((Task.title,), [], ['jo'])
+    assert 'MATCH' not in str(select(Task.id, score).where(*conditions).compile(dialect=mysql.dialect()))
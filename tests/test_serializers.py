@@ -0,0 +1,35 @@
+from datetime import date, datetime
+
+import orjson
+
+from app.models import Event, Task
+from app.serializers import JSONProvider, Serializer, iter_json_array, serialize_event, serialize_task
+
+
+def test_fields_are_read_in_order_and_converters_skip_none():
+    event = Event(id=3, title='t', description=None, event_date=date(2026, 2, 1), rrule=None,
+                  created_at=datetime(2026, 1, 1, 9), updated_at=None)
+    assert serialize_event(event) == {
+        'id': 3, 'title': 't', 'description': None, 'event_date': '2026-02-01', 'rrule': None,
+        'created_at': datetime(2026, 1, 1, 9), 'updated_at': None,
+    }
+    assert Serializer(('event_date',), {'event_date': date.isoformat})(Event(event_date=None)) == {'event_date': None}
+
+
+def test_subsets_are_built_once_and_a_single_field_still_gives_a_dict():
+    task = Task(id=1, title='t', completed=True)
+    only_title = serialize_task.only(['title'])
+    assert only_title is serialize_task.only(('title',))
+    assert serialize_task.only(serialize_task.fields) is serialize_task
+    assert only_title(task) == {'title': 't'}
+    assert serialize_task.only(['id', 'completed']).many([task, task]) == [{'id': 1, 'completed': True}] * 2
+
+
+def test_streamed_arrays_match_one_shot_encoding(app):
+    tasks = [Task(id=i, title=f'task {i}', completed=False, created_at=datetime(2026, 1, 1), updated_at=None)
+             for i in range(7)]
+    expected = orjson.loads(orjson.dumps(serialize_task.many(tasks)))
+    for provider in (app.json, JSONProvider(app)):
+        app.json = provider
+        assert orjson.loads(''.join(iter_json_array(tasks, serialize_task, chunk_size=3))) == expected
+    assert ''.join(iter_json_array([], serialize_task)) == '[]'
@@ -0,0 +1,128 @@
+import importlib
+import io
+import os
+
+import pytest
+from sqlalchemy import select, func
+
+from app.db import db
+from app.models import Upload
+from app.storage import storage
+
+PNG = b'\x89PNG\r\n\x1a\n'
+
+# The module, which the app package's storage instance shadows as an attribute
+storage_module = importlib.import_module('app.storage')
+
+
+def objects():
+    found = []
+    for directory, _, files in os.walk(os.path.join(storage.root, 'objects')):
+        found.extend(os.path.join(directory, name) for name in files)
+    return found
+
+
+def test_identical_uploads_share_one_object(client, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(storage, '_schedule_thumbnails', scheduled.append)
+
+    first = client.post('/api/upload', data=PNG + b'same', content_type='image/png').json['profile_picture']
+    second = client.post('/api/upload', data={'profile_picture': (io.BytesIO(PNG + b'same'), 'copy.png')},
+                         content_type='multipart/form-data').json['profile_picture']
+    other = client.post('/api/upload', data=PNG + b'other', content_type='image/png').json['profile_picture']
+
+    assert first == second != other
+    assert len(objects()) == 2
+    assert db.session.scalar(select(func.count()).select_from(Upload)) == 3
+    # Thumbnails are only rendered for new objects
+    assert len(scheduled) == 2
+    assert os.listdir(os.path.join(storage.root, 'tmp')) == []
+
+
+def test_multipart_files_stream_without_spooling(app, client, monkeypatch):
+    def spool(*args, **kwargs):
+        raise AssertionError('request.files spooled the upload')
+    monkeypatch.setattr(app.request_class, '_get_file_stream', spool)
+    body = PNG + os.urandom(1024 * 1024)
+
+    response = client.post('/api/upload', data={
+        'note': 'before the file',
+        'profile_picture': (io.BytesIO(body), 'big.png', 'image/png'),
+        'after': (io.BytesIO(b'ignored'), 'after.txt'),
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    with open(objects()[0], 'rb') as f:
+        assert f.read() == body
+
+
+@pytest.mark.parametrize('multipart', [False, True])
+def test_uploads_over_the_size_limit_are_rejected_and_not_kept(client, monkeypatch, multipart):
+    monkeypatch.setattr(storage, 'max_bytes', 1000)
+    body = PNG + b'x' * 1000
+    if multipart:
+        response = client.post('/api/upload', data={'profile_picture': (io.BytesIO(body), 'big.png')},
+                               content_type='multipart/form-data')
+    else:
+        response = client.post('/api/upload', data=body, content_type='image/png')
+
+    assert response.status_code == 413
+    assert response.json['message'] == 'File too large'
+    assert objects() == []
+    assert os.listdir(os.path.join(storage.root, 'tmp')) == []
+    assert db.session.scalar(select(func.count()).select_from(Upload)) == 0
+
+
+def test_disallowed_types_and_malformed_multipart_are_rejected(client):
+    assert client.post('/api/upload', data=b'MZ', content_type='image/x-exe').status_code == 415
+    response = client.post('/api/upload', data=b'--b\r\nnot a part',
+                           content_type='multipart/form-data; boundary=b')
+    assert response.status_code == 400
+
+
+class FakeImage:
+    """Stands in for Pillow, which is optional: records the sizes it renders."""
+
+    def __init__(self, size=(1024, 768)):
+        self.size = size
+
+    @classmethod
+    def open(cls, path):
+        return cls()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def convert(self, mode):
+        return self
+
+    def copy(self):
+        return FakeImage(self.size)
+
+    def thumbnail(self, box):
+        scale = min(box[0] / self.size[0], box[1] / self.size[1], 1)
+        self.size = (round(self.size[0] * scale), round(self.size[1] * scale))
+
+    def save(self, path, format, quality):
+        with open(path, 'w') as f:
+            f.write(f'{format} {self.size[0]}x{self.size[1]}')
+
+
+def test_thumbnails_are_rendered_in_the_background_for_each_size(client, monkeypatch):
+    monkeypatch.setattr(storage_module, 'Image', FakeImage)
+    monkeypatch.setattr(storage, '_executor_workers', 1)
+
+    url = client.post('/api/upload', data=PNG + b'picture', content_type='image/png').json['profile_picture']
+    storage._executor.shutdown(wait=True)
+    storage._executor = None
+
+    path = url[url.index('/media/') + len('/media/'):]
+    for size in storage.thumbnail_sizes:
+        thumbnail = storage.full_path(storage.thumbnail_path(path, size))
+        with open(thumbnail) as f:
+            assert f.read() == f'JPEG {size}x{round(size * 0.75)}'
+        assert not any(name.endswith('.tmp') for name in os.listdir(os.path.dirname(thumbnail)))
+        assert client.get(f'/api/media/{storage.thumbnail_path(path, size)}').status_code == 200
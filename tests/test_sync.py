@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app.db import db
+from app.models import Tombstone
+
+
+def sync(client, headers, since, **params):
+    response = client.get('/api/sync', query_string={'since': since, **params}, headers=headers)
+    assert response.status_code == 200
+    return response.json
+
+
+def create(client, headers, title):
+    return client.post('/api/tasks', json={'title': title}, headers=headers).json['task_id']
+
+
+def test_changes_since_a_version_include_updates_and_deletions(client, user):
+    _, headers = user
+    first, second = create(client, headers, 'one'), create(client, headers, 'two')
+    event_id = client.post('/api/events', json={'title': 'e', 'event_date': '2026-01-01'}, headers=headers).json['event_id']
+
+    full = sync(client, headers, 0)
+    assert sorted(t['id'] for t in full['tasks']) == [first, second]
+    assert [e['id'] for e in full['events']] == [event_id]
+    assert full['next_since'] is None
+
+    client.put(f'/api/tasks/{first}', json={'completed': True}, headers=headers)
+    client.delete(f'/api/tasks/{second}', headers=headers)
+    delta = sync(client, headers, full['version'])
+    assert [(t['id'], t['completed']) for t in delta['tasks']] == [(first, True)]
+    assert delta['deleted'] == {'tasks': [second], 'events': []}
+    assert delta['events'] == []
+
+    caught_up = sync(client, headers, delta['version'])
+    assert caught_up['version'] == delta['version'] and caught_up['tasks'] == []
+
+
+def test_pages_follow_next_since_without_splitting_a_version(client, user):
+    _, headers = user
+    singles = [create(client, headers, f'task {i}') for i in range(3)]
+    batch = client.post('/api/tasks:batch', json={'operations': [{'op': 'create', 'title': 'b'}] * 4},
+                        headers=headers).json['results']
+    client.delete(f'/api/tasks/{singles[0]}', headers=headers)
+
+    pages, since = [], 0
+    while since is not None:
+        page = sync(client, headers, since, limit=2)
+        pages.append(page)
+        since = page['next_since']
+
+    assert [len(page['tasks']) + len(page['deleted']['tasks']) for page in pages] == [2, 4, 1]
+    assert sorted(t['id'] for page in pages for t in page['tasks']) == singles[1:] + [r['id'] for r in batch]
+    assert pages[-1]['deleted']['tasks'] == [singles[0]]
+    assert [page['version'] for page in pages[:-1]] == [page['next_since'] for page in pages[:-1]]
+
+
+def test_syncing_from_before_pruned_tombstones_requires_a_full_resync(app, client, user):
+    _, headers = user
+    kept, gone = create(client, headers, 'kept'), create(client, headers, 'gone')
+    before_delete = sync(client, headers, 0)['version']
+    client.delete(f'/api/tasks/{gone}', headers=headers)
+    after_delete = sync(client, headers, before_delete)['version']
+    db.session.execute(update(Tombstone).values(deleted_at=datetime.utcnow() - timedelta(days=365)))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['sync', 'prune-tombstones'])
+    assert result.output == '1 tombstone(s) pruned\n'
+
+    response = client.get('/api/sync', query_string={'since': before_delete}, headers=headers)
+    assert response.status_code == 410
+    assert response.json['error'] == 'Full resync required'
+    assert [t['id'] for t in sync(client, headers, 0)['tasks']] == [kept]
+    assert sync(client, headers, after_delete)['deleted']['tasks'] == []
+
+
+def test_each_request_looks_up_its_own_users_version(client, make_user):
+    alice, headers = make_user('alice')
+    bob, other_headers = make_user('bob')
+    create(client, headers, 'one')
+
+    # The tests share one app context, and with it g, across requests
+    assert client.get('/api/tasks', headers=headers).headers['ETag'].startswith(f'W/"{alice}-1-')
+    assert client.get('/api/tasks', headers=other_headers).headers['ETag'].startswith(f'W/"{bob}-0-')
+    create(client, headers, 'two')
+    assert client.get('/api/tasks', headers=headers).headers['ETag'].startswith(f'W/"{alice}-2-')
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import update
+
+from app.db import db
+from app.models import Task
+from app.queries import decode_cursor, encode_cursor
+
+
+def create_tasks(client, headers, count):
+    return [client.post('/api/tasks', json={'title': f'task {i}', 'completed': i % 3 == 0}, headers=headers).json['task_id']
+            for i in range(count)]
+
+
+def walk(client, headers, url):
+    """Follow next-page cursors from url, returning the pages' task lists."""
+    pages = []
+    while url is not None:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        pages.append(response.json)
+        link = response.headers.get('Link')
+        if link is None:
+            assert 'X-Next-Cursor' not in response.headers
+            url = None
+        else:
+            url = link[1:link.index('>')].removeprefix('http://localhost')
+            assert f"cursor={response.headers['X-Next-Cursor']}" in url
+    return pages
+
+
+def test_cursor_round_trips():
+    updated_at = datetime(2026, 3, 1, 12, 30, 5, 123456)
+    cursor = encode_cursor(updated_at, 42)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (updated_at, 42)
+
+
+@pytest.mark.parametrize('cursor', ['x', 'not base64!', encode_cursor(datetime(2026, 1, 1), 1)[:-4], 'WyJ4IiwgMV0'])
+def test_malformed_cursors_are_rejected(client, user, cursor):
+    _, headers = user
+    response = client.get('/api/tasks', query_string={'cursor': cursor}, headers=headers)
+    assert response.status_code == 400
+    assert response.json['error'] == 'Invalid cursor'
+
+
+def test_pages_cover_every_task_once_across_updated_at_ties(client, user):
+    _, headers = user
+    ids = create_tasks(client, headers, 23)
+    # Most rows share one timestamp, so the id breaks the ties
+    tie = datetime(2026, 1, 1)
+    db.session.execute(update(Task).where(Task.id.in_(ids[:15])).values(updated_at=tie))
+    db.session.commit()
+
+    pages = walk(client, headers, '/api/tasks?limit=4')
+
+    assert [len(page) for page in pages] == [4, 4, 4, 4, 4, 3]
+    listed = [task['id'] for page in pages for task in page]
+    assert listed == sorted(ids[15:], reverse=True) + sorted(ids[:15], reverse=True)
+
+
+def test_next_links_keep_the_filters_and_fields(client, user):
+    _, headers = user
+    ids = create_tasks(client, headers, 12)
+
+    pages = walk(client, headers, '/api/tasks?limit=3&completed=false&fields=id,title')
+
+    listed = [task for page in pages for task in page]
+    assert {tuple(task) for task in listed} == {('id', 'title')}
+    assert [task['id'] for task in listed] == sorted((i for n, i in enumerate(ids) if n % 3), reverse=True)
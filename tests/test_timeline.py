@@ -0,0 +1,132 @@
+from datetime import date
+
+import pytest
+
+from app import sync
+from app.sync import current_version
+from app.timeline import EVENT_OVERHEAD_BYTES, EventCalendar, calendar
+
+
+@pytest.fixture
+def events_calendar(app, monkeypatch):
+    """A fresh EventCalendar that receives this test's commits."""
+    fresh = EventCalendar()
+    monkeypatch.setattr(sync, '_commit_listeners', sync._commit_listeners + [fresh.apply_changes])
+    return fresh
+
+
+def count_loads(monkeypatch, events_calendar):
+    loads = {'months': [], 'series': 0}
+    load_month, load_series = events_calendar._load_month, events_calendar._load_series
+
+    def month(user_id, year, month):
+        loads['months'].append((year, month))
+        return load_month(user_id, year, month)
+
+    def series(user_id):
+        loads['series'] += 1
+        return load_series(user_id)
+    monkeypatch.setattr(events_calendar, '_load_month', month)
+    monkeypatch.setattr(events_calendar, '_load_series', series)
+    return loads
+
+
+def create_event(client, headers, title, event_date, **fields):
+    return client.post('/api/events', json={'title': title, 'event_date': event_date, **fields},
+                       headers=headers).json['event_id']
+
+
+def between(events_calendar, user_id, start, end):
+    events = events_calendar.events_between(user_id, start, end, current_version(user_id))
+    return [(e['event_date'], e['title']) for e in events]
+
+
+def test_week_and_month_views_around_current_date(client, user):
+    user_id, headers = user
+    calendar.invalidate_user(user_id)
+    for day in ('2026-02-01', '2026-02-02', '2026-02-08', '2026-02-09', '2026-02-28', '2026-03-01'):
+        create_event(client, headers, day, day)
+    create_event(client, headers, 'standup', '2026-01-26', rrule='FREQ=WEEKLY')
+
+    def timeline(**args):
+        response = client.get('/api/timeline', query_string=args, headers=headers)
+        assert response.status_code == 200
+        return [(e['event_date'], e['title']) for e in response.json]
+
+    # A Wednesday: the week runs Monday to Sunday
+    assert timeline(current_date='2026-02-04', view='week') == [
+        ('2026-02-02', '2026-02-02'), ('2026-02-02', 'standup'), ('2026-02-08', '2026-02-08'),
+    ]
+    assert timeline(current_date='2026-02-14', view='month') == [
+        ('2026-02-01', '2026-02-01'), ('2026-02-02', '2026-02-02'), ('2026-02-02', 'standup'),
+        ('2026-02-08', '2026-02-08'), ('2026-02-09', '2026-02-09'), ('2026-02-09', 'standup'),
+        ('2026-02-16', 'standup'), ('2026-02-23', 'standup'), ('2026-02-28', '2026-02-28'),
+    ]
+    response = client.get('/api/timeline?current_date=2026-02-14&view=year', headers=headers)
+    assert response.status_code == 400
+
+
+def test_buckets_are_reused_until_the_version_moves(client, user, events_calendar, monkeypatch):
+    user_id, headers = user
+    create_event(client, headers, 'rent', '2026-02-28')
+    loads = count_loads(monkeypatch, events_calendar)
+    version = current_version(user_id)
+
+    for _ in range(3):
+        events = events_calendar.events_between(user_id, date(2026, 2, 15), date(2026, 3, 15), version)
+    assert [e['title'] for e in events] == ['rent']
+    assert loads == {'months': [(2026, 2), (2026, 3)], 'series': 1}
+
+    # A write this process did not see, e.g. made by another worker
+    events_calendar.events_between(user_id, date(2026, 2, 15), date(2026, 3, 15), version + 1)
+    assert loads == {'months': [(2026, 2), (2026, 3)] * 2, 'series': 2}
+
+
+def test_committed_writes_are_applied_to_loaded_buckets(client, user, events_calendar, monkeypatch):
+    user_id, headers = user
+    rent = create_event(client, headers, 'rent', '2026-02-28')
+    gym = create_event(client, headers, 'gym', '2026-02-10')
+    create_event(client, headers, 'standup', '2026-02-02', rrule='FREQ=WEEKLY;COUNT=2')
+    loads = count_loads(monkeypatch, events_calendar)
+    assert len(between(events_calendar, user_id, date(2026, 2, 1), date(2026, 3, 31))) == 4
+
+    client.put(f'/api/events/{rent}', json={'title': 'rent', 'event_date': '2026-03-01'}, headers=headers)
+    client.delete(f'/api/events/{gym}', headers=headers)
+    create_event(client, headers, 'dentist', '2026-02-12')
+
+    assert between(events_calendar, user_id, date(2026, 2, 1), date(2026, 3, 31)) == [
+        ('2026-02-02', 'standup'), ('2026-02-09', 'standup'), ('2026-02-12', 'dentist'), ('2026-03-01', 'rent'),
+    ]
+    assert loads == {'months': [(2026, 2), (2026, 3)], 'series': 1}
+
+    # A new series drops the user's series, not the month buckets
+    create_event(client, headers, 'review', '2026-03-02', rrule='FREQ=MONTHLY;COUNT=1')
+    assert len(between(events_calendar, user_id, date(2026, 2, 1), date(2026, 3, 31))) == 5
+    assert loads == {'months': [(2026, 2), (2026, 3)], 'series': 2}
+
+
+def test_buckets_are_evicted_past_the_byte_budget(client, user, events_calendar):
+    user_id, headers = user
+    for month in range(1, 7):
+        create_event(client, headers, 'x' * 1000, f'2026-{month:02}-01')
+    version = current_version(user_id)
+    events_calendar.max_bytes = 3 * (EVENT_OVERHEAD_BYTES + 1000)
+
+    for month in range(1, 7):
+        events_calendar.events_between(user_id, date(2026, month, 1), date(2026, month, 28), version)
+
+    assert [key[1:] for key in events_calendar._buckets] == [(2026, 4), (2026, 5), (2026, 6)]
+    assert events_calendar._bytes == events_calendar.max_bytes
+    events_calendar.invalidate_user(user_id)
+    assert events_calendar._bytes == 0
+
+
+def test_series_are_capped_by_their_own_user_count(client, make_user, events_calendar):
+    events_calendar.max_series_users = 2
+    users = [make_user(name)[0] for name in ('alice', 'bob', 'carol')]
+
+    for user_id in users:
+        events_calendar.events_between(user_id, date(2026, 1, 1), date(2026, 1, 31), current_version(user_id))
+
+    assert list(events_calendar._series) == users[1:]
+    assert len(events_calendar._buckets) == 3
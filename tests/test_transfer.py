@@ -0,0 +1,105 @@
+import orjson
+import pytest
+from sqlalchemy import select
+
+from app.db import db
+from app.models import Task, Event, EventException
+
+
+def ndjson(*records):
+    return b''.join(orjson.dumps(record) + b'\n' for record in records)
+
+
+def post_import(client, headers, body, content_type='application/x-ndjson'):
+    return client.post('/api/import', data=body, headers={**headers, 'Content-Type': content_type})
+
+
+def titles():
+    return db.session.scalars(select(Task.title).order_by(Task.id)).all()
+
+
+def exceptions(user_id):
+    return db.session.execute(
+        select(Event.title, EventException.original_date, EventException.cancelled, EventException.title,
+               EventException.event_date)
+        .join(Event).where(Event.user_id == user_id).order_by(Event.title, EventException.original_date)
+    ).all()
+
+
+@pytest.mark.parametrize('fmt', ['ndjson', 'csv'])
+def test_export_round_trips_through_import(app, client, make_user, fmt):
+    alice, headers = make_user('alice')
+    bob, other_headers = make_user('bob')
+    client.post('/api/tasks:batch', json={'operations': [{'op': 'create', 'title': f'task {i}'} for i in range(3)]},
+                headers=headers)
+    for title in ('rent', 'gym'):
+        event_id = client.post('/api/events', json={'title': title, 'event_date': '2026-01-31', 'rrule': 'FREQ=MONTHLY'},
+                               headers=headers).json['event_id']
+    client.delete(f'/api/events/{event_id}/occurrences/2026-03-31', headers=headers)
+    client.put(f'/api/events/{event_id}/occurrences/2026-05-31', json={'title': 'gym (moved)', 'event_date': '2026-06-01'},
+               headers=headers)
+    # One per batch, so the exceptions land in a later batch than their event
+    app.config['IMPORT_BATCH_SIZE'] = 1
+
+    exported = client.get(f'/api/export?format={fmt}', headers=headers).data
+    response = client.post(f'/api/import?format={fmt}', data=exported, headers=other_headers)
+
+    assert response.status_code == 200
+    assert response.json['imported'] == {'tasks': 3, 'events': 2, 'exceptions': 2}
+    assert response.json['stopped'] is None
+    assert exceptions(bob) == exceptions(alice) and len(exceptions(bob)) == 2
+    synced = client.get('/api/sync?since=0', headers=other_headers).json
+    assert len(synced['event_exceptions']) == 2
+
+
+def test_exceptions_must_follow_an_imported_event(client, user):
+    _, headers = user
+    body = ndjson(
+        {'type': 'exception', 'event': 1, 'original_date': '2026-01-01'},
+        {'type': 'event', 'title': 'e', 'event_date': 'soon'},
+        {'type': 'event', 'title': 'e', 'event_date': '2026-01-01', 'rrule': 'FREQ=DAILY'},
+        {'type': 'exception', 'event': 1, 'original_date': '2026-01-01'},
+        {'type': 'exception', 'event': 2, 'original_date': '2026-01-02', 'cancelled': True},
+        {'type': 'exception', 'event': 2, 'original_date': '2026-01-02'},
+    )
+
+    report = post_import(client, headers, body).json
+
+    assert report['imported'] == {'tasks': 0, 'events': 1, 'exceptions': 1}
+    assert [e['line'] for e in report['errors']] == [1, 2, 4, 6]
+
+
+def test_invalid_records_are_skipped_and_reported_by_line(client, user):
+    _, headers = user
+    body = ndjson({'type': 'task', 'title': 'one'}) + b'{bad json\n\n' + ndjson(
+        {'type': 'note'}, {'type': 'event', 'title': 'e', 'event_date': 'soon'}, {'type': 'task', 'title': 'two'})
+
+    report = post_import(client, headers, body).json
+
+    assert report['imported'] == {'tasks': 2, 'events': 0, 'exceptions': 0}
+    assert [e['line'] for e in report['errors']] == [2, 4, 5]
+    assert titles() == ['one', 'two']
+
+
+@pytest.mark.parametrize('content_type, head, broken, error', [
+    ('application/x-ndjson', b'', b'{"type": "task", "title": "caf\xe9"}\n', 'The file must be UTF-8 encoded'),
+    ('text/csv', b'type,title\n', b'task,' + b'x' * 200000 + b'\n', 'Invalid CSV: field larger than field limit (131072)'),
+])
+def test_unreadable_input_keeps_earlier_batches_and_reports_where_it_stopped(
+        app, client, user, content_type, head, broken, error):
+    _, headers = user
+    app.config['IMPORT_BATCH_SIZE'] = 10
+    if content_type == 'text/csv':
+        rows = b''.join(b'task,row %d\n' % i for i in range(25))
+    else:
+        rows = ndjson(*({'type': 'task', 'title': f'row {i}'} for i in range(25)))
+    # Past the text decoder's read-ahead, so the first rows are parsed before it fails
+    padding = (b'\n' * 20000) if content_type != 'text/csv' else b''
+
+    response = post_import(client, headers, head + rows + padding + broken, content_type)
+
+    assert response.status_code == 400
+    assert response.json['error'] == error
+    assert response.json['imported'] == {'tasks': 25, 'events': 0, 'exceptions': 0}
+    assert response.json['stopped']['line'] > 25
+    assert titles() == [f'row {i}' for i in range(25)]